@@ -0,0 +1,3 @@
+"""
+    Lets the tests import the app as "src" when pytest runs from here
+"""
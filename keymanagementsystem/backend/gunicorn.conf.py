@@ -0,0 +1,88 @@
+"""
+    Production server settings. Run with:
+
+        gunicorn -c gunicorn.conf.py wsgi:app
+
+    Every setting can be changed through the environment variables below.
+    See the README for sizing the workers against the MongoDB pool
+"""
+
+# Import libraries
+import multiprocessing
+import os
+import tempfile
+
+# Address to listen on
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+
+# Worker processes, and threads in each. Requests mostly wait on MongoDB,
+# CAS and SMTP, so a few threads per process serve them well
+workers = int(os.environ.get("GUNICORN_WORKERS", multiprocessing.cpu_count()))
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+worker_class = "gthread"
+
+# Kill a worker stuck on one request for longer than timeout seconds. On
+# shutdown or reload (SIGTERM or SIGHUP), workers get graceful_timeout
+# seconds to finish their requests and send their queued emails
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 60))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", 5))
+
+# Replace each worker after this many requests (0 never does), with jitter
+# so they are not all replaced at once
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 0))
+max_requests_jitter = max_requests // 10
+
+# Load the app once in the master before forking (faster start, shared
+# memory). The master's MongoDB connections are then closed before forking
+preload_app = os.environ.get("GUNICORN_PRELOAD", "false").lower() == "true"
+
+# Log requests and errors to stdout and stderr
+accesslog = os.environ.get("GUNICORN_ACCESS_LOG", "-")
+errorlog = "-"
+
+# Workers share their Prometheus samples through this directory. It must be
+# set before the app (and prometheus_client) is imported
+if not os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="kms-metrics-")
+
+
+def on_starting(server) -> None:
+    # Drop samples left over from an earlier run of the server
+    metrics_dir: str = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    for name in os.listdir(metrics_dir):
+        if name.endswith(".db"):
+            os.remove(os.path.join(metrics_dir, name))
+
+
+def when_ready(server) -> None:
+    # The master never queries MongoDB itself. Close the connections it
+    # opened while preloading the app, so no worker inherits them
+    if preload_app:
+        from src.utils.serving import reset_mongo_connections
+        reset_mongo_connections(close=True)
+
+
+def post_fork(server, worker) -> None:
+    # Each worker opens its own MongoDB connections on its first query
+    from src.utils.serving import reset_mongo_connections
+    reset_mongo_connections(close=False)
+
+
+def post_worker_init(worker) -> None:
+    # Start delivering queued emails as soon as the worker has loaded the
+    # app, rather than after its first request
+    from src.utils.email_outbox import start_outbox_workers
+    start_outbox_workers(worker.wsgi)
+
+
+def worker_exit(server, worker) -> None:
+    # Let the email outbox threads finish the emails they are sending
+    from src.utils.email_outbox import stop_outbox_workers
+    stop_outbox_workers(timeout=graceful_timeout / 2)
+
+
+def child_exit(server, worker) -> None:
+    # Stop counting the live gauges (e.g. open connections) of a dead worker
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
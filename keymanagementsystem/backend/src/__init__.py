@@ -12,6 +12,21 @@ from .routes.blueprint_users import blueprint_users
 from .routes.blueprint_ledger import blueprint_ledger
 from .routes.blueprint_email import blueprint_email
 
+# Import management commands
+from .utils.db_commands import db_cli
+
+# Import email outbox
+from .utils.email_outbox import email_cli, start_outbox_workers
+
+# Import profiling
+from .utils.profiling import init_profiling
+
+# Import metrics
+from .utils.metrics import init_metrics
+
+# Import slow query log
+from .utils.slow_queries import init_slow_query_log
+
 # Initial plugins
 db = MongoEngine()
 cors = CORS()
@@ -38,6 +53,17 @@ def create_app() -> Flask:
         app.logger.debug("Using development settings")
         app.config.from_object("config.DevelopmentConfig")
 
+    # Profile a sample of requests if enabled (before connecting to
+    # MongoDB, so the connection reports its commands)
+    init_profiling(app)
+
+    # Count and time requests (also before connecting, so the connection
+    # pool reports its usage)
+    init_metrics(app)
+
+    # Log slow MongoDB operations (also before connecting)
+    init_slow_query_log(app)
+
     # Initialize plugins
     db.init_app(app)
     cors.init_app(app, supports_credentials=True)
@@ -52,5 +78,15 @@ def create_app() -> Flask:
         app.register_blueprint(blueprint_users, url_prefix="/api")
         app.register_blueprint(blueprint_ledger, url_prefix="/api")
         app.register_blueprint(blueprint_email, url_prefix="/api")
-        
+
+        # Register management commands
+        app.cli.add_command(db_cli)
+        app.cli.add_command(email_cli)
+
+        # Start delivering queued emails once the app serves requests
+        # (not when it only runs a command). gunicorn starts them as each
+        # worker boots (see gunicorn.conf.py), so this only matters for the
+        # development server
+        app.before_first_request(lambda: start_outbox_workers(app))
+
         return app
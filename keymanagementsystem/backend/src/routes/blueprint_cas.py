@@ -6,9 +6,6 @@
 from flask import Flask, Response, make_response, session, request, \
     redirect, url_for, Blueprint, current_app, jsonify
 
-# Import CAS
-from cas import CASClient
-
 # Import mongo objects
 from mongoengine.queryset.visitor import Q
 from mongoengine import *
@@ -16,12 +13,14 @@ from mongoengine import *
 # Import schemas
 from ..schemas.user import User
 
-# Initialize CAS Client
-cas_client = CASClient(version=2,
-                       server_url="https://login.vt.edu/profile/cas/login")
+# Import validation
+from ..utils.validation import session_role_cache_enabled, cache_session_role
+
+# Import collection versions
+from ..utils.collection_versions import bump_collection_versions
 
-# Define the base service URL
-base_service_url = "https://keymanagement.discovery.cs.vt.edu/api/cas/login_callback"
+# Import CAS ticket verification
+from ..utils.cas_client import get_cas_client, get_service_url, verify_cas_ticket
 
 # Define the blueprint
 blueprint_cas: Blueprint = Blueprint(
@@ -48,11 +47,11 @@ def login() -> Response:
         return "No destination address provided! We can't reroute you back unless this is supplied!", 400
 
     # Create new service URL
-    cas_client.service_url = base_service_url + f"?destination={destination}"
+    service_url: str = get_service_url(destination)
 
     # If ticket is none, user needs to login with VT CAS first
     if not ticket:
-        cas_login_url = cas_client.get_login_url()
+        cas_login_url = get_cas_client(service_url).get_login_url()
         current_app.logger.debug("CAS login URL: %s", cas_login_url)
         return redirect(cas_login_url)
 
@@ -70,8 +69,8 @@ def login_callback() -> Response:
     destination = request.args.get("destination")
     ticket = request.args.get("ticket")
 
-    # Validate ticket from CAS
-    pid, _, _ = cas_client.verify_ticket(ticket)
+    # Validate ticket from CAS, with the service URL the login used
+    pid = verify_cas_ticket(ticket, get_service_url(destination)) if ticket else None
 
     # If the pid could not be extracted, that means ticket verfication failed
     if not pid:
@@ -83,13 +82,19 @@ def login_callback() -> Response:
         user: User = User.objects.get(pid=pid)
     except User.DoesNotExist:
         try:
-            new_user: User = User(pid=pid, full_name="NA", role="requestor")
-            new_user.save()
+            user: User = User(pid=pid, full_name="NA", role="requestor")
+            user.save()
+            bump_collection_versions("users")
         except ValidationError:
             return "Error! There was an issue processing your information in the server!", 500
 
     session["pid"] = pid
     session.permanent = True      # set session cookie expiration to 31 days
+
+    # Cache the role in the session so requests can skip the user lookup
+    if session_role_cache_enabled():
+        cache_session_role(user)
+
     return redirect(destination)  # redirect client to destination
 
 
@@ -101,13 +106,17 @@ def logout() -> Response:
         Response: A URL redirect to VT CAS logout
     """
     # Create cas logout URL
-    cas_logout_url = cas_client.get_logout_url()
+    cas_logout_url = get_cas_client().get_logout_url()
     current_app.logger.debug("CAS Logout URL: %s", cas_logout_url)
 
     # Delete username off cookie
     if "pid" in session:
         session.pop("pid", None)
 
+    # Delete the cached role off cookie
+    for cached in ("role", "role_version", "role_cached_at"):
+        session.pop(cached, None)
+
     # Redirect to cas logout url
     return redirect(cas_logout_url)
 
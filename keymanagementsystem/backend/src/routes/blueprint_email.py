@@ -11,7 +11,7 @@ import re
 from flask import Blueprint, current_app, jsonify, session, abort, \
     make_response, request, Response
 
-from flask_mail import Mail, Message
+from flask_mail import Message
 
 # Import mongo objects
 from mongoengine import *
@@ -19,13 +19,15 @@ from mongoengine import *
 # Import schemas
 from ..schemas.user import User
 from ..schemas.key import Key
+from ..schemas.email import Email, VALID_STATUSES
 
 # Import validation
 from ..utils.validation import validate_authenticated_admin, \
-    validate_authenticated
+    validate_authenticated, get_authenticated_user
 
-# Setup mail
-mail = Mail()
+# Import email outbox
+from ..utils.email_outbox import enqueue_email
+from ..utils.smtp_pool import get_smtp_pool
 
 # Define email regex
 email_regex = re.compile(r'([A-Za-z0-9]+[.-_])*[A-Za-z0-9]+@[A-Za-z0-9-]+(\.[A-Z|a-z]{2,})+')
@@ -61,6 +63,26 @@ def update_admin_email(new_email: str) -> Response:
     return f"Successfully changed admin email to {new_email}", 200
 
 
+@blueprint_email.route("/email/stats", methods=["GET"])
+def get_email_stats() -> Response:
+    """Get the number of emails in each outbox state and the counters of
+    this process's SMTP connections (restricted to administrator+ only)
+
+    Returns:
+        Response: A JSON like { queue: { status: count }, connections: [...] }
+    """
+
+    # Require admin priviledges (abort if failure)
+    validate_authenticated_admin()
+
+    queue: dict = {status: Email.objects(status=status).count() for status in VALID_STATUSES}
+
+    return jsonify({
+        "queue": queue,
+        "connections": get_smtp_pool(current_app._get_current_object()).stats()
+    })
+
+
 @blueprint_email.route("/email/request", methods=["POST"])
 def send_request_email() -> Response:
     """Send an email to a recipient requesting for a key
@@ -83,8 +105,8 @@ def send_request_email() -> Response:
     if set(data.keys()) != set(required_fields):
         return "Error! JSON for request email does not have all fields!", 400
 
-    # Find the user in the database
-    user: User = User.objects.get(pid=session["pid"])
+    # Get the user who sent the request
+    user: User = get_authenticated_user()
 
     # Extract variables from json request body
     try:
@@ -133,11 +155,11 @@ def send_request_email() -> Response:
     # Clean up email body
     msg.body = inspect.cleandoc(body)
 
-    # Send the email
-    mail.send(msg)
+    # Queue the email (background workers send it)
+    enqueue_email(msg)
 
     # Report done
-    return "Sucessfully sent request email", 200
+    return "Sucessfully sent request email", 202
 
 
 @blueprint_email.route("/email/return", methods=["POST"])
@@ -164,8 +186,8 @@ def send_return_email():
     # Extract variables from json request body
     tag_number = data["tag_number"]
 
-    # Find the user in the database
-    user: User = User.objects.get(pid=session["pid"])
+    # Get the user who sent the request
+    user: User = get_authenticated_user()
 
     # Initialize a new email message
     msg = Message(
@@ -190,11 +212,11 @@ def send_return_email():
     # Clean up email body
     msg.body = inspect.cleandoc(body)
 
-    # Send the email
-    mail.send(msg)
+    # Queue the email (background workers send it)
+    enqueue_email(msg)
 
     # Report done
-    return "Sucessfully sent return email", 200
+    return "Sucessfully sent return email", 202
 
 
 @blueprint_email.route("/email/report", methods=["POST"])
@@ -222,8 +244,8 @@ def send_report_email():
     tag_number = data["tag_number"]
     reason = data["reason"]
 
-    # Find the user in the database
-    user: User = User.objects.get(pid=session["pid"])
+    # Get the user who sent the request
+    user: User = get_authenticated_user()
 
     # Initialize a new email message
     msg = Message(
@@ -250,8 +272,8 @@ def send_report_email():
     # Clean up email body
     msg.body = inspect.cleandoc(body)
 
-    # Send the email
-    mail.send(msg)
+    # Queue the email (background workers send it)
+    enqueue_email(msg)
 
     # Report done
-    return "Sucessfully sent report email", 200
\ No newline at end of file
+    return "Sucessfully sent report email", 202
\ No newline at end of file
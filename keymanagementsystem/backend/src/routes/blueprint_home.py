@@ -5,7 +5,25 @@
         - Rename this file and blueprint to "blueprint_misc"
 """
 # Import flask objects
-from flask import Flask, Blueprint, current_app
+from flask import Flask, Blueprint, Response, current_app, jsonify
+
+# Import validation
+from ..utils.validation import validate_authenticated_admin
+
+# Import response cache
+from ..utils.response_cache import get_response_cache
+
+# Import metrics
+from ..utils.metrics import has_metrics_token, metrics_response
+
+# Import pagination
+from ..utils.pagination import parse_page_size
+
+# Import fast serialization
+from ..utils.fast_json import json_response
+
+# Import schemas
+from ..schemas.slow_query import SlowQuery
 
 # Define the blueprint
 blueprint_home: Blueprint = Blueprint(name="blueprint_home", import_name=__name__)
@@ -16,4 +34,55 @@ def home() :
         return "Welcome to the key management API! You are in production mode."
     else:
         return "Welcome to the key management API! You are in development mode."
-    
\ No newline at end of file
+
+
+@blueprint_home.route("/cache/stats", methods=["GET"])
+def get_cache_stats() -> Response:
+    """Get the response cache hit and miss counters of this process
+    (restricted to administrator+ only)
+
+    Returns:
+        Response: A JSON like { backend, hits, misses, hit_ratio, invalidations, routes }
+    """
+
+    # Require admin priviledges (abort if failure)
+    validate_authenticated_admin()
+
+    return jsonify(get_response_cache(current_app._get_current_object()).stats())
+
+
+@blueprint_home.route("/metrics", methods=["GET"])
+def get_metrics() -> Response:
+    """Get the request, MongoDB pool, email and CAS metrics in the
+    Prometheus text format (restricted to administrator+ or scrapers
+    sending the METRICS_TOKEN bearer token)
+
+    Returns:
+        Response: The metrics of every worker process
+    """
+
+    # Require admin priviledges unless the token was sent (abort if failure)
+    if not has_metrics_token():
+        validate_authenticated_admin()
+
+    return metrics_response()
+
+
+@blueprint_home.route("/slow-queries", methods=["GET"])
+def get_slow_queries() -> Response:
+    """Get the most recently captured slow queries and their query plans,
+    newest first (restricted to administrator+ only). Takes the optional
+    request parameter "limit" (50 by default)
+
+    Returns:
+        Response: A JSON array of slow queries
+    """
+
+    # Require admin priviledges (abort if failure)
+    validate_authenticated_admin()
+
+    # Read the page size (abort if invalid)
+    limit: int = parse_page_size(50, 500)
+
+    # Read the capped collection backwards, in insertion order
+    return json_response(list(SlowQuery.objects.order_by("-$natural").limit(limit).as_pymongo()))
@@ -3,6 +3,9 @@
 """
 
 # Imports libraries
+import csv
+import io
+from datetime import datetime
 from functools import reduce
 
 # Import flask objects
@@ -12,22 +15,95 @@ from flask import Blueprint, Response, current_app, jsonify, session, \
 # Import mongo objects
 from mongoengine.queryset.visitor import Q
 from mongoengine import *
+from pymongo.errors import BulkWriteError
 
 # Import schemas
 from ..schemas.key import Key
 from ..schemas.user import User
+from ..schemas.record import Record
 
 # Import validation
 from ..utils.validation import validate_authenticated_admin
 
+# Import pagination
+from ..utils.pagination import is_paginated_request, parse_page_size, \
+    parse_sort, parse_bool, paginate
+
+# Import fast serialization
+from ..utils.fast_json import json_response, stream_json_array
+
+# Import sparse fieldsets
+from ..utils.fields import parse_fields, project
+
+# Import key search
+from ..utils.key_search import search_keys, DEFAULT_SEARCH_LIMIT, MAX_SEARCH_LIMIT
+
+# Import transactions
+from ..utils.transactions import run_in_transaction
+
+# Import collection versions
+from ..utils.collection_versions import bump_versions_after_writes, \
+    collection_etag, abort_if_not_modified, set_etag
+
+# Import response cache
+from ..utils.response_cache import get_cached_response, cache_response, \
+    invalidate_cached_responses
+
 # List of possible request parameters
 possible_params: list = ["tag_number", "series_id", "sequence_id",
                          "building", "key_type", "location", "is_available", "comment"]
 
+# List of request parameters that filter the key listing
+filter_params: list = ["building", "key_type", "is_available", "series_id", "location"]
+
+# List of fields the key listing can be sorted on
+sortable_params: list = ["tag_number", "series_id", "sequence_id",
+                         "building", "key_type", "is_available"]
+
+# Maximum number of keys in one bulk request
+MAX_BULK_KEYS = 5000
+
 # Define the blueprint
 blueprint_keys: Blueprint = Blueprint(
     name="blueprint_keys", import_name=__name__)
 
+# Key routes also write users (deleting a key removes it from its owner)
+# and the ledger (deleting a held key records its return)
+blueprint_keys.after_request(bump_versions_after_writes("keys", "users", "ledger"))
+
+
+# region Helpers
+
+def build_key(data: dict) -> Key:
+    """Construct a (not yet saved) key from a request body
+
+    Args:
+        data (dict): The key's fields as sent by the client
+
+    Returns:
+        Key: The new key. Raises KeyError, TypeError or ValueError if
+        fields are missing or malformed
+    """
+
+    # Build locations
+    location_list = str(data["location"]).split(",")
+    for index, loc in enumerate(location_list):
+        location_list[index] = loc.strip()
+
+    # Construct new key
+    return Key(
+        tag_number=str(data["tag_number"]).strip(),
+        series_id=str(data["series_id"]).strip(),
+        sequence_id=int(data["sequence_id"]),
+        building=str(data["building"]).strip(),
+        key_type=str(data["key_type"]).strip(),
+        location=location_list,
+        is_available=str(data["is_available"]).lower() == "true",
+        comment=str(data["comment"]).strip()
+    )
+
+# endregion
+
 
 # region Routes
 
@@ -35,28 +111,110 @@ blueprint_keys: Blueprint = Blueprint(
 def get_all_keys() -> Response:
     """Get all keys in the database
 
+    Supports the optional request parameters "limit", "cursor", "sort"
+    (prefix with "-" for descending) and the filters in filter_params.
+    When any of these are supplied, a single page is returned instead.
+    "fields" (comma separated) limits the fields returned for each key.
+    Answers 304 if the If-None-Match header holds the current ETag.
+
     Returns:
-        Response: A json array of all keys in the database
+        Response: A json array of all keys in the database, or a json of
+        the form { items, total, next_cursor } when paginating
     """
 
     # Require admin priviledges (abort if failure)
     validate_authenticated_admin()
 
-    # Get all keys in the database
-    result: list = Key.objects()
+    # Read the requested fields (abort if invalid)
+    fields: list = parse_fields(Key)
+
+    # Skip the query if the client already has the current keys
+    etag: str = collection_etag("keys")
+    abort_if_not_modified(etag)
+
+    # Serve the listing from the cache if it is still current
+    cached: Response = get_cached_response(("keys",), etag)
+    if cached:
+        return set_etag(cached, etag)
 
-    # If there was nothing in the database, return an empty list
-    if not result:
-        return jsonify([])
+    # Without any pagination or filter parameters, keep returning every key
+    if not is_paginated_request(filter_params):
 
-    # Finally, return the result as json
-    return jsonify(result)
+        # Stream every key in the database as raw documents
+        return set_etag(cache_response(("keys",), etag, stream_json_array(project(Key.objects(), fields))), etag)
+
+    # Read pagination parameters (abort if invalid)
+    page_size: int = parse_page_size()
+    sort_field, descending = parse_sort(sortable_params, "tag_number")
+    cursor: str = request.args.get("cursor")
+
+    # Build filters from the request parameters
+    filters: dict = {}
+    for param in filter_params:
+        if param in request.args:
+            filters[param] = request.args.get(param).strip()
+    if "is_available" in filters:
+        filters["is_available"] = parse_bool(filters["is_available"])
+
+    # Apply the filters
+    queryset = Key.objects(**filters)
+
+    # Get the requested page (the sort field is needed for the next cursor)
+    items, next_cursor = paginate(project(queryset, fields and fields + [sort_field]),
+                                  sort_field, descending, page_size, cursor)
+
+    # Return the page with the total number of matching keys
+    return set_etag(cache_response(("keys",), etag, json_response({
+        "items": items,
+        "total": queryset.count(),
+        "next_cursor": next_cursor
+    })), etag)
+
+
+@blueprint_keys.route("/keys/search", methods=["GET"])
+def search_all_keys() -> Response:
+    """Search keys by tag number, series id, building, location and comment
+
+    Takes the request parameters "q" (the words to search for, matched
+    case-insensitively as whole words or prefixes) and "limit".
+
+    Returns:
+        Response: A json like { items, more } with the best matches first.
+        Each key has a "score": 3 for its tag number, 2 if every word
+        matched a whole word, 1 if every word matched the start of one
+    """
+
+    # Require admin priviledges (abort if failure)
+    validate_authenticated_admin()
+
+    # Read the search parameters (abort if invalid)
+    query: str = request.args.get("q", "").strip()
+    if not query:
+        return "Error! Search text (q) is required.", 400
+    limit: int = parse_page_size(DEFAULT_SEARCH_LIMIT, MAX_SEARCH_LIMIT)
+
+    # Serve the results from the cache if they are still current
+    version: str = collection_etag("keys")
+    cached: Response = get_cached_response(("keys",), version)
+    if cached:
+        return cached
+
+    # Find the keys
+    items, more = search_keys(query, limit)
+
+    return cache_response(("keys",), version, json_response({
+        "items": items,
+        "more": more
+    }))
 
 
 @blueprint_keys.route("/keys/<string:tag_number>", methods=["GET"])
 def get_key(tag_number: str) -> Response:
     """Get a specific key in the database
 
+    Supports the optional request parameter "fields" (comma separated)
+    to limit the fields returned.
+
     Args:
         tag_number (str): The tag number for the key of interest
 
@@ -68,12 +226,21 @@ def get_key(tag_number: str) -> Response:
     # Require admin priviledges (abort if failure)
     validate_authenticated_admin()
 
+    # Read the requested fields (abort if invalid)
+    fields: list = parse_fields(Key)
+
+    # Serve the key from the cache if it is still current
+    version: str = collection_etag("keys")
+    cached: Response = get_cached_response(("keys",), version)
+    if cached:
+        return cached
+
     try:
-        # Find the key
-        key: Key = Key.objects.get(tag_number=tag_number)
+        # Find the key, reading only the requested fields
+        key: dict = project(Key.objects, fields).as_pymongo().get(tag_number=tag_number)
 
         # Return the key as json
-        return jsonify(key)
+        return cache_response(("keys",), version, json_response(key))
 
     # Handle key not found
     except Key.DoesNotExist:
@@ -88,6 +255,9 @@ def get_key(tag_number: str) -> Response:
 def get_key_owner(tag_number: str) -> Response:
     """Get the owner of a specific key in the database
 
+    Supports the optional request parameter "fields" (comma separated)
+    to limit the user fields returned.
+
     Args:
         tag_number (str): The tag number for the key of interest
 
@@ -99,18 +269,25 @@ def get_key_owner(tag_number: str) -> Response:
     # Require admin priviledges (abort if failure)
     validate_authenticated_admin()
 
+    # Read the requested fields (abort if invalid)
+    fields: list = parse_fields(User)
+
     try:
         # Find the key
-        key: Key = Key.objects.get(tag_number=tag_number)
+        key: Key = Key.objects.only("owner_pid").get(tag_number=tag_number)
+
+        # If the key is not held by anyone, return failure
+        if not key.owner_pid:
+            return f"Error! Key does not have an owner!", 404
 
-        # Next, find all owners of the key
-        owned_users: list = User.objects(Q(owned_keys__in=[key]))
+        # Next, find the owner of the key, reading only the requested fields
+        owner: dict = project(User.objects, fields).as_pymongo().get(pid=key.owner_pid)
 
-        # If there is at least one user who owns this key, return the (first) owner as json
-        if owned_users:
-            return jsonify(owned_users[0])
-        
-        # Else, return failure
+        # Return the owner as json
+        return json_response(owner)
+
+    # Handle a stale owner (run "flask db repair-owners" to fix it)
+    except User.DoesNotExist:
         return f"Error! Key does not have an owner!", 404
 
     # Handle key not found
@@ -150,25 +327,12 @@ def add_key() -> Response:
         if Key.objects(Q(series_id=data["series_id"]) & Q(sequence_id=data["sequence_id"])):
             return f"Error! A key with series id {data['series_id']} and sequence id {data['sequence_id']} already exists!", 400
 
-        # Build locations
-        location_list = str(data["location"]).split(",")
-        for index, loc in enumerate(location_list):
-            location_list[index] = loc.strip()
-
         # Construct new key
-        new_key: Key = Key(
-            tag_number=str(data["tag_number"]).strip(),
-            series_id=str(data["series_id"]).strip(),
-            sequence_id=int(data["sequence_id"]),
-            building=str(data["building"]).strip(),
-            key_type=str(data["key_type"]).strip(),
-            location=location_list,
-            is_available=str(data["is_available"]).lower() == "true",
-            comment=str(data["comment"]).strip()
-        )
+        new_key: Key = build_key(data)
 
         # Now save it into the database
         new_key.save()
+        invalidate_cached_responses("keys")
 
         # Report done
         tagNum = str(data["tag_number"]).strip()
@@ -191,6 +355,117 @@ def add_key() -> Response:
         return f"Error with adding key: {e}", 400
 
 
+@blueprint_keys.route("/keys/bulk", methods=["POST"])
+def add_keys_bulk() -> Response:
+    """Add many keys to the database at once
+
+    The body is either a JSON array of keys (same fields as POST /keys) or
+    a CSV file with those fields as columns, uploaded as the "file" field
+    of a form or sent as text/csv. "is_available" defaults to true and
+    "comment" to empty.
+
+    Returns:
+        Response: A JSON like { created, failed, results } where results
+        holds { row, tag_number, status, error } for every row. The status
+        code is 200 if every key was added, 207 if only some were and 400
+        if none were.
+    """
+
+    # Require admin priviledges (abort if failure)
+    validate_authenticated_admin()
+
+    # Read the rows from a CSV upload, a CSV body or a JSON array
+    if "file" in request.files:
+        text: str = request.files["file"].read().decode("utf-8-sig")
+        rows: list = list(csv.DictReader(io.StringIO(text)))
+    elif request.mimetype == "text/csv":
+        rows: list = list(csv.DictReader(io.StringIO(request.get_data(as_text=True))))
+    else:
+        rows = request.get_json(silent=True)
+
+    # Ensure there is something to add
+    if not isinstance(rows, list) or not rows:
+        return "Error! Send a non-empty JSON array of keys or a CSV file!", 400
+
+    if len(rows) > MAX_BULK_KEYS:
+        return f"Error! Cannot add more than {MAX_BULK_KEYS} keys at once!", 400
+
+    results: list = []
+    valid: list = []
+
+    # Build and validate every row before touching the database
+    for row_number, row in enumerate(rows, start=1):
+        result: dict = {"row": row_number, "tag_number": None, "status": "error", "error": None}
+        results.append(result)
+
+        try:
+            if not isinstance(row, dict):
+                raise TypeError("each key must be an object")
+
+            key: Key = build_key({"is_available": "true", "comment": "", **row})
+            result["tag_number"] = key.tag_number
+            key.validate()
+            valid.append((result, key))
+
+        except ValidationError as verror:
+            result["error"] = f"{verror}. Regex errors suggest mistakenly using special characters!"
+        except KeyError as kerror:
+            result["error"] = f"Missing field {kerror}"
+        except (TypeError, ValueError) as error:
+            result["error"] = str(error)
+
+    # Check uniqueness against the database for the whole batch in one query
+    existing: list = Key.objects(
+        Q(tag_number__in=[key.tag_number for _, key in valid]) |
+        Q(series_id__in=list({key.series_id for _, key in valid}))
+    ).only("tag_number", "series_id", "sequence_id") if valid else []
+
+    taken_tags: set = {key.tag_number for key in existing}
+    taken_pairs: set = {(key.series_id, key.sequence_id) for key in existing}
+
+    # Reject duplicates of existing keys and of earlier rows in this batch
+    to_insert: list = []
+    for result, key in valid:
+        pair: tuple = (key.series_id, key.sequence_id)
+
+        if key.tag_number in taken_tags:
+            result["error"] = f"A key with tag number {key.tag_number} already exists!"
+        elif pair in taken_pairs:
+            result["error"] = f"A key with series id {key.series_id} and sequence id {key.sequence_id} already exists!"
+        else:
+            taken_tags.add(key.tag_number)
+            taken_pairs.add(pair)
+            to_insert.append((result, key))
+
+    # Insert every remaining key with one unordered bulk write
+    if to_insert:
+        for result, _ in to_insert:
+            result["status"] = "created"
+
+        try:
+            Key._get_collection().insert_many(
+                [key.to_mongo() for _, key in to_insert], ordered=False)
+
+        # Keys added by someone else since the uniqueness check
+        except BulkWriteError as bwerror:
+            for error in bwerror.details.get("writeErrors", []):
+                result: dict = to_insert[error["index"]][0]
+                result["status"] = "error"
+                result["error"] = error.get("errmsg", "Could not insert key")
+
+        invalidate_cached_responses("keys")
+
+    # Report per-row results
+    created: int = sum(1 for result in results if result["status"] == "created")
+    status: int = 200 if created == len(results) else 207 if created else 400
+
+    return jsonify({
+        "created": created,
+        "failed": len(results) - created,
+        "results": results
+    }), status
+
+
 @blueprint_keys.route("/keys/<string:old_tag_number>", methods=["PATCH"])
 def update_key(old_tag_number: str) -> Response:
     """Update a specific key's properties in the database
@@ -213,54 +488,47 @@ def update_key(old_tag_number: str) -> Response:
         # Find the key
         key: Key = Key.objects.get(tag_number=old_tag_number)
 
-        ####################################################################################
-        #delete if statements checking if in data (ex. if series_id in data)
-        #keep the checks for uniqueness
-        #if passing those checks, key.update(data)
-        #where ever this is called, need to change parameters to pass in old tag number and new tag number
-        ####################################################################################
-
-        # Ensure that this key has a unique tag number
-        # maybe add statement checking if it is the previous tag number
-        if Key.objects(Q(tag_number=data["tag_number"])) and data["tag_number"] != old_tag_number:
-            return f"Error! A key with tag number {data['tag_number']} already exists!", 400
-
-        # Ensure that this key has a unique series id and sequence id
-        # maybe add statement checking if it is the previous series and sequence id
-        if Key.objects(Q(series_id=data["series_id"]) & Q(sequence_id=data["sequence_id"])) and key.series_id != data["series_id"] and key.sequence_id != data["sequence_id"]:
-            return f"Error! A key with series id {data['series_id']} and sequence id {data['sequence_id']} already exists!", 400
-
-        # Update tag number
-        # if "tag_number" in data:
-        #     # Ensure that this key has a unique tag number
-        #     if Key.objects(Q(tag_number=data["tag_number"])):
-        #         return f"Error! A key with tag number {data['tag_number']} already exists!", 400
-
-        key.update(set__tag_number=str(data["tag_number"]).strip())
+        # Build the new field values from the whole payload first
+        updates: dict = {
+            "tag_number": str(data["tag_number"]).strip(),
+            "series_id": str(data["series_id"]).strip(),
+            "sequence_id": int(data["sequence_id"]),
+            "building": str(data["building"]).strip(),
+            "key_type": str(data["key_type"]).strip(),
+            "comment": str(data["comment"]).strip()
+        }
 
-        # Update series id
-        key.update(set__series_id=str(data["series_id"]).strip())
-
-        # Update sequence id
-        key.update(set__sequence_id=int(data["sequence_id"]))
-
-        # Update building
-        key.update(set__building=str(data["building"]).strip())
-
-        # Update key type
-        key.update(set__key_type=str(data["key_type"]).strip())
-
-        # Update location
+        # Build locations
         if "location" in data:
-            # Build locations
             location_list = str(data["location"]).split(",")
             for index, loc in enumerate(location_list):
                 # Remove unnecessary elements from loc
                 location_list[index] = loc.replace("[", "").replace("]", "").replace("'", "").strip()
-            key.update(set__location=location_list)
-        
-        # Update comment
-        key.update(set__comment=str(data["comment"]).strip())
+            updates["location"] = location_list
+
+        # Validate the edited key before writing anything (raises ValidationError)
+        for field, value in updates.items():
+            setattr(key, field, value)
+        key.validate()
+
+        # Keep the search terms in sync (validating rebuilt them)
+        updates["search_terms"] = key.search_terms
+
+        # Ensure that no other key has this tag number, or this series id
+        # and sequence id, with a single query
+        conflict: Key = Key.objects(
+            (Q(tag_number=updates["tag_number"]) |
+             (Q(series_id=updates["series_id"]) & Q(sequence_id=updates["sequence_id"]))) &
+            Q(id__ne=key.id)).only("tag_number").first()
+
+        if conflict:
+            if conflict.tag_number == updates["tag_number"]:
+                return f"Error! A key with tag number {updates['tag_number']} already exists!", 400
+            return f"Error! A key with series id {updates['series_id']} and sequence id {updates['sequence_id']} already exists!", 400
+
+        # Apply every change in one atomic update
+        key.update(**{f"set__{field}": value for field, value in updates.items()})
+        invalidate_cached_responses("keys")
 
         # Report done
         return f"Succesfully updated key with tag number {data['tag_number']}", 200
@@ -305,16 +573,14 @@ def return_key(tag_number: str) -> Response:
         # Find the key
         key: Key = Key.objects.get(tag_number=tag_number)
 
-        # We need to find all users who have this key owned
-        owned_users: list = User.objects(Q(owned_keys__in=[key]))
-
-        # If there is at least one user who owns this key, fail
+        # If a user still owns this key, fail
         # because we cannot safely return the key
-        if owned_users:
-            return f"Error! Cannot return key because {owned_users[0].pid} owns this still!", 400
+        if key.owner_pid:
+            return f"Error! Cannot return key because {key.owner_pid} owns this still!", 400
 
         # Mark the key as available
         key.update(set__is_available=True)
+        invalidate_cached_responses("keys")
 
         # Report done
         return f"Sucessfully returned key with tag number {tag_number}", 200
@@ -330,7 +596,8 @@ def return_key(tag_number: str) -> Response:
 
 @blueprint_keys.route("/keys/<string:tag_number>", methods=["DELETE"])
 def delete_key(tag_number: str) -> Response:
-    """Delete a specific key in the database
+    """Delete a specific key in the database. Pulling it off its owners
+    and recording its return in the ledger happen in the same transaction
 
     Args:
         tag_number (str): The tag number for the key of interest
@@ -343,28 +610,49 @@ def delete_key(tag_number: str) -> Response:
     # Require admin priviledges (abort if failure)
     validate_authenticated_admin()
 
-    try:
-        # Find the key
-        key: Key = Key.objects.get(tag_number=tag_number)
+    # Comment of the ledger record when a held key is deleted
+    comment: str = f"Auto-Generated: key deleted by {session['pid']}"
+
+    def cascade(db_session) -> dict:
+        # Delete the key first. This is the step that decides whether
+        # anything else is written, and returns who held it at that moment
+        deleted: dict = Key._get_collection().find_one_and_delete(
+            {"tag_number": tag_number}, projection={"owner_pid": 1}, session=db_session)
+
+        # The key does not exist (anymore), nothing else to write
+        if deleted is None:
+            return None
+
+        # Pull the key off every user still referencing it, in one write
+        User._get_collection().update_many(
+            {"owned_keys": deleted["_id"]}, {"$pull": {"owned_keys": deleted["_id"]}},
+            session=db_session)
+
+        # Record that the holder no longer has the key
+        if deleted.get("owner_pid"):
+            Record._get_collection().insert_one(Record(
+                tag_number=tag_number,
+                pid=deleted["owner_pid"],
+                date=datetime.now(),
+                exchange="returned",
+                comment=comment
+            ).to_mongo(), session=db_session)
 
-        # We need to find all users who have this key owned
-        owned_users: list = User.objects(Q(owned_keys__in=[key]))
+        return deleted
 
-        # Delete this key off the owned keys array for all users
-        for user in owned_users:
-            user.owned_keys.remove(key)  # remove the key
-            user.save()                  # save user details in database
+    try:
+        # Delete the key and clean up after it in a single transaction
+        deleted: dict = run_in_transaction(cascade)
+
+        # Handle key not found
+        if deleted is None:
+            return f"Error! Key with tag {tag_number} does not exist!", 404
 
-        # Now delete the key off the system entirely
-        key.delete()
+        invalidate_cached_responses("keys", "users")
 
         # Report done
         return f"Successfully deleted key with tag number {tag_number}", 200
 
-    # Handle key not found
-    except Key.DoesNotExist:
-        return f"Error! Key with tag {tag_number} does not exist!", 404
-
     # Catch all other errors
     except Exception as e:
         return f"Error with deleting key: {e}", 400
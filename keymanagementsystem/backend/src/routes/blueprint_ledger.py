@@ -3,7 +3,7 @@
 """
 
 # Import libraries
-from datetime import datetime
+from datetime import datetime, timedelta
 from functools import reduce
 import dateutil.parser
 
@@ -17,16 +17,36 @@ from mongoengine import *
 # Import validation
 from ..utils.validation import validate_authenticated
 
+# Import pagination
+from ..utils.pagination import is_paginated_request, parse_page_size, \
+    parse_sort, paginate
+
+# Import fast serialization
+from ..utils.fast_json import json_response, stream_json_array
+
+# Import sparse fieldsets
+from ..utils.fields import parse_fields, project
+
+# Import collection versions
+from ..utils.collection_versions import bump_versions_after_writes, \
+    collection_etag, abort_if_not_modified, set_etag
+
 # Import schemas
 from ..schemas.record import Record
 
 # List of possible request parameters
 possible_params: list = ["tag_number", "pid", "date", "exchange", "comment"]
 
+# List of request parameters that filter the ledger listing
+filter_params: list = ["from", "to", "pid", "tag_number", "exchange"]
+
 # Define the blueprint
 blueprint_ledger: Blueprint = Blueprint(
     name="blueprint_ledger", import_name=__name__)
 
+# Keep the ledger's version current after every write
+blueprint_ledger.after_request(bump_versions_after_writes("ledger"))
+
 
 # region Routes
 
@@ -34,28 +54,86 @@ blueprint_ledger: Blueprint = Blueprint(
 def get_all_records() -> Response:
     """Get all records (restricted to adminstrator+ only)
 
+    Supports the optional request parameters "limit", "cursor", "sort"
+    ("date" or "-date", newest first by default), the ISO dates "from"
+    and "to" (both inclusive), and the filters "pid", "tag_number" and
+    "exchange". When any of these are supplied, a single page is returned
+    instead. "fields" (comma separated) limits the fields returned for each
+    record. Answers 304 if the If-None-Match header holds the current ETag.
+
     Returns:
-        Response: A JSON array of all records in the ledger
+        Response: A JSON array of all records in the ledger, or a JSON of
+        the form { items, total, next_cursor } when paginating
     """
 
     # Require authentication (abort if failure)
     validate_authenticated()
 
-    # Get all records
-    result: list = Record.objects()
+    # Read the requested fields (abort if invalid)
+    fields: list = parse_fields(Record)
+
+    # Skip the query if the client already has the current ledger
+    etag: str = collection_etag("ledger")
+    abort_if_not_modified(etag)
 
-    # If there was nothing in the database, return an empty list
-    if not result:
-        return jsonify([])
+    # Without any pagination or filter parameters, keep returning every record
+    if not is_paginated_request(filter_params):
 
-    # Finally, return the result as json
-    return jsonify(result)
+        # Stream all records as raw documents
+        return set_etag(stream_json_array(project(Record.objects(), fields)), etag)
+
+    # Read pagination parameters (abort if invalid)
+    page_size: int = parse_page_size()
+    sort_field, descending = parse_sort(["date"], "-date")
+    cursor: str = request.args.get("cursor")
+
+    # Build filters from the request parameters
+    filters: dict = {}
+    for param in ("pid", "tag_number", "exchange"):
+        if param in request.args:
+            filters[param] = request.args.get(param).lower().strip() \
+                if param == "exchange" else request.args.get(param).strip()
+
+    try:
+        # Records on or after the start date
+        if request.args.get("from"):
+            filters["date__gte"] = dateutil.parser.isoparse(request.args.get("from"))
+
+        # Records on or before the end date. A date without a time covers
+        # the whole day
+        if request.args.get("to"):
+            date_iso_str: str = request.args.get("to")
+            if "T" in date_iso_str:
+                filters["date__lte"] = dateutil.parser.isoparse(date_iso_str)
+            else:
+                filters["date__lt"] = dateutil.parser.isoparse(date_iso_str) + timedelta(days=1)
+
+    # Handle dates that are not in ISO format
+    except ValueError:
+        return "Error! The from and to dates must be in ISO format.", 400
+
+    # Apply the filters
+    queryset = Record.objects(**filters)
+
+    # Get the requested page (the sort field is needed for the next cursor)
+    items, next_cursor = paginate(project(queryset, fields and fields + [sort_field]),
+                                  sort_field, descending, page_size, cursor)
+
+    # Return the page with the total number of matching records
+    return set_etag(json_response({
+        "items": items,
+        "total": queryset.count(),
+        "next_cursor": next_cursor
+    }), etag)
 
 
 @blueprint_ledger.route("/ledger/<string:oid>", methods=["GET"])
 def get_record(oid: str) -> Response:
     """Get a specific user (restricted to administrator+ only)
 
+    Supports the optional request parameter "fields" (comma separated)
+    to limit the fields returned.
+
     Args:
         oid (str): The object id of the record of interest
 
@@ -67,12 +145,15 @@ def get_record(oid: str) -> Response:
     # Require authentication (abort if failure)
     validate_authenticated()
 
+    # Read the requested fields (abort if invalid)
+    fields: list = parse_fields(Record)
+
     try:
-        # Find the record
-        record: Record = Record.objects.get(id=oid)
+        # Find the record, reading only the requested fields
+        record: dict = project(Record.objects, fields).as_pymongo().get(id=oid)
 
         # Return the record as json
-        return jsonify(record)
+        return json_response(record)
 
     # Handle record not found
     except Record.DoesNotExist:
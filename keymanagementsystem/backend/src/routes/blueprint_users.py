@@ -2,6 +2,9 @@
     Defines routes for user resource
 """
 
+# Import libraries
+from datetime import datetime
+
 # Import flask objects
 from flask import Blueprint, current_app, jsonify, session, abort, \
     make_response, request, Response
@@ -13,22 +16,140 @@ from mongoengine import *
 # Import schemas
 from ..schemas.user import User
 from ..schemas.key import Key
+from ..schemas.record import Record
 
 # Import validation
 from ..utils.validation import validate_authenticated_admin, \
-    validate_authenticated
+    validate_authenticated, get_authenticated_user, invalidate_session_role, \
+    cache_session_role, session_role_cache_enabled
+
+# Import transactions
+from ..utils.transactions import run_in_transaction
+
+# Import collection versions
+from ..utils.collection_versions import bump_versions_after_writes, \
+    collection_etag, abort_if_not_modified, set_etag
+
+# Import fast serialization
+from ..utils.fast_json import json_response, stream_json_array
+
+# Import sparse fieldsets
+from ..utils.fields import parse_fields, project
+
+# Import user search
+from ..utils.user_search import search_users, get_user_by_name as find_user_by_name, \
+    DEFAULT_SEARCH_LIMIT, MAX_SEARCH_LIMIT
+
+# Import pagination
+from ..utils.pagination import parse_page_size
+
+# Import response cache
+from ..utils.response_cache import get_cached_response, cache_response, \
+    invalidate_cached_responses
 
 # Define the blueprint
 blueprint_users: Blueprint = Blueprint(
     name="blueprint_users", import_name=__name__)
 
+# User routes also write keys (owners) and the ledger (checkouts)
+blueprint_users.after_request(bump_versions_after_writes("users", "keys", "ledger"))
+
+
+# region Helpers
+
+# Reference fields that GET routes can replace with the documents they
+# point to (through the "expand" request parameter)
+EXPANDABLE_FIELDS = ["owned_keys"]
+
+
+def parse_expand() -> bool:
+    """Reads the expand request parameter.
+    Triggers abort if it names a field that cannot be expanded.
+
+    Returns:
+        bool: True if the owned keys should be embedded in each user
+    """
+
+    expand: list = [field.strip() for field in request.args.get("expand", "").split(",")
+                    if field.strip()]
+
+    unknown: list = [field for field in expand if field not in EXPANDABLE_FIELDS]
+    if unknown:
+        abort(make_response(
+            f"Error! Cannot expand {', '.join(unknown)}. Choose from {', '.join(EXPANDABLE_FIELDS)}.", 400))
+
+    return "owned_keys" in expand
+
+
+def fetch_owned_keys(key_ids: list, fields: list = None) -> list:
+    """Read the keys a user owns in a single query (instead of one query
+    per reference), in the order they were added
+
+    Args:
+        key_ids (list): The object ids of the user's keys
+        fields (list): The key fields to return (all if None)
+
+    Returns:
+        list: The raw keys
+    """
+
+    if not key_ids:
+        return []
+
+    keys: dict = {key["_id"]: key for key in
+                  project(Key.objects(id__in=key_ids), fields).as_pymongo()}
+
+    return [keys[key_id] for key_id in key_ids if key_id in keys]
+
+
+def owned_keys_response(key_ids: list, fields: list = None) -> Response:
+    """Serialize the keys a user owns (in the order they were added),
+    reading only the requested fields
+
+    Args:
+        key_ids (list): The object ids of the user's keys
+        fields (list): The key fields to return (all if None)
+
+    Returns:
+        Response: A JSON array of the keys
+    """
+
+    return json_response(fetch_owned_keys(key_ids, fields))
+
+
+def embed_owned_keys(users: list) -> list:
+    """Replace the key ids in owned_keys with the keys themselves, reading
+    the keys of every user in a single query
+
+    Args:
+        users (list): The raw users
+
+    Returns:
+        list: The same users
+    """
+
+    key_ids: list = [key_id for user in users for key_id in user.get("owned_keys", [])]
+    keys: dict = {key["_id"]: key for key in fetch_owned_keys(list(dict.fromkeys(key_ids)))}
+
+    for user in users:
+        if "owned_keys" in user:
+            user["owned_keys"] = [keys[key_id] for key_id in user["owned_keys"] if key_id in keys]
+
+    return users
+
+# endregion
+
 
 # region Routes
 
 
 @blueprint_users.route("/users", methods=["GET"])
 def get_all_users() -> Response:
-    """Get all users (restricted to adminstrator+ only)
+    """Get all users (restricted to adminstrator+ only). The optional
+    request parameter "fields" (comma separated) limits the fields returned
+    for each user, and "expand=owned_keys" returns each user's keys instead
+    of their ids. Answers 304 if the If-None-Match header holds the
+    current ETag
 
     Returns:
         Response: A JSON array of all users
@@ -37,21 +158,28 @@ def get_all_users() -> Response:
     # Require admin priviledges (abort if failure)
     validate_authenticated_admin()
 
-    # Get all users
-    result: list = User.objects()
+    # Read the requested fields (abort if invalid)
+    fields: list = parse_fields(User)
+    expand: bool = parse_expand()
 
-    # If there was nothing in the database, return an empty list
-    if not result:
-        return jsonify([])
+    # Skip the query if the client already has the current users
+    etag: str = collection_etag("users", "keys") if expand else collection_etag("users")
+    abort_if_not_modified(etag)
 
-    # Finally, return the result as json
-    return jsonify(result)
+    # Stream all users as raw documents, reading the keys of each chunk
+    # of users in one query
+    return set_etag(stream_json_array(project(User.objects(), fields),
+                                      map_chunk=embed_owned_keys if expand else None), etag)
 
 
 @blueprint_users.route("/users/<string:pid>", methods=["GET"])
 def get_user(pid: str) -> Response:
     """Get a specific user (restricted to administrator+ only)
 
+    Supports the optional request parameters "fields" (comma separated)
+    to limit the fields returned and "expand=owned_keys" to return the
+    user's keys instead of their ids.
+
     Args:
         pid (str): The pid for the user of interest
 
@@ -62,12 +190,16 @@ def get_user(pid: str) -> Response:
     # Require admin priviledges (abort if failure)
     validate_authenticated_admin()
 
+    # Read the requested fields (abort if invalid)
+    fields: list = parse_fields(User)
+    expand: bool = parse_expand()
+
     try:
-        # Find the user
-        user: User = User.objects.get(pid=pid)
+        # Find the user, reading only the requested fields
+        user: dict = project(User.objects, fields).as_pymongo().get(pid=pid)
 
         # Return the user as json
-        return jsonify(user)
+        return json_response(embed_owned_keys([user])[0] if expand else user)
 
     # Handle user not found
     except User.DoesNotExist:
@@ -77,34 +209,73 @@ def get_user(pid: str) -> Response:
     except Exception as e:
         return f"Error with getting user: {e}", 400
 
+@blueprint_users.route("/users/search", methods=["GET"])
+def search_all_users() -> Response:
+    """Search users by name (restricted to administrator+ only)
+
+    Takes the request parameters "q" (the name or part of it, matched
+    ignoring case, as a prefix or by how it sounds), "limit", "cursor"
+    and "fields" (comma separated). Answers 304 if the If-None-Match
+    header holds the current ETag
+
+    Returns:
+        Response: A json like { items, next_cursor } with the best matches
+        first. Each user has a "score": 4 if the whole name matched, 3 if
+        the name starts with the query, 2 if every word starts a word of
+        the name, 1 if every word sounds like one
+    """
+
+    # Require admin priviledges (abort if failure)
+    validate_authenticated_admin()
+
+    # Read the search parameters (abort if invalid)
+    query: str = request.args.get("q", "").strip()
+    if not query:
+        return "Error! Search text (q) is required.", 400
+    limit: int = parse_page_size(DEFAULT_SEARCH_LIMIT, MAX_SEARCH_LIMIT)
+    fields: list = parse_fields(User)
+
+    # Skip the query if the client already has the current results
+    etag: str = collection_etag("users")
+    abort_if_not_modified(etag)
+
+    # Find one page of users
+    items, next_cursor = search_users(query, limit, request.args.get("cursor"), fields)
+
+    return set_etag(json_response({
+        "items": items,
+        "next_cursor": next_cursor
+    }), etag)
+
+
 @blueprint_users.route("/users/name/<string:full_name>", methods=["GET"])
 def get_user_by_name(full_name: str) -> Response:
-    """Get a specific user (restricted to administrator+ only)
+    """Get a specific user (restricted to administrator+ only). The name is
+    matched ignoring case and spacing
+
+    Supports the optional request parameters "fields" (comma separated)
+    to limit the fields returned and "expand=owned_keys" to return the
+    user's keys instead of their ids.
 
     Args:
         full_name (str): The full name
 
     Returns:
-        Response: A JSON of the user. Otherwise, a response indicating failure
+        Response: A JSON of the user. Otherwise, a response indicating
+        failure (409 listing their pids if several users share the name)
     """
 
     # Require admin priviledges (abort if failure)
     validate_authenticated_admin()
 
-    try:
-        # Find the user
-        user: User = User.objects.get(full_name=full_name)
+    # Read the requested fields (abort if invalid)
+    fields: list = parse_fields(User)
+    expand: bool = parse_expand()
 
-        # Return the user as json
-        return jsonify(user)
-
-    # Handle user not found
-    except User.DoesNotExist:
-        return f"Error! User with full_name: {full_name} does not exist in database!", 404
+    # Find the user, reading only the requested fields (abort if not exactly one)
+    user: dict = find_user_by_name(full_name, fields)
 
-    # Catch all other errors
-    except Exception as e:
-        return f"Error with getting user: {e}", 400
+    return json_response(embed_owned_keys([user])[0] if expand else user)
 
 
 @blueprint_users.route("/users", methods=["POST"])
@@ -184,18 +355,33 @@ def update_user(pid: str) -> Response:
     data = request.get_json()
 
     try:
-        # Find the user in the database
-        user: User = User.objects.get(pid=pid)
+        # Find the user in the database (unless they are the one asking)
+        user: User = get_authenticated_user() if session["pid"] == pid \
+            else User.objects.get(pid=pid)
 
         # Update role
         if "role" in data:
             role: str = str(data["role"]).lower().strip()
-            user.update(set__role=role)
+            if role != user.role:
+                # Bump the role version so sessions caching the old role
+                # are refreshed early
+                user = User.objects(id=user.id).modify(
+                    new=True, set__role=role, inc__role_version=1)
+                invalidate_session_role(user.pid, user.role_version)
+
+                # Refresh the caller's own session right away
+                if session_role_cache_enabled() and session["pid"] == user.pid:
+                    cache_session_role(user)
 
         # Update full name
         if "full_name" in data:
             full_name: str = str(data["full_name"]).strip()
-            user.update(set__full_name=full_name)
+
+            # Validate the name, which also rebuilds the name search fields
+            user.full_name = full_name
+            user.validate()
+            user.update(set__full_name=full_name, set__name_key=user.name_key,
+                        set__name_terms=user.name_terms, set__name_sounds=user.name_sounds)
 
         # Report done
         return f"Sucessfully updated user with pid {pid}", 200
@@ -223,7 +409,9 @@ def update_user(pid: str) -> Response:
 
 @blueprint_users.route("/users/<string:pid>", methods=["DELETE"])
 def delete_user(pid: str) -> Response:
-    """Delete a specific user (restricted to administator+ only)
+    """Delete a specific user (restricted to administator+ only). Every key
+    they held is made available again and its return recorded in the
+    ledger, in the same transaction
 
     Args:
         pid (str): The pid for the user of interest
@@ -236,19 +424,66 @@ def delete_user(pid: str) -> Response:
     # Require admin priviledges (abort if failure)
     validate_authenticated_admin()
 
+    # Comment of the ledger records of the returned keys
+    comment: str = f"Auto-Generated: user deleted by {session['pid']}"
+
+    # The role version of the deleted user, once deleted
+    deleted_role_version: list = []
+
+    def cascade(db_session) -> list:
+        # Delete the user first. This is the step that decides whether
+        # anything else is written, and returns the keys they held
+        deleted: dict = User._get_collection().find_one_and_delete(
+            {"pid": pid}, projection={"owned_keys": 1, "role_version": 1}, session=db_session)
+
+        # The user does not exist (anymore), nothing else to write
+        if deleted is None:
+            return None
+        deleted_role_version[:] = [deleted.get("role_version", 0)]
+
+        # Their keys are those naming them as owner, plus those they
+        # reference that nobody else claims
+        held: dict = {"$or": [
+            {"owner_pid": pid},
+            {"_id": {"$in": deleted.get("owned_keys", [])}, "owner_pid": {"$in": [None, pid]}}
+        ]}
+        keys: list = list(Key._get_collection().find(held, {"tag_number": 1}, session=db_session))
+        if not keys:
+            return keys
+
+        # Return every key in one write
+        Key._get_collection().update_many(
+            {"_id": {"$in": [key["_id"] for key in keys]}},
+            {"$set": {"is_available": True}, "$unset": {"owner_pid": ""}},
+            session=db_session)
+
+        # Record the returns in one write
+        now: datetime = datetime.now()
+        Record._get_collection().insert_many([Record(
+            tag_number=key["tag_number"],
+            pid=pid,
+            date=now,
+            exchange="returned",
+            comment=comment
+        ).to_mongo() for key in keys], session=db_session)
+
+        return keys
+
     try:
-        # Find the user
-        user: User = User.objects.get(pid=pid)
+        # Delete the user and return their keys in a single transaction
+        returned: list = run_in_transaction(cascade)
 
-        # Delete the user
-        user.delete()
+        # Handle user not found
+        if returned is None:
+            return f"Error! User with pid: {pid} does not exist in our database!  Instruct this user to create an account by logging into the website with their PID.", 404
 
-        # Report done
-        return f"Sucessfully deleted user with pid {pid}", 200
+        # Stop trusting the role cached in the deleted user's sessions
+        invalidate_session_role(pid, deleted_role_version[0] + 1)
 
-    # Handle user not found
-    except User.DoesNotExist:
-        return f"Error! User with pid: {pid} does not exist in our database!  Instruct this user to create an account by logging into the website with their PID.", 404
+        invalidate_cached_responses("users", "keys")
+
+        # Report done
+        return f"Sucessfully deleted user with pid {pid} and returned {len(returned)} keys", 200
 
     # Catch all other errors
     except Exception as e:
@@ -259,6 +494,9 @@ def delete_user(pid: str) -> Response:
 def user_get_keys(pid: str) -> Response:
     """Get a specific user's keys
 
+    Supports the optional request parameter "fields" (comma separated)
+    to limit the key fields returned.
+
     Args:
         pid (str): The pid for the user of interest
 
@@ -269,16 +507,22 @@ def user_get_keys(pid: str) -> Response:
     # Require authentiation (abort if failure)
     validate_authenticated()
 
+    # Read the requested fields (abort if invalid)
+    fields: list = parse_fields(Key)
+
+    # Serve the keys from the cache if they are still current
+    version: str = collection_etag("users", "keys")
+    cached: Response = get_cached_response(("users", "keys"), version)
+    if cached:
+        return cached
+
     try:
-        # Find the user
-        user: User = User.objects.get(pid=pid)
+        # Read only the ids of the user's keys
+        user: dict = User.objects.only("owned_keys").as_pymongo().get(pid=pid)
 
-        # If the user has no keys, return an empty list.
-        # Otherwise, return what they have
-        if user.owned_keys == None or len(user.owned_keys) == 0:
-            return jsonify([])
-        else:
-            return jsonify(user.owned_keys)
+        # Read every key in one query, projecting the requested fields
+        return cache_response(("users", "keys"), version,
+                              owned_keys_response(user.get("owned_keys", []), fields))
 
     # Handle user not found
     except User.DoesNotExist:
@@ -291,42 +535,41 @@ def user_get_keys(pid: str) -> Response:
 
 @blueprint_users.route("/users/name/<string:full_name>/keys", methods=["GET"])
 def user_get_keys_by_name(full_name: str) -> Response:
-    """Get a specific user's keys
+    """Get a specific user's keys. The name is matched ignoring case and
+    spacing
+
+    Supports the optional request parameter "fields" (comma separated)
+    to limit the key fields returned.
 
     Args:
+        full_name (str): The full name
 
     Returns:
-        Response: A JSON array of the user's keys
+        Response: A JSON array of the user's keys. Otherwise, a response
+        indicating failure (409 listing their pids if several users share
+        the name)
     """
 
     # Require authentiation (abort if failure)
     validate_authenticated()
-    # console.log("Hi")
-    try:
-        # Find the user
-        user: User = User.objects.get(full_name=full_name)
 
-        # If the user has no keys, return an empty list.
-        # Otherwise, return what they have
-        
-        if user.owned_keys == None or len(user.owned_keys) == 0:
-            return jsonify([])
-        else:
-            return jsonify(user.owned_keys)
+    # Read the requested fields (abort if invalid)
+    fields: list = parse_fields(Key)
 
-    # Handle user not found
-    except User.DoesNotExist:
-        return f"Error! User with name: {full_name} does not exist in our database!", 404
+    # Find the user (abort if not exactly one has the name)
+    user: dict = find_user_by_name(full_name, ["owned_keys"])
 
-    # Catch all other errors
-    except Exception as e:
-        mult =  User.objects.get(full_name=full_name).values()
-        return f"Multiple users with that name: {mult}. Error: {e}", 400
+    # Return their keys, reading only the requested fields
+    return owned_keys_response(user.get("owned_keys", []), fields)
 
 
 @blueprint_users.route("/users/<string:pid>/keys/<string:tag_number>", methods=["POST"])
 def user_add_key(pid: str, tag_number: str) -> Response:
-    """Add a key for a specific user (restricted to adminstrator+)
+    """Check out a key for a specific user (restricted to adminstrator+)
+
+    Claiming the key, adding it to the user and writing the "acquired"
+    ledger record happen in a single transaction. An optional JSON body
+    like { "comment": str } sets the comment of the record.
 
     Args:
         pid (str): The pid for the user of interest
@@ -334,33 +577,78 @@ def user_add_key(pid: str, tag_number: str) -> Response:
 
     Returns:
         Response: A response indicating whether adding a key to the user
-        was successful or not
+        was successful or not. Returns 409 if the key was not available
     """
 
     # Require admin priviledges (abort if failure)
     validate_authenticated_admin()
 
+    # Get the (optional) json from the body
+    data: dict = request.get_json(silent=True) or {}
+
     try:
 
         # Find the user
-        user: User = User.objects.get(pid=pid)
-
-        # Find the key
-        key: Key = Key.objects.get(tag_number=tag_number)
-
-        # Do not add the key if they already own it
-        if key in user.owned_keys:
-            return f"Error! {pid} already owns this key!", 400
-
-        # Ensure they key was even available
-        if not key.is_available:
-            return f"Error! Tried to assign {pid} to key with tag number {tag_number} but it isn't available!", 400
-
-        # Update the key state to false
-        key.update(set__is_available=False)
+        user: User = User.objects.only("id", "pid").get(pid=pid)
 
-        # Add the key to the user
-        user.update(push__owned_keys=key)
+        # Build the ledger record first so a bad comment fails before any write
+        record: Record = Record(
+            tag_number=tag_number,
+            pid=pid,
+            date=datetime.now(),
+            exchange="acquired",
+            comment=str(data.get("comment", "Auto-Generated")).strip()
+        )
+        record.validate()
+
+        def checkout(db_session) -> dict:
+            # Claim the key only if it is still available. This is the
+            # single atomic step that decides which request wins
+            claimed: dict = Key._get_collection().find_one_and_update(
+                {"tag_number": tag_number, "is_available": True},
+                {"$set": {"is_available": False, "owner_pid": pid}},
+                session=db_session)
+
+            # Lost the claim, nothing else to write
+            if claimed is None:
+                return None
+
+            try:
+                # Add the key to the user
+                User._get_collection().update_one(
+                    {"_id": user.id}, {"$addToSet": {"owned_keys": claimed["_id"]}},
+                    session=db_session)
+
+                # Record the exchange in the ledger
+                Record._get_collection().insert_one(record.to_mongo(), session=db_session)
+
+            except Exception:
+                # Without a transaction, release the claim by hand, and take
+                # the key back off the user if it was already added
+                if db_session is None:
+                    Key._get_collection().update_one(
+                        {"_id": claimed["_id"], "owner_pid": pid},
+                        {"$set": {"is_available": True}, "$unset": {"owner_pid": ""}})
+                    User._get_collection().update_one(
+                        {"_id": user.id}, {"$pull": {"owned_keys": claimed["_id"]}})
+                raise
+
+            return claimed
+
+        # Check out the key
+        claimed: dict = run_in_transaction(checkout)
+        if claimed is not None:
+            invalidate_cached_responses("users", "keys")
+
+        # If the claim lost, find out why
+        if claimed is None:
+            key: Key = Key.objects.only("owner_pid").get(tag_number=tag_number)
+
+            # Do not add the key if they already own it
+            if key.owner_pid == pid:
+                return f"Error! {pid} already owns this key!", 400
+
+            return f"Error! Tried to assign {pid} to key with tag number {tag_number} but it isn't available!", 409
 
         # Report done
         return f"Sucessfully added key with tag {tag_number} for user with pid {pid}", 200
@@ -373,6 +661,10 @@ def user_add_key(pid: str, tag_number: str) -> Response:
     except Key.DoesNotExist:
         return f"Error! Key with tag: {tag_number} does not exist in our database!", 404
 
+    # Handle bad values
+    except ValidationError as verror:
+        return f"Error on adding key to user: {verror}. Regex errors suggest mistakenly using special characters!", 400
+
     # Catch all other errors
     except Exception as e:
         return f"Error with adding key to user: {e}", 400
@@ -396,21 +688,21 @@ def user_remove_key(pid: str, tag_number: str):
 
     try:
 
-        # Find the user
-        user: User = User.objects.get(pid=pid)
+        # Find the user (unless they are the one asking)
+        user: User = get_authenticated_user() if session["pid"] == pid \
+            else User.objects.only("id", "pid").get(pid=pid)
 
         # Find the key
-        key: Key = Key.objects.get(tag_number=tag_number)
+        key: Key = Key.objects.only("id").get(tag_number=tag_number)
 
-        # Error if the user doesn't own this key
-        if key not in user.owned_keys:
+        # Remove the key from the user, matching on the reference so the
+        # owned keys are never loaded. Error if the user doesn't own it
+        if not User.objects(id=user.id, owned_keys=key.id).update(pull__owned_keys=key.id):
             return f"Error, the key you specified is not owned by the user!", 400
 
-        # Remove the key from the user
-        user.update(pull__owned_keys=key)
-
-        # Make sure the changes are saved to the database
-        user.save()
+        # Clear the key's owner if it still points at this user
+        Key.objects(id=key.id, owner_pid=user.pid).update(unset__owner_pid=True)
+        invalidate_cached_responses("users", "keys")
 
         # Report done
         return f"Sucessfully removed key with tag number {tag_number} from user with pid {pid}", 200
@@ -0,0 +1,56 @@
+"""
+    The schema for an email waiting in the outbox
+"""
+
+# Import libraries
+from datetime import datetime
+
+# Import mongo objects
+from mongoengine import Document, ListField, StringField, IntField, DateTimeField
+
+# Restrictions
+MAX_SUBJECT_LENGTH = 255
+VALID_STATUSES = ["queued", "sending", "sent", "dead"]  # statuses can only be these
+
+
+class Email(Document):
+    """
+        Defines an email document in the outbox
+    """
+
+    # Needed to define the name of the collection
+    # By default, it would be named "email" not "outbox"
+    # The index backs workers looking for the next email that is due
+    # Indexes are only built by "flask db indexes", never by a request
+    meta = {
+        "collection": "outbox",
+        "auto_create_index": False,
+        "indexes": [("status", "next_attempt_at")]
+    }
+
+    # Fields
+
+    subject = StringField(required=True, max_length=MAX_SUBJECT_LENGTH)
+
+    sender = StringField(required=True)
+
+    recipients = ListField(StringField(), required=True)
+
+    body = StringField(required=True)
+
+    status = StringField(required=True, choices=VALID_STATUSES, default="queued")
+
+    # Number of delivery attempts so far
+    attempts = IntField(required=True, default=0)
+
+    # The email is not sent before this time (used for backing off)
+    next_attempt_at = DateTimeField(required=True, default=datetime.now)
+
+    # When a worker claimed the email, to recover from crashed workers
+    locked_at = DateTimeField(required=False)
+
+    last_error = StringField(required=False)
+
+    created_at = DateTimeField(required=True, default=datetime.now)
+
+    sent_at = DateTimeField(required=False)
@@ -2,6 +2,9 @@
     The schema for keys
 """
 
+# Import libraries
+import re
+
 # Import mongo objects
 from mongoengine import Document, ListField, StringField, IntField, BooleanField
 
@@ -26,6 +29,41 @@ VALID_LOCATION_REGEX = r"^[\-a-zA-Z0-9 ]+$"
 
 MIN_STRING_LENGTH = 1
 
+# Fields the server keeps for itself and never sends to clients
+INTERNAL_FIELDS = ["search_terms"]
+
+# Words are runs of letters and digits. Mixed words like "mcb116" are also
+# split into "mcb" and "116" so room numbers match on their own
+SEARCH_WORD_REGEX = re.compile(r"[a-z0-9]+")
+SEARCH_PART_REGEX = re.compile(r"[a-z]+|[0-9]+")
+
+
+def search_words(text: str) -> list:
+    """
+        Splits text into lowercase words for searching
+    """
+
+    return SEARCH_WORD_REGEX.findall(str(text).lower())
+
+
+def build_search_terms(*values: str) -> list:
+    """
+        Builds the normalized, de-duplicated search terms of a key from its
+        searchable field values
+    """
+
+    terms: dict = {}
+    for value in values:
+        if value is None:
+            continue
+        for word in search_words(value):
+            terms[word] = True
+            parts: list = SEARCH_PART_REGEX.findall(word)
+            if len(parts) > 1:
+                terms.update(dict.fromkeys(parts, True))
+
+    return list(terms)
+
 
 class Key(Document):
     """
@@ -34,7 +72,18 @@ class Key(Document):
 
     # Needed to define the name of the collection
     # By default, it would be named "key" not "keys"
-    meta = {'collection': 'keys'}
+    # A series id and sequence id pair must be unique
+    # The search terms index backs GET /keys/search
+    # Indexes are only built by "flask db indexes", never by a request
+    meta = {
+        'collection': 'keys',
+        'auto_create_index': False,
+        'indexes': [
+            {'fields': ('series_id', 'sequence_id'), 'unique': True},
+            'owner_pid',
+            'search_terms'
+        ]
+    }
 
     # Fields
     tag_number = StringField(required=True, min_length=MIN_STRING_LENGTH, 
@@ -57,4 +106,21 @@ class Key(Document):
 
     is_available = BooleanField(required=True)
 
-    comment = StringField(required=False, min_length=0)
\ No newline at end of file
+    comment = StringField(required=False, min_length=0)
+
+    # The pid of the user currently holding this key. This mirrors
+    # User.owned_keys so the owner can be found without searching users
+    owner_pid = StringField(required=False)
+
+    # Normalized words of the tag number, series id, building, locations
+    # and comment. Kept up to date by clean(), which runs on validate()
+    search_terms = ListField(StringField(), required=False)
+
+    def clean(self):
+        """
+            Keeps the search terms in sync with the searchable fields
+        """
+
+        self.search_terms = build_search_terms(
+            self.tag_number, self.series_id, self.building,
+            *(self.location or []), self.comment)
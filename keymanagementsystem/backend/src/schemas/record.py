@@ -23,7 +23,19 @@ class Record(Document):
 
     # Needed to define the name of the collection
     # By default, it would be named "Record" not "ledger"
-    meta = {"collection": "ledger"}
+    # The indexes back paginating by (date, _id) and filtering by
+    # pid, tag number and exchange within a date range
+    # Indexes are only built by "flask db indexes", never by a request
+    meta = {
+        "collection": "ledger",
+        "auto_create_index": False,
+        "indexes": [
+            ("date", "id"),
+            ("pid", "date", "id"),
+            ("tag_number", "date", "id"),
+            ("exchange", "date", "id")
+        ]
+    }
 
     # Fields
 
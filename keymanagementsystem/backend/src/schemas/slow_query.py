@@ -0,0 +1,54 @@
+"""
+    The schema for a captured slow query
+"""
+
+# Import libraries
+from datetime import datetime
+
+# Import mongo objects
+from mongoengine import Document, StringField, FloatField, BooleanField, \
+    DateTimeField, ListField
+
+# Restrictions
+MAX_LOG_BYTES = 5 * 1024 * 1024
+MAX_LOG_DOCUMENTS = 1000
+
+
+class SlowQuery(Document):
+    """
+        Defines a slow query with a summary of its query plan. Values in the
+        query are redacted, so only its shape is stored
+    """
+
+    # Needed to define the name of the collection
+    # The collection is capped, so the oldest entries make room for new ones
+    meta = {
+        "collection": "slow_queries",
+        "max_size": MAX_LOG_BYTES,
+        "max_documents": MAX_LOG_DOCUMENTS
+    }
+
+    # Fields
+
+    command = StringField(required=True)
+
+    # The collection the query ran on
+    target = StringField(required=True)
+
+    # The filter (and sort or pipeline) with every value replaced by "?",
+    # as JSON (operators like $in cannot be field names on older servers)
+    shape = StringField(required=True)
+
+    duration_ms = FloatField(required=True)
+
+    # The method and endpoint of the request that ran the query
+    route = StringField(required=False)
+
+    # The stages of the winning plan, outermost first (e.g. FETCH, IXSCAN)
+    plan = ListField(StringField(), required=False)
+
+    indexes = ListField(StringField(), required=False)
+
+    collection_scan = BooleanField(required=False)
+
+    captured_at = DateTimeField(required=True, default=datetime.now)
@@ -2,8 +2,11 @@
     The schema for a user
 """
 
+# Import libraries
+import re
+
 # Import mongo objects
-from mongoengine import Document, ListField, StringField, ReferenceField
+from mongoengine import Document, ListField, StringField, ReferenceField, IntField
 
 # Import schemas
 from .key import Key
@@ -21,6 +24,56 @@ VALID_FULL_NAME_REGEX = r"^[a-zA-Z\s]+$"
 VALID_ROLES = ["requestor", "administrator",
                "sudo"]
 
+# Fields the server keeps for itself and never sends to clients
+INTERNAL_FIELDS = ["name_key", "name_terms", "name_sounds"]
+
+# Letters that sound alike share a Soundex digit (vowels, h, w and y have none)
+SOUNDEX_DIGITS: dict = {letter: digit for letters, digit in
+                        [("bfpv", "1"), ("cgjkqsxz", "2"), ("dt", "3"),
+                         ("l", "4"), ("mn", "5"), ("r", "6")]
+                        for letter in letters}
+NAME_WORD_REGEX = re.compile(r"[a-z]+")
+
+
+def name_words(text: str) -> list:
+    """
+        Splits a name into lowercase words
+    """
+
+    return NAME_WORD_REGEX.findall(str(text).lower())
+
+
+def normalize_name(text: str) -> str:
+    """
+        Normalizes a name for comparing (lowercase, single spaces)
+    """
+
+    return " ".join(name_words(text))
+
+
+def soundex(word: str) -> str:
+    """
+        Encodes a word by how it sounds, so small misspellings of a name
+        share a code (e.g. "smith" and "smyth" are both "s530")
+    """
+
+    word = word.lower()
+    if not word:
+        return ""
+
+    code: str = word[0]
+    previous: str = SOUNDEX_DIGITS.get(word[0], "")
+    for letter in word[1:]:
+        digit: str = SOUNDEX_DIGITS.get(letter, "")
+        if digit and digit != previous:
+            code += digit
+
+        # "h" and "w" do not separate letters with the same digit
+        if letter not in "hw":
+            previous = digit
+
+    return (code + "000")[:4]
+
 
 
 class User(Document):
@@ -30,15 +83,44 @@ class User(Document):
 
     # Needed to define the name of the collection
     # By default, it would be named "User" not "Users"
-    meta = {'collection': 'users'}
+    # Index owned_keys (a multikey index) so finding the owner of a key
+    # does not scan every user
+    # The name indexes back GET /users/search and the lookups by name
+    # Indexes are only built by "flask db indexes", never by a request
+    meta = {
+        'collection': 'users',
+        'auto_create_index': False,
+        'indexes': ['owned_keys', 'name_key', 'name_terms', 'name_sounds']
+    }
 
     # Fields
 
-    pid = StringField(required=True, min_length=MIN_PID_LENGTH, max_length=MAX_PID_LENGTH)
+    pid = StringField(required=True, min_length=MIN_PID_LENGTH, max_length=MAX_PID_LENGTH,
+                      unique=True)
 
     full_name = StringField(required=True, min_length=MIN_FULL_NAME_LENGTH,
                             max_length=MAX_FULL_NAME_LENGTH, regex=VALID_FULL_NAME_REGEX)
 
     role = StringField(required=True, choices=VALID_ROLES)
 
+    # Incremented on every role change so roles cached in sessions
+    # can be invalidated
+    role_version = IntField(required=False, default=0)
+
     owned_keys = ListField(ReferenceField(Key), required=False)
+
+    # The normalized full name, its words and their Soundex codes.
+    # Kept up to date by clean(), which runs on validate()
+    name_key = StringField(required=False)
+    name_terms = ListField(StringField(), required=False)
+    name_sounds = ListField(StringField(), required=False)
+
+    def clean(self):
+        """
+            Keeps the name search fields in sync with the full name
+        """
+
+        words: list = name_words(self.full_name or "")
+        self.name_key = " ".join(words)
+        self.name_terms = list(dict.fromkeys(words))
+        self.name_sounds = list(dict.fromkeys(soundex(word) for word in words))
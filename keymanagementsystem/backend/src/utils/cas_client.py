@@ -0,0 +1,158 @@
+"""
+    Utility script for verifying CAS tickets. A CAS client is built for
+    each request, since its service URL depends on the request, while the
+    HTTP connections to the CAS server are kept alive in a pool shared by
+    the threads of this process
+"""
+
+# Import libraries
+import threading
+import time
+from typing import Optional
+from xml.etree.ElementTree import ParseError
+
+# Import flask objects
+from flask import Flask, current_app
+
+# Import HTTP objects
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Import CAS
+from cas import CASClient
+
+# Import metrics
+from .metrics import observe_cas_verification
+
+# Defaults for the CAS_* config settings
+DEFAULT_SERVER_URL = "https://login.vt.edu/profile/cas/login"
+DEFAULT_SERVICE_URL = "https://keymanagement.discovery.cs.vt.edu/api/cas/login_callback"
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 3.0
+DEFAULT_READ_TIMEOUT = 5.0
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """
+        An HTTP adapter that gives every request a default timeout, since
+        the CAS client sends its requests without one
+    """
+
+    def __init__(self, timeout: tuple, *args, **kwargs):
+        self.timeout: tuple = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def create_cas_session(app: Flask) -> requests.Session:
+    """Create the HTTP session used to reach the CAS server. It keeps up to
+    CAS_POOL_SIZE (10) connections alive and gives up on a request after
+    CAS_CONNECT_TIMEOUT (3) seconds to connect or CAS_READ_TIMEOUT (5)
+    seconds waiting for the answer
+
+    Args:
+        app (Flask): The application
+
+    Returns:
+        requests.Session: The session
+    """
+
+    # Retry a failed connection once. A ticket is used up once CAS has
+    # read it, so requests that reached the server are never resent
+    retries: Retry = Retry(total=1, connect=1, read=0, status=0, redirect=0)
+    adapter: TimeoutHTTPAdapter = TimeoutHTTPAdapter(
+        timeout=(float(app.config.get("CAS_CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT)),
+                 float(app.config.get("CAS_READ_TIMEOUT", DEFAULT_READ_TIMEOUT))),
+        pool_connections=1,
+        pool_maxsize=int(app.config.get("CAS_POOL_SIZE", DEFAULT_POOL_SIZE)),
+        max_retries=retries)
+
+    session: requests.Session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# Guards creating the session of this process
+session_lock: threading.Lock = threading.Lock()
+
+
+def get_cas_session(app: Flask) -> requests.Session:
+    """Get the CAS session of this process, creating it on first use
+    (so it is never shared across forked processes)
+
+    Args:
+        app (Flask): The application
+
+    Returns:
+        requests.Session: The session
+    """
+
+    with session_lock:
+        if "cas_session" not in app.extensions:
+            app.extensions["cas_session"] = create_cas_session(app)
+        return app.extensions["cas_session"]
+
+
+def get_cas_client(service_url: Optional[str] = None) -> CASClient:
+    """Build a CAS client for the current request. Clients are cheap and
+    never shared, so concurrent logins cannot change each other's service
+    URL. The CAS server is CAS_SERVER_URL
+
+    Args:
+        service_url (str): Where CAS sends the user back after logging in
+
+    Returns:
+        CASClient: The client
+    """
+
+    app: Flask = current_app._get_current_object()
+    return CASClient(version=2,
+                     server_url=app.config.get("CAS_SERVER_URL", DEFAULT_SERVER_URL),
+                     service_url=service_url,
+                     verify_ssl_certificate=app.config.get("CAS_VERIFY_SSL", True),
+                     session=get_cas_session(app))
+
+
+def get_service_url(destination: str) -> str:
+    """Get the service URL of a login, which CAS_SERVICE_URL points at the
+    login callback. Logging in and verifying the ticket must use the same one
+
+    Args:
+        destination (str): Where to send the client after logging in
+
+    Returns:
+        str: The service URL
+    """
+
+    base_service_url: str = current_app.config.get("CAS_SERVICE_URL", DEFAULT_SERVICE_URL)
+    return base_service_url + f"?destination={destination}"
+
+
+def verify_cas_ticket(ticket: str, service_url: str) -> Optional[str]:
+    """Ask the CAS server whether a ticket is valid, recording how long it
+    took. A CAS server that is down, slow or answering nonsense counts as a
+    failed verification
+
+    Args:
+        ticket (str): The ticket CAS gave the client
+        service_url (str): The service URL the ticket was issued for
+
+    Returns:
+        Optional[str]: The PID of the user, or None if not verified
+    """
+
+    started: float = time.perf_counter()
+    try:
+        pid, _, _ = get_cas_client(service_url).verify_ticket(ticket)
+    except (requests.RequestException, ParseError, IndexError) as e:
+        current_app.logger.warning("Could not verify a CAS ticket: %s", e)
+        pid = None
+
+    observe_cas_verification(time.perf_counter() - started, bool(pid))
+    return pid
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+    A stand-in CAS 2 server for local development and offline load tests.
+    It logs everyone in without a password, so never expose it. Run it from
+    src/utils as
+
+        python cas_stub.py --port 8089 --users 50
+
+    and set CAS_SERVER_URL = "http://localhost:8089/cas/login" (and
+    CAS_SERVICE_URL to the local login callback) in config.py. Logging in
+    through /api/cas/login then redirects straight back with a ticket for
+    the next of the users stub0 ... stub49 (or ?pid= given to /cas/login)
+"""
+
+# Imports
+import argparse
+import itertools
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator, Optional
+from urllib.parse import parse_qs, urlencode, urlparse
+from xml.sax.saxutils import escape
+
+# Responses of /cas/serviceValidate
+SUCCESS_XML = """<cas:serviceResponse xmlns:cas="http://www.yale.edu/tp/cas">
+    <cas:authenticationSuccess>
+        <cas:user>{pid}</cas:user>
+    </cas:authenticationSuccess>
+</cas:serviceResponse>"""
+
+FAILURE_XML = """<cas:serviceResponse xmlns:cas="http://www.yale.edu/tp/cas">
+    <cas:authenticationFailure code="INVALID_TICKET">Ticket {ticket} not recognized</cas:authenticationFailure>
+</cas:serviceResponse>"""
+
+
+class TicketStore:
+    """
+        The tickets issued and not yet validated. Like a real CAS server,
+        a ticket is valid once, and only for the service it was issued for
+    """
+
+    def __init__(self, users: int):
+        self.tickets: dict = {}  # ticket -> (service, pid)
+        self.lock: threading.Lock = threading.Lock()
+        self.pids: Iterator[str] = itertools.cycle([f"stub{i}" for i in range(users)])
+
+    def issue(self, service: str, pid: Optional[str]) -> str:
+        with self.lock:
+            ticket: str = f"ST-{uuid.uuid4().hex}"
+            self.tickets[ticket] = (service, pid or next(self.pids))
+            return ticket
+
+    def redeem(self, ticket: str, service: str) -> Optional[str]:
+        with self.lock:
+            issued: Optional[tuple] = self.tickets.pop(ticket, None)
+        if issued is None or issued[0] != service:
+            return None
+        return issued[1]
+
+
+class CASStubHandler(BaseHTTPRequestHandler):
+    """
+        Serves /cas/login, /cas/serviceValidate and /cas/logout
+    """
+
+    # Keep connections alive like a real CAS server
+    protocol_version = "HTTP/1.1"
+
+    # Set by main()
+    store: TicketStore = None
+    delay: float = 0.0
+    quiet: bool = False
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        params: dict = {name: values[0] for name, values in parse_qs(url.query).items()}
+
+        if url.path.endswith("/login"):
+            self.login(params)
+        elif url.path.endswith("/serviceValidate"):
+            self.service_validate(params)
+        elif url.path.endswith("/logout"):
+            self.send_body(200, "text/plain", "Logged out of the CAS stub")
+        else:
+            self.send_body(404, "text/plain", "Not found")
+
+    def login(self, params: dict) -> None:
+        # Send the user back to the service with a new ticket
+        service: Optional[str] = params.get("service")
+        if not service:
+            self.send_body(400, "text/plain", "No service provided")
+            return
+
+        ticket: str = self.store.issue(service, params.get("pid"))
+        separator: str = "&" if "?" in service else "?"
+        self.send_response(302)
+        self.send_header("Location", service + separator + urlencode({"ticket": ticket}))
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def service_validate(self, params: dict) -> None:
+        # Act like a CAS server under load
+        if self.delay:
+            time.sleep(self.delay)
+
+        ticket: str = params.get("ticket", "")
+        pid: Optional[str] = self.store.redeem(ticket, params.get("service", ""))
+        if pid:
+            body: str = SUCCESS_XML.format(pid=escape(pid))
+        else:
+            body: str = FAILURE_XML.format(ticket=escape(ticket))
+        self.send_body(200, "text/xml; charset=utf-8", body)
+
+    def send_body(self, status: int, content_type: str, body: str) -> None:
+        data: bytes = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args) -> None:
+        if not self.quiet:
+            super().log_message(format, *args)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run a stand-in CAS 2 server")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--users", type=int, default=1,
+                        help="Number of users (stub0, stub1, ...) to log in, in turn")
+    parser.add_argument("--delay-ms", type=float, default=0.0,
+                        help="Time to wait before answering each validation")
+    parser.add_argument("--quiet", action="store_true", help="Do not log each request")
+    args = parser.parse_args()
+
+    CASStubHandler.store = TicketStore(max(args.users, 1))
+    CASStubHandler.delay = args.delay_ms / 1000
+    CASStubHandler.quiet = args.quiet
+
+    server: ThreadingHTTPServer = ThreadingHTTPServer((args.host, args.port), CASStubHandler)
+    print(f"CAS stub listening on http://{args.host}:{args.port}/cas/login")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
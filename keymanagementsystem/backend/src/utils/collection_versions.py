@@ -0,0 +1,179 @@
+"""
+    Utility script for per-collection change counters, used as ETags so
+    clients can skip downloading collections that have not changed
+"""
+
+# Import libraries
+import threading
+import time
+import uuid
+from typing import Callable
+
+# Import flask objects
+from flask import Response, current_app, has_app_context, request, abort, make_response
+
+# Import mongo objects
+from mongoengine.connection import get_db
+from pymongo import ReturnDocument
+
+# Name of the collection holding one counter per versioned collection
+VERSIONS_COLLECTION = "collection_versions"
+
+# Request methods that never write
+SAFE_METHODS: tuple = ("GET", "HEAD", "OPTIONS")
+
+# Default number of seconds a process reuses the versions it read
+DEFAULT_VERSIONS_TTL = 1
+
+# The versions this process read last, as name -> (version, when read)
+cached_versions: dict = {}
+cached_versions_lock: threading.Lock = threading.Lock()
+
+# How many times this process bumped each collection. A read that raced a
+# bump (the count changed meanwhile) may be older, so it is not cached
+bump_counts: dict = {}
+
+
+# region Versions
+
+def get_collection_versions(*names: str) -> dict:
+    """Gets the current versions of collections with a single query,
+    creating missing counters on first use. Each counter has a random epoch
+    so that versions never repeat after the counters are dropped.
+
+    Versions read in the last COLLECTION_VERSIONS_TTL seconds (1 by
+    default, 0 to always query) are reused without querying. This process'
+    own writes drop them, so only writes by other processes can go unseen,
+    and for no longer than the TTL.
+
+    Args:
+        names (str): The names of the collections
+
+    Returns:
+        dict: The version of each collection, like "<epoch>-<counter>"
+    """
+
+    # Reuse the versions read recently
+    ttl: float = current_app.config.get("COLLECTION_VERSIONS_TTL", DEFAULT_VERSIONS_TTL) \
+        if has_app_context() else 0
+    now: float = time.monotonic()
+    with cached_versions_lock:
+        cached: dict = {name: cached_versions[name][0] for name in names
+                        if name in cached_versions and now - cached_versions[name][1] < ttl}
+        bumps_before: dict = {name: bump_counts.get(name, 0) for name in names}
+    if len(cached) == len(names):
+        return cached
+
+    versions = get_db()[VERSIONS_COLLECTION]
+    docs: dict = {doc["_id"]: doc for doc in versions.find({"_id": {"$in": list(names)}})}
+
+    # Counters are only written here the first time
+    for name in names:
+        if name not in docs:
+            docs[name] = versions.find_one_and_update(
+                {"_id": name},
+                {"$setOnInsert": {"epoch": uuid.uuid4().hex[:8], "version": 0}},
+                upsert=True, return_document=ReturnDocument.AFTER)
+
+    current: dict = {name: f"{docs[name]['epoch']}-{docs[name]['version']}" for name in names}
+    with cached_versions_lock:
+        for name, version in current.items():
+            if bump_counts.get(name, 0) == bumps_before[name]:
+                cached_versions[name] = (version, now)
+
+    return current
+
+
+def bump_collection_versions(*names: str) -> None:
+    """Records that collections changed, so clients holding their old
+    version download them again
+
+    Args:
+        names (str): The names of the collections that changed
+    """
+
+    versions = get_db()[VERSIONS_COLLECTION]
+    for name in names:
+        versions.update_one(
+            {"_id": name},
+            {"$inc": {"version": 1}, "$setOnInsert": {"epoch": uuid.uuid4().hex[:8]}},
+            upsert=True)
+
+    # Read the new versions on next use
+    with cached_versions_lock:
+        for name in names:
+            bump_counts[name] = bump_counts.get(name, 0) + 1
+            cached_versions.pop(name, None)
+
+
+def bump_versions_after_writes(*names: str) -> Callable[[Response], Response]:
+    """Builds an after_request handler that bumps the given collections'
+    versions after every request that may have written to them. Bumping
+    after the write (never before) means a client can at worst download
+    unchanged data again, but never keep stale data.
+
+    Args:
+        names (str): The names of the collections the blueprint writes to
+
+    Returns:
+        Callable[[Response], Response]: The handler to register
+    """
+
+    def bump_versions(response: Response) -> Response:
+        # Writes can happen before a request fails, so any status counts
+        if request.method not in SAFE_METHODS:
+            bump_collection_versions(*names)
+        return response
+
+    return bump_versions
+
+# endregion
+
+
+# region Conditional requests
+
+def collection_etag(*names: str) -> str:
+    """Builds the ETag of a response made from the given collections
+
+    Args:
+        names (str): The names of the collections the response is made from
+
+    Returns:
+        str: The (unquoted) ETag
+    """
+
+    versions: dict = get_collection_versions(*names)
+    return ".".join(f"{name}-{versions[name]}" for name in names)
+
+
+def abort_if_not_modified(etag: str) -> None:
+    """Answers 304 Not Modified (and aborts) if the client already holds
+    this version, before anything is queried or serialized
+
+    Args:
+        etag (str): The ETag of the current version
+    """
+
+    if request.if_none_match.contains(etag):
+        response: Response = make_response("", 304)
+        set_etag(response, etag)
+        abort(response)
+
+
+def set_etag(response: Response, etag: str) -> Response:
+    """Adds the ETag to a response and asks clients to revalidate it
+    before every reuse
+
+    Args:
+        response (Response): The response to tag
+        etag (str): The ETag of the version the response was made from
+
+    Returns:
+        Response: The tagged response
+    """
+
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+# endregion
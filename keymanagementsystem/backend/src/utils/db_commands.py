@@ -0,0 +1,226 @@
+"""
+    Management commands for maintaining the database.
+    Run them with "flask db <command>" (FLASK_APP=wsgi.py)
+"""
+
+# Import libraries
+import sys
+
+# Import flask objects
+import click
+from flask.cli import AppGroup
+
+# Import mongo objects
+from pymongo import UpdateOne
+from pymongo.errors import OperationFailure
+
+# Import schemas
+from ..schemas.key import Key
+from ..schemas.user import User
+from ..schemas.record import Record
+from ..schemas.email import Email
+
+# Import collection versions
+from .collection_versions import bump_collection_versions
+
+# Every document whose indexes are managed here
+documents: list = [Key, User, Record, Email]
+
+# Define the command group
+db_cli: AppGroup = AppGroup("db", help="Manage the key management database.")
+
+
+# region Helpers
+
+def expected_indexes(document) -> list:
+    """Get the indexes declared on a document (through its meta dict
+    and unique fields)
+
+    Args:
+        document: The document class
+
+    Returns:
+        list: A list of indexes, each a dict of its fields (a list of
+        (field, direction) tuples) and whether it is unique and sparse
+    """
+
+    return [{"fields": list(spec["fields"]),
+             "unique": bool(spec.get("unique", False)),
+             "sparse": bool(spec.get("sparse", False))}
+            for spec in document._meta["index_specs"]]
+
+
+def existing_indexes(document) -> list:
+    """Get the indexes that currently exist on a document's collection.
+    Reads the collection directly so it does not trigger mongoengine's
+    automatic index creation.
+
+    Args:
+        document: The document class
+
+    Returns:
+        list: A list of indexes, each a dict of its fields (a list of
+        (field, direction) tuples) and whether it is unique and sparse
+    """
+
+    # Directions may come back as floats (1.0). Text, hashed and geo
+    # indexes name their type instead, which is kept as it is
+    collection = document._get_db()[document._get_collection_name()]
+    return [{"fields": [(field, int(direction) if isinstance(direction, (int, float)) else direction)
+                        for field, direction in info["key"]],
+             "unique": bool(info.get("unique", False)),
+             "sparse": bool(info.get("sparse", False))}
+            for info in collection.index_information().values()]
+
+
+def missing_indexes(document) -> list:
+    """Get the declared indexes that do not exist yet. An index on the
+    right fields but without the declared unique or sparse option counts
+    as missing, since its constraint is not enforced
+
+    Args:
+        document: The document class
+
+    Returns:
+        list: A list of indexes, as returned by expected_indexes
+    """
+
+    existing: list = existing_indexes(document)
+    return [index for index in expected_indexes(document) if index not in existing]
+
+
+def describe_index(index: dict) -> str:
+    """Describe an index for the command output
+
+    Args:
+        index (dict): The index, as returned by expected_indexes
+
+    Returns:
+        str: Its fields followed by its options, e.g. "[('pid', 1)] unique"
+    """
+
+    options: list = [option for option in ("unique", "sparse") if index[option]]
+    return " ".join([str(index["fields"])] + options)
+
+# endregion
+
+
+# region Commands
+
+@db_cli.command("indexes")
+@click.option("--check", is_flag=True,
+              help="Only report missing indexes (exit code 1 if any are missing).")
+def indexes_command(check: bool) -> None:
+    """Report missing indexes and create them"""
+
+    failed: bool = False
+
+    for document in documents:
+        collection_name: str = document._get_collection_name()
+        missing: list = missing_indexes(document)
+
+        # Report the state of this collection
+        if not missing:
+            click.echo(f"{collection_name}: all {len(expected_indexes(document))} indexes exist")
+            continue
+
+        for index in missing:
+            click.echo(f"{collection_name}: missing index {describe_index(index)}")
+
+        if check:
+            failed = True
+            continue
+
+        try:
+            # Create the declared indexes (existing ones are left alone)
+            document.ensure_indexes()
+            click.echo(f"{collection_name}: created {len(missing)} indexes")
+
+        # Unique indexes fail when the collection already holds duplicates,
+        # and any index fails when one on the same fields has other options
+        # (drop that one first, e.g. db.users.dropIndex("pid_1"))
+        except OperationFailure as e:
+            click.echo(f"{collection_name}: could not create indexes: {e}", err=True)
+            failed = True
+
+    if failed:
+        sys.exit(1)
+
+
+@db_cli.command("repair-owners")
+@click.option("--dry-run", is_flag=True,
+              help="Only report what would change.")
+def repair_owners_command(dry_run: bool) -> None:
+    """Rebuild Key.owner_pid from User.owned_keys"""
+
+    # Map every owned key to its owner, reading only the raw references
+    owners: dict = {}
+    for user in User.objects(__raw__={"owned_keys.0": {"$exists": True}}) \
+            .only("pid", "owned_keys").no_dereference():
+        for key_ref in user.owned_keys:
+            key_id = key_ref.id if hasattr(key_ref, "id") else key_ref
+
+            # A key should only have one owner. Keep the first one found
+            if key_id in owners and owners[key_id] != user.pid:
+                click.echo(f"Key {key_id} is owned by both {owners[key_id]} "
+                           f"and {user.pid}, keeping {owners[key_id]}", err=True)
+                continue
+
+            owners[key_id] = user.pid
+
+    # Find the keys whose pointer disagrees with the user data
+    operations: list = []
+    for key in Key.objects().only("id", "owner_pid").as_pymongo():
+        owner_pid = owners.get(key["_id"])
+        if key.get("owner_pid") == owner_pid:
+            continue
+
+        if owner_pid is None:
+            operations.append(UpdateOne({"_id": key["_id"]}, {"$unset": {"owner_pid": ""}}))
+        else:
+            operations.append(UpdateOne({"_id": key["_id"]}, {"$set": {"owner_pid": owner_pid}}))
+
+    click.echo(f"{len(owners)} owned keys, {len(operations)} pointers to repair")
+
+    # Write all repairs in one unordered bulk write
+    if operations and not dry_run:
+        result = Key._get_collection().bulk_write(operations, ordered=False)
+        bump_collection_versions("keys")
+        click.echo(f"Repaired {result.modified_count} keys")
+
+
+@db_cli.command("search-terms")
+@click.option("--batch-size", type=int, default=1000,
+              help="Number of documents updated per bulk write.")
+def search_terms_command(batch_size: int) -> None:
+    """Rebuild Key.search_terms and the name search fields of every user"""
+
+    # Rebuild them from the searchable fields only
+    targets: list = [
+        (Key, ["tag_number", "series_id", "building", "location", "comment"], ["search_terms"]),
+        (User, ["full_name"], ["name_key", "name_terms", "name_sounds"])
+    ]
+
+    for document, sources, terms in targets:
+        collection = document._get_collection()
+        operations: list = []
+        updated: int = 0
+
+        for item in document.objects().only(*sources):
+            item.clean()
+            operations.append(UpdateOne(
+                {"_id": item.id}, {"$set": {field: item[field] for field in terms}}))
+
+            # Write them in unordered bulk writes
+            if len(operations) >= batch_size:
+                updated += collection.bulk_write(operations, ordered=False).matched_count
+                operations = []
+
+        if operations:
+            updated += collection.bulk_write(operations, ordered=False).matched_count
+
+        click.echo(f"Rebuilt the search terms of {updated} {collection.name}")
+
+    bump_collection_versions("keys", "users")
+
+# endregion
@@ -5,72 +5,218 @@ import sys
 sys.path.insert(1, "../")
 
 # Other imports
+import argparse
 import csv
-from schemas.key import Key
-from mongoengine import connect
+import time
+from itertools import islice
+from typing import Iterator, Tuple
+from schemas.key import Key, VALID_KEY_TYPES
+from utils.collection_versions import bump_collection_versions
+from mongoengine import connect, ValidationError
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+# Number of rows validated and written together
+DEFAULT_BATCH_SIZE = 1000
+
+# Mongo error code for a unique index violation
+DUPLICATE_KEY_ERROR = 11000
+
+# Key types as they are spelled in older csv files
+KEY_TYPE_ALIASES: dict = {"door": "Door", "display": "Display case", "file_cabinet": "File cabinet"}
+KEY_TYPE_ALIASES.update({key_type.lower(): key_type for key_type in VALID_KEY_TYPES})
 
 
 # Methods
 
-def build_db_from_csv(filename: str) -> list:
+def read_keys_from_csv(filename: str, start_tag: int = 1) -> Iterator[Tuple[int, Key]]:
     """
-        Reads a csv file and returns a list of
-        Key objects
+        Lazily reads a csv file and yields (row number, Key object) pairs.
+        Tag numbers come from the "tag_number" column if there is one,
+        otherwise they are counted up from start_tag.
     """
 
-    # The list of keys
-    result: list = []
-
     # Tag number counter
-    tag_count = 1
+    tag_count = start_tag
 
-    # Parse CSV
+    # Parse CSV one row at a time
     with open(filename, "r", newline="") as csvfile:
         reader = csv.DictReader(csvfile)
-        for row in reader:
-
-            # Prepare fields
-            tag_number: str = tag_count
-            series_id: str = row["series_id"]
-            sequence_id: int = int(row["sequence_id"])
-            building: str = row["building"]
-            key_type: int = row["key_type"]
-            location: list = row["location"].split("/")
+        for row_number, row in enumerate(reader, start=2):
+
+            # Prepare fields (bad values are reported when validating)
+            tag_number: str = str(row.get("tag_number") or tag_count).strip()
+            series_id: str = (row.get("series_id") or "").strip()
+            sequence_id: str = (row.get("sequence_id") or "").strip()
+            building: str = (row.get("building") or "").strip()
+            key_type: str = (row.get("key_type") or "").strip()
+            key_type = KEY_TYPE_ALIASES.get(key_type.lower(), key_type)
+            location: list = [loc.strip() for loc in (row.get("location") or "").split("/")]
             is_available: bool = True
 
             # Create new key object
             key: Key = Key(
                 tag_number = tag_number,
                 series_id = series_id,
-                sequence_id = sequence_id,
+                sequence_id = int(sequence_id) if sequence_id.isdigit() else sequence_id,
                 building = building,
                 key_type = key_type,
                 location = location,
                 is_available = is_available
             )
 
-            # Append to list
-            result.append(key)
+            yield row_number, key
 
             # Increment tag number count
             tag_count = tag_count + 1
-    
-    return result
+
+
+def build_db_from_csv(filename: str) -> list:
+    """
+        Reads a csv file and returns a list of
+        Key objects
+    """
+
+    return [key for _, key in read_keys_from_csv(filename)]
+
+
+def validate_batch(batch: list, summary: dict) -> list:
+    """
+        Validates a batch of (row number, Key) pairs and returns the valid
+        ones. Invalid rows are added to the summary's errors.
+    """
+
+    valid: list = []
+    for row_number, key in batch:
+        try:
+            key.validate()
+            valid.append((row_number, key))
+        except ValidationError as verror:
+            summary["invalid"] += 1
+            summary["errors"].append((row_number, str(verror)))
+
+    return valid
+
+
+def write_batch(batch: list, on_duplicate: str, summary: dict) -> None:
+    """
+        Writes a batch of valid (row number, Key) pairs with one unordered
+        bulk write. Duplicates are either skipped or upserted by their
+        series id and sequence id.
+    """
+
+    collection = Key._get_collection()
+
+    try:
+        if on_duplicate == "upsert":
+            # Update the descriptive fields of existing keys. Tag numbers and
+            # availability are only set for new keys so held keys stay held
+            operations: list = []
+            for _, key in batch:
+                doc: dict = key.to_mongo().to_dict()
+                on_insert: dict = {field: doc.pop(field) for field in ("tag_number", "is_available")}
+                operations.append(UpdateOne(
+                    {"series_id": doc["series_id"], "sequence_id": doc["sequence_id"]},
+                    {"$set": doc, "$setOnInsert": on_insert},
+                    upsert=True))
+
+            result = collection.bulk_write(operations, ordered=False)
+            summary["inserted"] += result.upserted_count
+            summary["updated"] += result.modified_count
+            summary["unchanged"] += result.matched_count - result.modified_count
+
+        else:
+            result = collection.insert_many(
+                [key.to_mongo() for _, key in batch], ordered=False)
+            summary["inserted"] += len(result.inserted_ids)
+
+    # Report the rows that failed while keeping the rest of the batch
+    except BulkWriteError as bwerror:
+        details: dict = bwerror.details
+        summary["inserted"] += details.get("nInserted", 0) + details.get("nUpserted", 0)
+        summary["updated"] += details.get("nModified", 0)
+        summary["unchanged"] += details.get("nMatched", 0) - details.get("nModified", 0)
+
+        for error in details.get("writeErrors", []):
+            row_number: int = batch[error["index"]][0]
+            if error["code"] == DUPLICATE_KEY_ERROR and on_duplicate == "skip":
+                summary["duplicates"] += 1
+            else:
+                summary["errors"].append((row_number, error.get("errmsg", "write failed")))
+
+
+def import_keys(keys: Iterator[Tuple[int, Key]], batch_size: int = DEFAULT_BATCH_SIZE,
+                on_duplicate: str = "skip", dry_run: bool = False) -> dict:
+    """
+        Validates and inserts keys in batches and returns a summary with
+        the counts, per-row errors and elapsed time
+    """
+
+    summary: dict = {"read": 0, "inserted": 0, "updated": 0, "unchanged": 0, "duplicates": 0,
+                     "invalid": 0, "errors": [], "seconds": 0.0}
+    start: float = time.perf_counter()
+
+    while True:
+        # Take the next batch of rows
+        batch: list = list(islice(keys, batch_size))
+        if not batch:
+            break
+        summary["read"] += len(batch)
+
+        # Validate, then write what is left
+        valid: list = validate_batch(batch, summary)
+        if valid and not dry_run:
+            write_batch(valid, on_duplicate, summary)
+
+    # Let clients holding the old key listing download it again
+    if not dry_run and summary["inserted"] + summary["updated"]:
+        bump_collection_versions("keys")
+
+    summary["seconds"] = time.perf_counter() - start
+    return summary
+
+
+def print_summary(summary: dict, dry_run: bool) -> None:
+    """
+        Prints per-row errors and a throughput summary
+    """
+
+    for row_number, message in summary["errors"]:
+        print(f"Row {row_number}: {message}")
+
+    rate: float = summary["read"] / summary["seconds"] if summary["seconds"] else 0.0
+    print(f"{'Checked' if dry_run else 'Imported'} {summary['read']} rows in "
+          f"{summary['seconds']:.2f}s ({rate:.0f} rows/s): "
+          f"{summary['inserted']} inserted, {summary['updated']} updated, "
+          f"{summary['unchanged']} unchanged, "
+          f"{summary['duplicates']} duplicates skipped, {summary['invalid']} invalid, "
+          f"{len(summary['errors']) - summary['invalid']} failed to write")
 
 
 # main code
 if __name__ == "__main__":
 
-    # Setup database connection
-    connect(db="keymanagementdb", host="localhost", port=27017)
+    # Parse arguments
+    parser = argparse.ArgumentParser(description="Import keys from a csv file")
+    parser.add_argument("filename", nargs="?", default="csv_files/working_set.csv")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=27017)
+    parser.add_argument("--db", default="keymanagementdb")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--start-tag", type=int, default=1,
+                        help="first tag number when the csv has no tag_number column")
+    parser.add_argument("--on-duplicate", choices=["skip", "upsert"], default="skip",
+                        help="skip duplicate keys, or update them by series and sequence id")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="only validate the rows, do not write anything")
+    args = parser.parse_args()
 
-    # Build key list
-    key_list: list = build_db_from_csv("csv_files/working_set.csv")  
+    # Setup database connection
+    if not args.dry_run:
+        connect(db=args.db, host=args.host, port=args.port)
 
-    # Get size of the key list
-    print(len(key_list))
+    # Stream the keys into the "keys" collection
+    summary: dict = import_keys(read_keys_from_csv(args.filename, args.start_tag),
+                                args.batch_size, args.on_duplicate, args.dry_run)
 
-    # Insert all keys
-    for key in key_list:
-        key.save()  # calling save will add the document to the "keys" collection
-    
\ No newline at end of file
+    print_summary(summary, args.dry_run)
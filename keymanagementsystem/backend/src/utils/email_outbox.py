@@ -0,0 +1,297 @@
+"""
+    Utility script for the email outbox. Routes queue emails in MongoDB and
+    return right away, then background workers deliver them with retries
+"""
+
+# Import libraries
+import signal
+import threading
+from datetime import datetime, timedelta
+from typing import Optional
+
+# Import flask objects
+import click
+from flask import Flask, current_app
+from flask.cli import AppGroup
+from flask_mail import Message
+
+# Import mongo objects
+from pymongo import ReturnDocument
+
+# Import schemas
+from ..schemas.email import Email
+
+# Import SMTP pool
+from .smtp_pool import get_smtp_pool
+
+# Defaults for the EMAIL_OUTBOX_* config settings
+DEFAULT_WORKERS = 2
+DEFAULT_POLL_SECONDS = 2.0
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_RETRY_SECONDS = 30
+DEFAULT_LOCK_SECONDS = 300
+DEFAULT_BATCH_SIZE = 20
+
+# Workers running in this process
+workers: list = []
+
+# Define the command group
+email_cli: AppGroup = AppGroup("email", help="Manage the email outbox.")
+
+
+# region Queue
+
+def enqueue_email(msg: Message) -> Email:
+    """Queue an email for delivery, or send it right away if the outbox is
+    turned off (EMAIL_OUTBOX = False)
+
+    Args:
+        msg (Message): The email to send
+
+    Returns:
+        Email: The queued email, or None if it was sent right away
+    """
+
+    if not current_app.config.get("EMAIL_OUTBOX", True):
+        error: Exception = get_smtp_pool(current_app._get_current_object()).send_many([msg])[0]
+        if error:
+            raise error
+        return None
+
+    email: Email = Email(
+        subject=msg.subject,
+        sender=msg.sender,
+        recipients=list(msg.recipients),
+        body=msg.body
+    )
+    email.save()
+
+    return email
+
+
+def claim_next_email(config: dict) -> Optional[Email]:
+    """Atomically claim the next email that is due, so that no two workers
+    (in any process) send the same email. Emails left "sending" by a worker
+    that died are claimed again once their lock expires.
+
+    Args:
+        config (dict): The app config
+
+    Returns:
+        Optional[Email]: The claimed email, or None if nothing is due
+    """
+
+    now: datetime = datetime.now()
+    lock_expiry: datetime = now - timedelta(
+        seconds=config.get("EMAIL_OUTBOX_LOCK_SECONDS", DEFAULT_LOCK_SECONDS))
+
+    doc: dict = Email._get_collection().find_one_and_update(
+        {"$or": [
+            {"status": "queued", "next_attempt_at": {"$lte": now}},
+            {"status": "sending", "locked_at": {"$lt": lock_expiry}}
+        ]},
+        {"$set": {"status": "sending", "locked_at": now}, "$inc": {"attempts": 1}},
+        sort=[("next_attempt_at", 1)],
+        return_document=ReturnDocument.AFTER)
+
+    return Email._from_son(doc) if doc else None
+
+
+def build_message(email: Email) -> Message:
+    """Rebuild a Flask-Mail message from a queued email
+
+    Args:
+        email (Email): The queued email
+
+    Returns:
+        Message: The message to send
+    """
+
+    return Message(email.subject, sender=email.sender,
+                   recipients=list(email.recipients), body=email.body)
+
+
+def mark_sent(email: Email) -> None:
+    """Record that an email was delivered
+
+    Args:
+        email (Email): The delivered email
+    """
+
+    email.update(set__status="sent", set__sent_at=datetime.now(),
+                 unset__locked_at=True, unset__last_error=True)
+
+
+def mark_failed(email: Email, error: Exception, config: dict) -> None:
+    """Schedule a retry with exponential backoff, or move the email to the
+    dead letter state after too many attempts
+
+    Args:
+        email (Email): The email that could not be delivered
+        error (Exception): Why it could not be delivered
+        config (dict): The app config
+    """
+
+    max_attempts: int = config.get("EMAIL_OUTBOX_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS)
+
+    if email.attempts >= max_attempts:
+        email.update(set__status="dead", set__last_error=str(error), unset__locked_at=True)
+        return
+
+    # Wait 30s, 60s, 120s, ... before trying again
+    delay: float = config.get("EMAIL_OUTBOX_RETRY_SECONDS", DEFAULT_RETRY_SECONDS) \
+        * 2 ** (email.attempts - 1)
+    email.update(set__status="queued", set__last_error=str(error), unset__locked_at=True,
+                 set__next_attempt_at=datetime.now() + timedelta(seconds=delay))
+
+
+def deliver_next_emails(app: Flask) -> bool:
+    """Claim up to EMAIL_OUTBOX_BATCH_SIZE due emails and deliver them
+    over a single pooled SMTP connection
+
+    Args:
+        app (Flask): The application (needed for its mail settings)
+
+    Returns:
+        bool: True if any email was claimed, False if the queue had nothing due
+    """
+
+    with app.app_context():
+        batch_size: int = app.config.get("EMAIL_OUTBOX_BATCH_SIZE", DEFAULT_BATCH_SIZE)
+
+        # Claim a batch of emails
+        emails: list = []
+        while len(emails) < batch_size:
+            email: Email = claim_next_email(app.config)
+            if email is None:
+                break
+            emails.append(email)
+
+        if not emails:
+            return False
+
+        # Send them all over one connection
+        errors: list = get_smtp_pool(app).send_many([build_message(email) for email in emails])
+
+        # Record the outcome of each email
+        for email, error in zip(emails, errors):
+            if error is None:
+                mark_sent(email)
+            else:
+                app.logger.warning("Could not send email %s (attempt %d): %s",
+                                   email.id, email.attempts, error)
+                mark_failed(email, error, app.config)
+
+        return True
+
+# endregion
+
+
+# region Workers
+
+class OutboxWorker(threading.Thread):
+    """
+        A background thread that keeps delivering queued emails
+    """
+
+    def __init__(self, app: Flask, name: str):
+        super().__init__(name=name, daemon=True)
+        self.app: Flask = app
+        self.stopping: threading.Event = threading.Event()
+
+    def run(self) -> None:
+        poll_seconds: float = self.app.config.get("EMAIL_OUTBOX_POLL_SECONDS", DEFAULT_POLL_SECONDS)
+
+        while not self.stopping.is_set():
+            try:
+                # Keep going while there is work, otherwise wait for more
+                if not deliver_next_emails(self.app):
+                    self.stopping.wait(poll_seconds)
+
+            # Never let the worker die (e.g. while the database is down)
+            except Exception:
+                self.app.logger.exception("Email outbox worker failed")
+                self.stopping.wait(poll_seconds)
+
+    def stop(self) -> None:
+        self.stopping.set()
+
+
+def start_outbox_workers(app: Flask) -> None:
+    """Start the background workers for this process
+    (EMAIL_OUTBOX_WORKERS of them, none if the outbox is turned off)
+
+    Args:
+        app (Flask): The application
+    """
+
+    if workers or not app.config.get("EMAIL_OUTBOX", True):
+        return
+
+    for index in range(app.config.get("EMAIL_OUTBOX_WORKERS", DEFAULT_WORKERS)):
+        worker: OutboxWorker = OutboxWorker(app, f"outbox-worker-{index}")
+        worker.start()
+        workers.append(worker)
+
+
+def stop_outbox_workers(timeout: float = None) -> None:
+    """Stop the background workers of this process, letting them finish the
+    email they are sending
+
+    Args:
+        timeout (float): How long to wait for each worker
+    """
+
+    for worker in workers:
+        worker.stop()
+    for worker in workers:
+        worker.join(timeout)
+        if "smtp_pool" in worker.app.extensions:
+            worker.app.extensions["smtp_pool"].close()
+    workers.clear()
+
+# endregion
+
+
+# region Commands
+
+@email_cli.command("worker")
+@click.option("--threads", type=int, default=None,
+              help="Number of worker threads (defaults to EMAIL_OUTBOX_WORKERS).")
+def worker_command(threads: int) -> None:
+    """Deliver queued emails until interrupted"""
+
+    app: Flask = current_app._get_current_object()
+    if threads is not None:
+        app.config["EMAIL_OUTBOX_WORKERS"] = threads
+    start_outbox_workers(app)
+    click.echo(f"Started {len(workers)} outbox workers, press Ctrl+C to stop")
+
+    # Wait until interrupted, then let the workers finish their current email
+    stopping: threading.Event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    try:
+        while not stopping.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    stop_outbox_workers()
+
+
+@email_cli.command("status")
+def status_command() -> None:
+    """Show how many emails are in each state"""
+
+    for status in ("queued", "sending", "sent", "dead"):
+        click.echo(f"{status}: {Email.objects(status=status).count()}")
+
+
+@email_cli.command("retry-dead")
+def retry_dead_command() -> None:
+    """Queue every dead email again"""
+
+    count: int = Email.objects(status="dead").update(
+        set__status="queued", set__attempts=0, set__next_attempt_at=datetime.now())
+    click.echo(f"Queued {count} dead emails again")
+
+# endregion
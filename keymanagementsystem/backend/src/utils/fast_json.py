@@ -0,0 +1,143 @@
+"""
+    Utility script for serializing raw documents straight from the driver,
+    skipping MongoEngine document hydration. The output matches what
+    jsonify produces for documents (MongoDB extended JSON, e.g.
+    {"$oid": ...} and {"$date": ...})
+"""
+
+# Import libraries
+import json
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+# Import flask objects
+from flask import Response, current_app
+
+# Import mongo objects
+from bson import json_util
+from mongoengine.queryset import QuerySet
+
+# Import profiling
+from .profiling import profile_section
+
+# Number of documents fetched from the driver and encoded together
+DEFAULT_CHUNK_SIZE = 500
+
+
+def get_encoder() -> json.JSONEncoder:
+    """Build an encoder that uses the C accelerated json encoder and only
+    calls back into Python for BSON values (ObjectId, datetime, ...)
+
+    Returns:
+        json.JSONEncoder: The encoder
+    """
+
+    return json.JSONEncoder(
+        default=json_util.default,
+        separators=(",", ":"),
+        sort_keys=current_app.config.get("JSON_SORT_KEYS", True)
+    )
+
+
+def json_response(obj: Any, status: int = 200) -> Response:
+    """Serialize raw documents (or anything containing them) into a
+    response, like jsonify does for documents
+
+    Args:
+        obj (Any): The object to serialize
+        status (int): The status code of the response
+
+    Returns:
+        Response: The JSON response
+    """
+
+    with profile_section("serialize"):
+        body: str = get_encoder().encode(obj)
+
+    return Response(body, status, mimetype="application/json")
+
+
+def iter_json_array(documents: Iterable, encoder: json.JSONEncoder,
+                    chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+    """Encode documents as a JSON array, one chunk of documents at a time
+
+    Args:
+        documents (Iterable): The raw documents
+        encoder (json.JSONEncoder): The encoder to use
+        chunk_size (int): Number of documents per chunk
+
+    Yields:
+        bytes: The next piece of the array
+    """
+
+    encode = encoder.encode
+    chunk: list = []
+    separator: bytes = b"["
+
+    # Fetch a chunk of documents, then encode them together
+    for document in documents:
+        chunk.append(document)
+        if len(chunk) >= chunk_size:
+            with profile_section("serialize"):
+                data: bytes = separator + ",".join(map(encode, chunk)).encode()
+            yield data
+            separator = b","
+            chunk = []
+
+    if chunk:
+        with profile_section("serialize"):
+            data: bytes = separator + ",".join(map(encode, chunk)).encode()
+        yield data
+        separator = b","
+
+    # Close the array (or send an empty one)
+    yield b"]" if separator == b"," else b"[]"
+
+
+def iter_mapped_chunks(documents: Iterable, map_chunk: Callable[[list], list],
+                       chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator:
+    """Pass documents through a function a chunk at a time, so work like
+    joining other collections costs one query per chunk, not per document
+
+    Args:
+        documents (Iterable): The raw documents
+        map_chunk (Callable[[list], list]): Maps a list of documents to
+        the documents to send
+        chunk_size (int): Number of documents per chunk
+
+    Yields:
+        The mapped documents
+    """
+
+    chunk: list = []
+    for document in documents:
+        chunk.append(document)
+        if len(chunk) >= chunk_size:
+            yield from map_chunk(chunk)
+            chunk = []
+
+    if chunk:
+        yield from map_chunk(chunk)
+
+
+def stream_json_array(queryset: QuerySet, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                      map_chunk: Optional[Callable[[list], list]] = None) -> Response:
+    """Stream every document of a query set as a JSON array, reading raw
+    dicts from the driver so the whole result is never held in memory
+
+    Args:
+        queryset (QuerySet): The (already filtered) query set
+        chunk_size (int): Number of documents fetched and encoded together
+        map_chunk (Optional[Callable[[list], list]]): Applied to each chunk
+        of documents before it is encoded (optional)
+
+    Returns:
+        Response: The streamed JSON response
+    """
+
+    # Build the encoder now, while the app context is still available
+    encoder: json.JSONEncoder = get_encoder()
+    documents = queryset.as_pymongo().batch_size(chunk_size)
+    if map_chunk:
+        documents = iter_mapped_chunks(documents, map_chunk, chunk_size)
+
+    return Response(iter_json_array(documents, encoder, chunk_size), mimetype="application/json")
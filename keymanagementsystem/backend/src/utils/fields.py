@@ -0,0 +1,77 @@
+"""
+    Utility script for sparse fieldsets. GET routes accept a request
+    parameter like "fields=tag_number,building" that becomes a MongoDB
+    projection, so unrequested fields never leave the database
+"""
+
+# Import libraries
+from typing import Optional
+
+# Import flask objects
+from flask import request, abort, make_response
+
+# Import mongo objects
+from mongoengine import Document
+from mongoengine.queryset import QuerySet
+
+# Import schemas
+from ..schemas.key import Key, INTERNAL_FIELDS as KEY_INTERNAL_FIELDS
+from ..schemas.user import User, INTERNAL_FIELDS as USER_INTERNAL_FIELDS
+
+# Name of the request parameter
+FIELDS_PARAM = "fields"
+
+# Fields of each document that are never returned
+internal_fields: dict = {Key: KEY_INTERNAL_FIELDS, User: USER_INTERNAL_FIELDS}
+
+
+def parse_fields(document: Document) -> Optional[list]:
+    """Reads the fields request parameter.
+    Triggers abort if it names a field the document does not have.
+
+    Args:
+        document (Document): The document class the fields belong to
+
+    Returns:
+        Optional[list]: The fields to project, or None to return every field.
+        The _id is always returned
+    """
+
+    if FIELDS_PARAM not in request.args:
+        return None
+
+    fields: list = [field.strip() for field in request.args.get(FIELDS_PARAM).split(",")
+                    if field.strip()]
+
+    # Only allow the document's own fields ("id" and "_id" are always returned)
+    allowed: list = sorted(field for field in document._fields
+                           if field != "id" and field not in internal_fields.get(document, []))
+    unknown: list = [field for field in fields if field not in allowed and field not in ("id", "_id")]
+    if not fields:
+        abort(make_response(f"Error! No fields were requested. Choose from {', '.join(allowed)}.", 400))
+    if unknown:
+        abort(make_response(
+            f"Error! Unknown fields {', '.join(unknown)}. Choose from {', '.join(allowed)}.", 400))
+
+    # Remove duplicates while keeping the order
+    projection: list = [field for field in fields if field not in ("id", "_id")]
+    return list(dict.fromkeys(projection)) or ["id"]
+
+
+def project(queryset: QuerySet, fields: Optional[list]) -> QuerySet:
+    """Limits a query set to the requested fields
+
+    Args:
+        queryset (QuerySet): The query set
+        fields (Optional[list]): The fields from parse_fields
+
+    Returns:
+        QuerySet: The projected query set (every field but the internal
+        ones if fields is None)
+    """
+
+    if fields:
+        return queryset.only(*fields)
+
+    hidden: list = internal_fields.get(queryset._document, [])
+    return queryset.exclude(*hidden) if hidden else queryset
@@ -0,0 +1,70 @@
+"""
+    Utility script for searching keys through the indexed search terms that
+    Key.clean() maintains
+"""
+
+# Import libraries
+import re
+from typing import Tuple
+
+# Import schemas
+from ..schemas.key import Key, INTERNAL_FIELDS, search_words
+
+# Default and maximum number of results
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+
+
+def search_keys(query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> Tuple[list, bool]:
+    """Finds the keys best matching a query, in ranked tiers:
+    3. the query is the key's tag number
+    2. every word of the query is a whole search term of the key
+    1. every word of the query starts a search term of the key
+    (so "torg 10" finds a key in "Torgersen" room "1060")
+
+    Each tier is a single query on the search terms index, read in index
+    order and cut off at limit, so no tier sorts or scans every match.
+
+    Args:
+        query (str): The text to search for
+        limit (int): The maximum number of keys to return
+
+    Returns:
+        Tuple[list, bool]: The matching raw keys (each with a "score") and
+        whether more keys matched
+    """
+
+    words: list = search_words(query)
+    if not words:
+        return [], False
+
+    # Look the longest (most selective) word up in the index first
+    words.sort(key=len, reverse=True)
+
+    tiers: list = [
+        (3, {"tag_number": query.strip()}),
+        (2, {"search_terms": {"$all": words}}),
+        (1, {"$and": [{"search_terms": re.compile(f"^{re.escape(word)}")} for word in words]})
+    ]
+
+    collection = Key._get_collection()
+    projection: dict = {field: 0 for field in INTERNAL_FIELDS}
+    results: list = []
+    seen: set = set()
+
+    for score, filters in tiers:
+        # Later tiers also match the keys found so far, so read past them
+        cursor = collection.find(filters, projection).limit(limit + 1 + len(seen))
+
+        # Keys found by a better tier keep their higher score
+        for key in cursor:
+            if key["_id"] in seen:
+                continue
+            seen.add(key["_id"])
+            key["score"] = score
+            results.append(key)
+
+        if len(results) > limit:
+            break
+
+    return results[:limit], len(results) > limit
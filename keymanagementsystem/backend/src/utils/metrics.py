@@ -0,0 +1,255 @@
+"""
+    Utility script for operational metrics in the Prometheus text format:
+    request counts and latencies for each route, MongoDB connection pool
+    usage, email queue depth and send latency, and CAS verification latency.
+
+    When several worker processes serve the app, set the environment
+    variable PROMETHEUS_MULTIPROC_DIR to an empty directory before the app
+    is imported. Each process then writes its samples to memory mapped
+    files there, and /api/metrics adds up every process
+"""
+
+# Import libraries
+import hmac
+import os
+import time
+from typing import Iterator, Optional
+
+# Import flask objects
+from flask import Flask, Response, current_app, g, request
+
+# Import metric types
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, \
+    REGISTRY, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+from prometheus_client.core import GaugeMetricFamily
+
+# Import mongo objects
+from pymongo import monitoring
+
+# Import schemas
+from ..schemas.email import Email, VALID_STATUSES
+
+
+# region Metrics
+
+REQUESTS = Counter(
+    "kms_http_requests_total", "HTTP requests handled",
+    ["endpoint", "method", "status"])
+
+REQUEST_SECONDS = Histogram(
+    "kms_http_request_duration_seconds", "Time to handle a request, including sending its body",
+    ["endpoint", "method"])
+
+MONGO_POOL_CONNECTIONS = Gauge(
+    "kms_mongo_pool_connections", "MongoDB connections open (state=open) and checked out (state=in_use)",
+    ["state"], multiprocess_mode="livesum")
+
+MONGO_POOL_MAX = Gauge(
+    "kms_mongo_pool_max_connections", "Largest number of MongoDB connections the pools may open",
+    multiprocess_mode="livesum")
+
+MONGO_POOL_CHECKOUT_FAILURES = Counter(
+    "kms_mongo_pool_checkout_failures_total", "MongoDB connection checkouts that failed",
+    ["reason"])
+
+EMAIL_SEND_SECONDS = Histogram(
+    "kms_email_send_duration_seconds", "Time to send one email over SMTP",
+    ["result"])
+
+CAS_VERIFY_SECONDS = Histogram(
+    "kms_cas_verify_duration_seconds", "Time to verify a CAS ticket",
+    ["result"])
+
+# endregion
+
+
+# region MongoDB connection pool
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """
+        Tracks the connections of every MongoDB pool in this process
+    """
+
+    def __init__(self):
+        self.max_sizes: dict = {}  # server address -> maxPoolSize
+
+    def pool_created(self, event: monitoring.PoolCreatedEvent) -> None:
+        # Options only lists the settings that differ from the defaults
+        self.max_sizes[event.address] = event.options.get("maxPoolSize", 100)
+        MONGO_POOL_MAX.inc(self.max_sizes[event.address])
+
+    def pool_cleared(self, event: monitoring.PoolClearedEvent) -> None:
+        pass
+
+    def pool_closed(self, event: monitoring.PoolClosedEvent) -> None:
+        MONGO_POOL_MAX.dec(self.max_sizes.pop(event.address, 0))
+
+    def connection_created(self, event: monitoring.ConnectionCreatedEvent) -> None:
+        MONGO_POOL_CONNECTIONS.labels("open").inc()
+
+    def connection_ready(self, event: monitoring.ConnectionReadyEvent) -> None:
+        pass
+
+    def connection_closed(self, event: monitoring.ConnectionClosedEvent) -> None:
+        MONGO_POOL_CONNECTIONS.labels("open").dec()
+
+    def connection_check_out_started(self, event: monitoring.ConnectionCheckOutStartedEvent) -> None:
+        pass
+
+    def connection_check_out_failed(self, event: monitoring.ConnectionCheckOutFailedEvent) -> None:
+        MONGO_POOL_CHECKOUT_FAILURES.labels(event.reason).inc()
+
+    def connection_checked_out(self, event: monitoring.ConnectionCheckedOutEvent) -> None:
+        MONGO_POOL_CONNECTIONS.labels("in_use").inc()
+
+    def connection_checked_in(self, event: monitoring.ConnectionCheckedInEvent) -> None:
+        MONGO_POOL_CONNECTIONS.labels("in_use").dec()
+
+
+# Listeners are global to pymongo, so register ours only once
+pool_listener_registered: bool = False
+
+
+def register_pool_listener() -> None:
+    """Register the pool listener. Only clients created afterwards report
+    to it, so call this before connecting to MongoDB
+    """
+
+    global pool_listener_registered
+
+    if not pool_listener_registered:
+        monitoring.register(PoolMetricsListener())
+        pool_listener_registered = True
+
+# endregion
+
+
+# region Email queue
+
+class EmailQueueCollector:
+    """
+        Reports the number of emails in each outbox state. The queue is
+        shared by every process, so it is read once per scrape instead of
+        being counted by each process
+    """
+
+    def collect(self) -> Iterator[GaugeMetricFamily]:
+        queue: GaugeMetricFamily = GaugeMetricFamily(
+            "kms_email_queue", "Emails in the outbox", labels=["status"])
+
+        # Leave the metric out rather than failing the whole scrape
+        try:
+            counts: dict = {row["_id"]: row["count"] for row in Email.objects.aggregate(
+                {"$group": {"_id": "$status", "count": {"$sum": 1}}})}
+        except Exception:
+            return
+
+        for status in VALID_STATUSES:
+            queue.add_metric([status], counts.get(status, 0))
+
+        yield queue
+
+
+# Collectors read at scrape time rather than by each process
+scrape_registry: CollectorRegistry = CollectorRegistry()
+scrape_registry.register(EmailQueueCollector())
+
+# endregion
+
+
+# region Helpers
+
+def observe_cas_verification(seconds: float, verified: bool) -> None:
+    """Record how long verifying a CAS ticket took
+
+    Args:
+        seconds (float): The duration
+        verified (bool): Whether the ticket was valid
+    """
+
+    CAS_VERIFY_SECONDS.labels("success" if verified else "failure").observe(seconds)
+
+
+def observe_email_send(seconds: float, sent: bool) -> None:
+    """Record how long sending one email took
+
+    Args:
+        seconds (float): The duration
+        sent (bool): Whether the email was sent
+    """
+
+    EMAIL_SEND_SECONDS.labels("success" if sent else "failure").observe(seconds)
+
+
+def has_metrics_token() -> bool:
+    """Checks whether the request carries the METRICS_TOKEN config setting
+    as a bearer token (so scrapers need no CAS session)
+
+    Returns:
+        bool: True if METRICS_TOKEN is set and the request sent it
+    """
+
+    token: Optional[str] = current_app.config.get("METRICS_TOKEN")
+    if not token:
+        return False
+
+    sent: str = request.headers.get("Authorization", "")
+    return hmac.compare_digest(sent.encode(), f"Bearer {token}".encode())
+
+
+def metrics_response() -> Response:
+    """Render every metric in the Prometheus text format, adding up the
+    samples of all worker processes in multiprocess mode
+
+    Returns:
+        Response: The metrics
+    """
+
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry: CollectorRegistry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry: CollectorRegistry = REGISTRY
+
+    body: bytes = generate_latest(registry) + generate_latest(scrape_registry)
+    return Response(body, content_type=CONTENT_TYPE_LATEST)
+
+# endregion
+
+
+# region Request hooks
+
+def init_metrics(app: Flask) -> None:
+    """Count and time every request of the app, unless METRICS is False.
+    Must run before the app connects to MongoDB
+
+    Args:
+        app (Flask): The application
+    """
+
+    if not app.config.get("METRICS", True):
+        return
+
+    register_pool_listener()
+
+    @app.before_request
+    def start_timer() -> None:
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def count_request(response: Response) -> Response:
+        started: Optional[float] = g.get("metrics_started")
+        if started is None:
+            return response
+
+        # Label by route, not path, so the number of series stays small
+        endpoint: str = request.endpoint or "unmatched"
+        method: str = request.method
+        REQUESTS.labels(endpoint, method, str(response.status_code)).inc()
+
+        # Time until the whole body was sent
+        response.call_on_close(lambda: REQUEST_SECONDS.labels(endpoint, method)
+                               .observe(time.perf_counter() - started))
+        return response
+
+# endregion
@@ -0,0 +1,193 @@
+"""
+    Utility script for paginating, filtering and sorting collection queries
+"""
+
+# Import libraries
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Any, Optional, Tuple
+
+# Import flask objects
+from flask import request, abort, make_response
+
+# Import mongo objects
+from bson import ObjectId
+from bson.errors import InvalidId
+from mongoengine.queryset.visitor import Q
+from mongoengine.queryset import QuerySet
+
+# Default and maximum number of documents in one page
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Request parameters that control pagination (not filters)
+PAGINATION_PARAMS: list = ["limit", "cursor", "sort"]
+
+
+def is_paginated_request(filter_params: list) -> bool:
+    """Checks whether the client asked for a paginated response. Requests
+    without any pagination or filter parameters keep receiving a plain array.
+
+    Args:
+        filter_params (list): The filter parameters the route supports
+
+    Returns:
+        bool: True if any pagination or filter parameter was supplied
+    """
+
+    return any(param in request.args for param in PAGINATION_PARAMS + filter_params)
+
+
+def parse_page_size(default: int = DEFAULT_PAGE_SIZE, maximum: int = MAX_PAGE_SIZE) -> int:
+    """Reads the "limit" request parameter.
+    Triggers abort if the value is not a positive integer.
+
+    Args:
+        default (int): The page size when no limit was supplied
+        maximum (int): The largest page size allowed
+
+    Returns:
+        int: The page size, capped at maximum
+    """
+
+    limit = request.args.get("limit", default)
+
+    try:
+        limit = int(limit)
+    except ValueError:
+        abort(make_response("Error! The limit must be an integer.", 400))
+
+    if limit < 1:
+        abort(make_response("Error! The limit must be at least 1.", 400))
+
+    return min(limit, maximum)
+
+
+def parse_sort(allowed_fields: list, default_field: str) -> Tuple[str, bool]:
+    """Reads the "sort" request parameter (e.g. "building" or "-building").
+    Triggers abort if the field cannot be sorted on.
+
+    Args:
+        allowed_fields (list): The fields that can be sorted on
+        default_field (str): The field (with optional "-" prefix) to use
+        when no sort was supplied
+
+    Returns:
+        Tuple[str, bool]: The field name and whether it is sorted descending
+    """
+
+    sort: str = request.args.get("sort", default_field).strip()
+    descending: bool = sort.startswith("-")
+    field: str = sort.lstrip("-+")
+
+    if field not in allowed_fields:
+        abort(make_response(
+            f"Error! Cannot sort on {field}. Must be one of: {', '.join(allowed_fields)}", 400))
+
+    return field, descending
+
+
+def parse_bool(value: str) -> bool:
+    """Parses a boolean request parameter the same way request bodies are parsed
+
+    Args:
+        value (str): The raw parameter value
+
+    Returns:
+        bool: True if the value is "true" (case-insensitive)
+    """
+
+    return str(value).lower().strip() == "true"
+
+
+def encode_cursor(value: Any, oid: ObjectId) -> str:
+    """Builds an opaque cursor that points just after a document
+
+    Args:
+        value (Any): The value of the sort field for the last document
+        oid (ObjectId): The object id of the last document
+
+    Returns:
+        str: A url-safe cursor string
+    """
+
+    payload: dict = {"id": str(oid)}
+
+    # Dates are not json serializable, so tag them to restore them later
+    if isinstance(value, datetime):
+        payload["d"] = value.isoformat()
+    else:
+        payload["v"] = value
+
+    raw: bytes = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Any, ObjectId]:
+    """Reverses encode_cursor.
+    Triggers abort if the cursor is malformed.
+
+    Args:
+        cursor (str): The cursor supplied by the client
+
+    Returns:
+        Tuple[Any, ObjectId]: The sort field value and object id
+    """
+
+    try:
+        padded: str = cursor + "=" * (-len(cursor) % 4)
+        payload: dict = json.loads(base64.urlsafe_b64decode(padded.encode()))
+
+        if "d" in payload:
+            value = datetime.fromisoformat(payload["d"])
+        else:
+            value = payload["v"]
+
+        return value, ObjectId(payload["id"])
+
+    except (binascii.Error, ValueError, KeyError, TypeError, InvalidId):
+        abort(make_response("Error! The cursor is not valid.", 400))
+
+
+def paginate(queryset: QuerySet, sort_field: str, descending: bool,
+             page_size: int, cursor: Optional[str]) -> Tuple[list, Optional[str]]:
+    """Fetches one page of a query set using keyset pagination on
+    (sort_field, _id), so later pages cost the same as the first one
+
+    Args:
+        queryset (QuerySet): The (already filtered) query set
+        sort_field (str): The field to sort on
+        descending (bool): Whether to sort in descending order
+        page_size (int): The maximum number of documents to return
+        cursor (Optional[str]): The cursor returned with the previous page
+
+    Returns:
+        Tuple[list, Optional[str]]: The raw documents (dicts) in the page and
+        the cursor for the next page (None if this is the last page)
+    """
+
+    # Resume after the last document of the previous page
+    if cursor:
+        value, oid = decode_cursor(cursor)
+        operator: str = "lt" if descending else "gt"
+        queryset = queryset.filter(
+            Q(**{f"{sort_field}__{operator}": value}) |
+            (Q(**{sort_field: value}) & Q(**{f"id__{operator}": oid})))
+
+    # Break ties on the object id so the order is total
+    direction: str = "-" if descending else "+"
+    queryset = queryset.order_by(f"{direction}{sort_field}", f"{direction}id")
+
+    # Fetch one extra document to know whether there is a next page.
+    # Raw dicts skip building documents that are only serialized
+    items: list = list(queryset.limit(page_size + 1).as_pymongo())
+
+    next_cursor: Optional[str] = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        last: dict = items[-1]
+        next_cursor = encode_cursor(last.get(sort_field), last["_id"])
+
+    return items, next_cursor
@@ -0,0 +1,222 @@
+"""
+    Utility script for profiling requests. A sample of requests records its
+    wall time, the MongoDB commands it ran (through driver command
+    monitoring) and the time spent serializing, and reports them in a
+    Server-Timing header and a structured log line
+"""
+
+# Import libraries
+import json
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+# Import flask objects
+from flask import Flask, Response, g, request
+
+# Import mongo objects
+from pymongo import monitoring
+
+# Logger of the profile lines (one JSON object per request)
+profile_logger: logging.Logger = logging.getLogger("kms.profile")
+
+# Default share of requests that are profiled (1%, cheap enough to leave
+# on in production)
+DEFAULT_SAMPLE_RATE = 0.01
+
+
+class RequestProfile:
+    """
+        The timings collected for one request
+    """
+
+    def __init__(self):
+        self.started: float = time.perf_counter()
+        self.db_seconds: float = 0.0
+        self.db_commands: int = 0
+        self.commands: dict = {}  # command name -> count
+        self.sections: dict = {}  # section name -> seconds
+
+    def add_command(self, name: str, seconds: float) -> None:
+        self.db_seconds += seconds
+        self.db_commands += 1
+        self.commands[name] = self.commands.get(name, 0) + 1
+
+    def add_section(self, name: str, seconds: float) -> None:
+        self.sections[name] = self.sections.get(name, 0.0) + seconds
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self) -> str:
+        """Format the timings so far as a Server-Timing header value
+
+        Returns:
+            str: e.g. 'db;dur=4.1;desc="3 commands", serialize;dur=0.8, total;dur=9.5'
+        """
+
+        commands: str = "command" if self.db_commands == 1 else "commands"
+        metrics: list = [f'db;dur={self.db_seconds * 1000:.1f};desc="{self.db_commands} {commands}"']
+        metrics += [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.sections.items()]
+        metrics.append(f"total;dur={self.elapsed() * 1000:.1f}")
+
+        return ", ".join(metrics)
+
+
+# The profile of the request running in this context (None if unsampled)
+current_profile: ContextVar = ContextVar("current_profile", default=None)
+
+
+# region Command monitoring
+
+class ProfilingCommandListener(monitoring.CommandListener):
+    """
+        Adds every MongoDB command to the profile of the request that ran it.
+        pymongo calls listeners on the thread that ran the command, so the
+        context variable points at the right request
+    """
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        pass
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        profile: Optional[RequestProfile] = current_profile.get()
+        if profile is not None:
+            profile.add_command(event.command_name, event.duration_micros / 1e6)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        profile: Optional[RequestProfile] = current_profile.get()
+        if profile is not None:
+            profile.add_command(event.command_name, event.duration_micros / 1e6)
+
+
+# Listeners are global to pymongo, so register ours only once
+listener_lock: threading.Lock = threading.Lock()
+listener_registered: bool = False
+
+
+def register_command_listener() -> None:
+    """Register the command listener. Only clients created afterwards
+    report to it, so call this before connecting to MongoDB
+    """
+
+    global listener_registered
+
+    with listener_lock:
+        if not listener_registered:
+            monitoring.register(ProfilingCommandListener())
+            listener_registered = True
+
+# endregion
+
+
+# region Helpers
+
+@contextmanager
+def profile_section(name: str) -> Iterator[None]:
+    """Time a block of code into the current request's profile
+    (does nothing if the request is not profiled)
+
+    Args:
+        name (str): The name of the section (e.g. "serialize")
+    """
+
+    profile: Optional[RequestProfile] = current_profile.get()
+    if profile is None:
+        yield
+        return
+
+    started: float = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add_section(name, time.perf_counter() - started)
+
+
+def log_profile(profile: RequestProfile, method: str, path: str,
+                endpoint: Optional[str], status: int) -> None:
+    """Write the profile of a finished request as one JSON log line
+
+    Args:
+        profile (RequestProfile): The profile
+        method (str): The request method
+        path (str): The request path
+        endpoint (Optional[str]): The endpoint that handled the request
+        status (int): The status code of the response
+    """
+
+    profile_logger.info(json.dumps({
+        "event": "request_profile",
+        "method": method,
+        "path": path,
+        "endpoint": endpoint,
+        "status": status,
+        "total_ms": round(profile.elapsed() * 1000, 2),
+        "db_ms": round(profile.db_seconds * 1000, 2),
+        "db_commands": profile.db_commands,
+        "commands": profile.commands,
+        **{f"{name}_ms": round(seconds * 1000, 2) for name, seconds in profile.sections.items()}
+    }, separators=(",", ":")))
+
+# endregion
+
+
+# region Request hooks
+
+def init_profiling(app: Flask) -> None:
+    """Profile a sample of the app's requests, if PROFILING is True.
+    PROFILING_SAMPLE_RATE (0 to 1, 0.01 by default) sets the share of
+    requests profiled.
+    Must run before the app connects to MongoDB
+
+    Args:
+        app (Flask): The application
+    """
+
+    if not app.config.get("PROFILING", False):
+        return
+
+    register_command_listener()
+    sample_rate: float = float(app.config.get("PROFILING_SAMPLE_RATE", DEFAULT_SAMPLE_RATE))
+    server_timing: bool = bool(app.config.get("PROFILING_SERVER_TIMING", True))
+
+    # Make sure the profile lines are written somewhere
+    if profile_logger.level == logging.NOTSET:
+        profile_logger.setLevel(logging.INFO)
+    if not profile_logger.handlers and not logging.getLogger().handlers:
+        profile_logger.addHandler(logging.StreamHandler())
+
+    @app.before_request
+    def start_profile() -> None:
+        # Only profile a sample of the requests. Always set the variable so
+        # nothing is left over from an earlier request on this thread
+        profile: Optional[RequestProfile] = RequestProfile() if random.random() < sample_rate else None
+        g.profile = profile
+        current_profile.set(profile)
+
+    @app.after_request
+    def finish_profile(response: Response) -> Response:
+        profile: Optional[RequestProfile] = g.get("profile")
+        if profile is None:
+            return response
+
+        # Report the timings so far. A streamed body is still to be
+        # sent, so its time only shows up in the log line
+        if server_timing:
+            response.headers["Server-Timing"] = profile.server_timing()
+
+        # Log once the whole body was sent
+        method, path, endpoint = request.method, request.path, request.endpoint
+
+        def close() -> None:
+            current_profile.set(None)
+            log_profile(profile, method, path, endpoint, response.status_code)
+
+        response.call_on_close(close)
+        return response
+
+# endregion
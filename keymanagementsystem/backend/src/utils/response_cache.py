@@ -0,0 +1,366 @@
+"""
+    Utility script for caching the responses of read-heavy routes. The
+    backend is pluggable (an in-process LRU by default, or any cachelib
+    cache such as Redis) and entries are keyed by route and query string
+"""
+
+# Import libraries
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Iterator, Optional
+from urllib.parse import urlencode
+
+# Import cache backends
+from cachelib import BaseCache, NullCache, RedisCache
+
+# Import flask objects
+from flask import Flask, Response, current_app, request
+
+# Defaults for the RESPONSE_CACHE_* config settings
+DEFAULT_CACHE_SIZE = 500
+DEFAULT_CACHE_TTL = 60
+
+
+# region Backends
+
+class LRUCache(BaseCache):
+    """
+        A thread-safe in-process cache that evicts the least recently used
+        entry once it holds more than threshold entries
+    """
+
+    def __init__(self, threshold: int = DEFAULT_CACHE_SIZE, default_timeout: int = DEFAULT_CACHE_TTL):
+        super().__init__(default_timeout)
+        self.threshold: int = threshold
+        self.entries: OrderedDict = OrderedDict()  # key -> (expires, value)
+        self.lock: threading.Lock = threading.Lock()
+
+    def _expires(self, timeout: Optional[int]) -> Optional[float]:
+        # A timeout of 0 never expires
+        timeout = self.default_timeout if timeout is None else timeout
+        return time.monotonic() + timeout if timeout > 0 else None
+
+    def _get(self, key: str) -> Any:
+        item: tuple = self.entries.get(key)
+        if item is None:
+            return None
+
+        # Drop expired entries when they are read
+        expires, value = item
+        if expires is not None and expires <= time.monotonic():
+            del self.entries[key]
+            return None
+
+        self.entries.move_to_end(key)
+        return value
+
+    def _set(self, key: str, value: Any, timeout: Optional[int]) -> None:
+        self.entries[key] = (self._expires(timeout), value)
+        self.entries.move_to_end(key)
+
+        # Evict the least recently used entries
+        while len(self.entries) > self.threshold:
+            self.entries.popitem(last=False)
+
+    def get(self, key: str) -> Any:
+        with self.lock:
+            return self._get(key)
+
+    def set(self, key: str, value: Any, timeout: Optional[int] = None) -> bool:
+        with self.lock:
+            self._set(key, value, timeout)
+        return True
+
+    def add(self, key: str, value: Any, timeout: Optional[int] = None) -> bool:
+        with self.lock:
+            if self._get(key) is not None:
+                return False
+            self._set(key, value, timeout)
+        return True
+
+    def delete(self, key: str) -> bool:
+        with self.lock:
+            return self.entries.pop(key, None) is not None
+
+    def has(self, key: str) -> bool:
+        with self.lock:
+            return self._get(key) is not None
+
+    def clear(self) -> bool:
+        with self.lock:
+            self.entries.clear()
+        return True
+
+    def inc(self, key: str, delta: int = 1) -> int:
+        with self.lock:
+            value: int = (self._get(key) or 0) + delta
+            self._set(key, value, 0)
+        return value
+
+
+def create_cache_backend(app: Flask) -> BaseCache:
+    """Create the cache backend chosen by RESPONSE_CACHE_TYPE: "lru"
+    (the default), "redis" (using RESPONSE_CACHE_REDIS_URL), "null", or a
+    ready-made cachelib cache (e.g. a RedisCache around a fakeredis client)
+
+    Args:
+        app (Flask): The application
+
+    Returns:
+        BaseCache: The backend
+    """
+
+    backend: Any = app.config.get("RESPONSE_CACHE_TYPE", "lru")
+    ttl: int = app.config.get("RESPONSE_CACHE_TTL", DEFAULT_CACHE_TTL)
+
+    if isinstance(backend, BaseCache):
+        return backend
+
+    if backend == "lru":
+        return LRUCache(app.config.get("RESPONSE_CACHE_SIZE", DEFAULT_CACHE_SIZE), ttl)
+
+    # Shared by every worker. Bound its size with Redis' own
+    # maxmemory and "allkeys-lru" eviction policy
+    if backend == "redis":
+        import redis
+        client = redis.Redis.from_url(app.config.get("RESPONSE_CACHE_REDIS_URL", "redis://localhost:6379/0"))
+        return RedisCache(host=client, default_timeout=ttl, key_prefix="kms:")
+
+    if backend == "null":
+        return NullCache()
+
+    raise ValueError(f"Unknown RESPONSE_CACHE_TYPE {backend!r}")
+
+# endregion
+
+
+# region Response cache
+
+class ResponseCache:
+    """
+        Stores whole responses in a cache backend, grouped in namespaces
+        (e.g. "keys") that are invalidated together, and counts hits and
+        misses for each route
+    """
+
+    def __init__(self, backend: BaseCache):
+        self.backend: BaseCache = backend
+        self.counters: dict = {}  # endpoint -> { hits, misses }
+        self.invalidations: int = 0
+        self.lock: threading.Lock = threading.Lock()
+
+    def count(self, endpoint: str, counter: str) -> None:
+        with self.lock:
+            counters: dict = self.counters.setdefault(endpoint, {"hits": 0, "misses": 0})
+            counters[counter] += 1
+
+    def key_for(self, namespaces: tuple) -> str:
+        """Build the cache key of the current request. It includes the
+        generation of each namespace, so invalidating a namespace orphans
+        its old entries (they are evicted or expire later)
+
+        Args:
+            namespaces (tuple): The namespaces the response belongs to
+
+        Returns:
+            str: The cache key
+        """
+
+        generations: list = [f"{namespace}{self.backend.get(f'generation:{namespace}') or 0}"
+                             for namespace in namespaces]
+        query: str = urlencode(sorted(request.args.items(multi=True)))
+
+        return f"response:{'.'.join(generations)}:{request.path}?{query}"
+
+    def get(self, namespaces: tuple, version: str) -> Optional[Response]:
+        """Get the cached response of the current request
+
+        Args:
+            namespaces (tuple): The namespaces the response belongs to
+            version (str): The version of the data the response must be
+            made from (entries made from older data are ignored)
+
+        Returns:
+            Optional[Response]: The cached response, or None on a miss
+        """
+
+        entry: dict = self.backend.get(self.key_for(namespaces))
+
+        if entry is None or entry["version"] != version:
+            self.count(request.endpoint, "misses")
+            return None
+
+        self.count(request.endpoint, "hits")
+        response: Response = Response(entry["body"], entry["status"], mimetype=entry["mimetype"])
+        response.headers["X-Cache"] = "HIT"
+        return response
+
+    def set(self, namespaces: tuple, version: str, response: Response) -> Response:
+        """Cache the response of the current request (only if it succeeded)
+
+        Args:
+            namespaces (tuple): The namespaces the response belongs to
+            version (str): The version of the data the response was made from
+            response (Response): The response to cache
+
+        Returns:
+            Response: The same response
+        """
+
+        response.headers["X-Cache"] = "MISS"
+        if response.status_code != 200:
+            return response
+
+        entry: dict = {"version": version, "status": response.status_code,
+                       "mimetype": response.mimetype}
+        key: str = self.key_for(namespaces)
+
+        # Keep streaming, and cache the body once it was sent in full
+        if response.is_streamed:
+            response.response = self.store_when_sent(key, entry, response.response)
+            return response
+
+        entry["body"] = response.get_data()
+        self.backend.set(key, entry)
+        return response
+
+    def store_when_sent(self, key: str, entry: dict, chunks: Iterator) -> Iterator[bytes]:
+        """Pass a streamed body through, caching it after its last chunk
+        (a body that fails half way is never cached)
+
+        Args:
+            key (str): The cache key
+            entry (dict): The entry to store, without its body
+            chunks (Iterator): The chunks of the body
+
+        Yields:
+            bytes: The same chunks
+        """
+
+        body: list = []
+        for chunk in chunks:
+            chunk = chunk if isinstance(chunk, bytes) else chunk.encode()
+            body.append(chunk)
+            yield chunk
+
+        entry["body"] = b"".join(body)
+        self.backend.set(key, entry)
+
+    def invalidate(self, *namespaces: str) -> None:
+        """Drop every cached response in the given namespaces
+
+        Args:
+            namespaces (str): The namespaces whose data changed
+        """
+
+        for namespace in namespaces:
+            self.backend.inc(f"generation:{namespace}")
+        with self.lock:
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        """Get the hit and miss counters of this process
+
+        Returns:
+            dict: The counters in total and for each route
+        """
+
+        with self.lock:
+            routes: dict = {endpoint: dict(counters) for endpoint, counters in self.counters.items()}
+            invalidations: int = self.invalidations
+
+        hits: int = sum(counters["hits"] for counters in routes.values())
+        misses: int = sum(counters["misses"] for counters in routes.values())
+
+        return {
+            "backend": type(self.backend).__name__,
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": round(hits / (hits + misses), 3) if hits + misses else 0.0,
+            "invalidations": invalidations,
+            "routes": routes
+        }
+
+
+# Guards creating the cache of this process
+cache_lock: threading.Lock = threading.Lock()
+
+
+def get_response_cache(app: Flask) -> ResponseCache:
+    """Get the response cache of this process, creating it on first use
+
+    Args:
+        app (Flask): The application
+
+    Returns:
+        ResponseCache: The cache
+    """
+
+    with cache_lock:
+        if "response_cache" not in app.extensions:
+            app.extensions["response_cache"] = ResponseCache(create_cache_backend(app))
+        return app.extensions["response_cache"]
+
+# endregion
+
+
+# region Helpers for routes
+
+def response_cache_enabled() -> bool:
+    """Checks whether responses may be cached
+    (opt-out with the RESPONSE_CACHE config setting)
+
+    Returns:
+        bool: True if the response cache is enabled
+    """
+
+    return bool(current_app.config.get("RESPONSE_CACHE", True))
+
+
+def get_cached_response(namespaces: tuple, version: str) -> Optional[Response]:
+    """Get the cached response of the current request, if caching is on
+
+    Args:
+        namespaces (tuple): The namespaces the response belongs to
+        version (str): The version of the data the response must be made from
+
+    Returns:
+        Optional[Response]: The cached response, or None on a miss
+    """
+
+    if not response_cache_enabled():
+        return None
+
+    return get_response_cache(current_app._get_current_object()).get(namespaces, version)
+
+
+def cache_response(namespaces: tuple, version: str, response: Response) -> Response:
+    """Cache the response of the current request, if caching is on
+
+    Args:
+        namespaces (tuple): The namespaces the response belongs to
+        version (str): The version of the data the response was made from
+        response (Response): The response to cache
+
+    Returns:
+        Response: The same response
+    """
+
+    if not response_cache_enabled():
+        return response
+
+    return get_response_cache(current_app._get_current_object()).set(namespaces, version, response)
+
+
+def invalidate_cached_responses(*namespaces: str) -> None:
+    """Drop the cached responses of the given namespaces after a write
+
+    Args:
+        namespaces (str): The namespaces whose data changed
+    """
+
+    if response_cache_enabled():
+        get_response_cache(current_app._get_current_object()).invalidate(*namespaces)
+
+# endregion
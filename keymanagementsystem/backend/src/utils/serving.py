@@ -0,0 +1,32 @@
+"""
+    Utility script for running the app under a pre-forking server such as
+    gunicorn (see gunicorn.conf.py). A MongoClient is not fork-safe, so each
+    worker process must open its own connections after the fork
+"""
+
+# Import mongo objects
+from mongoengine import Document, connection
+from mongoengine.base.common import _get_documents_by_db
+
+
+def reset_mongo_connections(close: bool) -> None:
+    """Forget the MongoDB clients of this process, keeping their settings,
+    so the next query opens new connections.
+
+    Args:
+        close (bool): Whether to close the clients first. Only the process
+        that created them may do this: a forked child shares their sockets
+        with its parent, so closing them there would disturb the parent
+    """
+
+    for alias in list(connection._connections):
+        client = connection._connections.pop(alias)
+        if close:
+            client.close()
+
+    # Documents keep their collection objects, which point at the old client
+    for alias in list(connection._dbs):
+        for document in _get_documents_by_db(alias, connection.DEFAULT_CONNECTION_NAME):
+            if issubclass(document, Document):
+                document._disconnect()
+        del connection._dbs[alias]
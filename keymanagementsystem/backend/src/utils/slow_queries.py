@@ -0,0 +1,356 @@
+"""
+    Utility script for logging slow MongoDB operations. A driver command
+    listener logs every operation slower than SLOW_QUERY_MS with its
+    collection, the shape of its filter (values redacted), its duration and
+    the route that ran it. Optionally, the query plans of the slowest query
+    shapes are captured into the capped slow_queries collection
+"""
+
+# Import libraries
+import json
+import logging
+import threading
+import time
+from contextvars import ContextVar
+from queue import Full, Queue
+from typing import Any, Optional
+
+# Import flask objects
+from flask import Flask, Response, request
+
+# Import mongo objects
+from mongoengine.connection import get_db
+from pymongo import monitoring
+
+# Import schemas
+from ..schemas.slow_query import SlowQuery
+
+# Logger of the slow query lines (one JSON object per query)
+slow_query_logger: logging.Logger = logging.getLogger("kms.slow_query")
+
+# Defaults for the SLOW_QUERY_* config settings
+DEFAULT_THRESHOLD_MS = 200
+DEFAULT_EXPLAIN_INTERVAL = 600
+
+# The operations that are timed, and where each keeps its query
+QUERY_FIELDS: dict = {
+    "find": ["filter", "sort"],
+    "aggregate": ["pipeline"],
+    "count": ["query"],
+    "distinct": ["key", "query"],
+    "findAndModify": ["query", "sort"],
+    "update": ["updates"],
+    "delete": ["deletes"],
+    "insert": [],
+    "getMore": []
+}
+
+# The operations whose plans can be explained
+EXPLAINABLE: tuple = ("find", "aggregate", "count", "distinct", "findAndModify", "update", "delete")
+
+# Fields of a sent command that are not part of the query itself
+SESSION_FIELDS: tuple = ("$db", "lsid", "$clusterTime", "txnNumber", "startTransaction",
+                         "autocommit", "$readPreference", "readConcern", "writeConcern")
+
+# The method and endpoint of the request running in this context
+current_route: ContextVar = ContextVar("current_route", default=None)
+
+
+# region Shapes
+
+def redact(value: Any) -> Any:
+    """Replace every value in a query with "?", keeping its field names
+    and operators (e.g. {"pid": {"$in": ["a", "b"]}} becomes
+    {"pid": {"$in": ["?"]}})
+
+    Args:
+        value (Any): The query or part of it
+
+    Returns:
+        Any: The shape of the value
+    """
+
+    if isinstance(value, dict):
+        return {key: redact(item) for key, item in value.items()}
+
+    # Lists of conditions ($and, $or, pipelines) keep each condition's shape
+    if isinstance(value, (list, tuple)):
+        shapes: list = []
+        for item in value:
+            shape: Any = redact(item)
+            if shape not in shapes:
+                shapes.append(shape)
+        return shapes
+
+    return "?"
+
+
+def command_shape(name: str, command: dict) -> dict:
+    """Get the redacted query of a command
+
+    Args:
+        name (str): The command name
+        command (dict): The command as sent to the server
+
+    Returns:
+        dict: The shape of each field holding the query
+    """
+
+    shape: dict = {}
+    for field in QUERY_FIELDS.get(name, []):
+        if field not in command:
+            continue
+
+        # Sort orders and distinct keys are not values, keep them
+        if field in ("sort", "key"):
+            shape[field] = command[field]
+
+        # Keep only the filters of updates and deletes
+        elif field in ("updates", "deletes"):
+            shape[field] = redact([{"q": statement.get("q", {})} for statement in command[field]])
+
+        else:
+            shape[field] = redact(command[field])
+
+    return shape
+
+
+def command_target(name: str, command: dict) -> str:
+    """Get the collection a command runs on
+
+    Args:
+        name (str): The command name
+        command (dict): The command as sent to the server
+
+    Returns:
+        str: The collection name
+    """
+
+    target: Any = command.get("collection") if name == "getMore" else command.get(name)
+    return target if isinstance(target, str) else "?"
+
+# endregion
+
+
+# region Plans
+
+def summarize_plan(explained: dict) -> dict:
+    """Reduce an explain() result to its winning plan's stages and indexes.
+    The rest (including the parsed query and its values) is dropped
+
+    Args:
+        explained (dict): The result of the explain command
+
+    Returns:
+        dict: The plan stages (outermost first), the indexes used and
+        whether any stage scanned the whole collection
+    """
+
+    stages: list = []
+    indexes: list = []
+
+    def walk_stage(stage: dict) -> None:
+        stages.append(stage.get("stage", "?"))
+        if "indexName" in stage:
+            indexes.append(stage["indexName"])
+        for child in [stage.get("inputStage")] + stage.get("inputStages", []):
+            if isinstance(child, dict):
+                walk_stage(child)
+
+    # Aggregations nest their plan inside the pipeline's first stage
+    def find_plans(value: Any) -> None:
+        if isinstance(value, dict):
+            for key, item in value.items():
+                if key == "winningPlan" and isinstance(item, dict):
+                    walk_stage(item.get("queryPlan", item))
+                else:
+                    find_plans(item)
+        elif isinstance(value, list):
+            for item in value:
+                find_plans(item)
+
+    find_plans(explained)
+
+    return {
+        "plan": stages,
+        "indexes": list(dict.fromkeys(indexes)),
+        "collection_scan": "COLLSCAN" in stages
+    }
+
+
+class PlanCapturer:
+    """
+        Explains slow queries on a background thread, so the request that
+        ran them is not slowed further, and stores the plans in
+        slow_queries. A query shape is explained again only if it got twice
+        as slow, or after interval seconds
+    """
+
+    def __init__(self, interval: float):
+        self.interval: float = interval
+        self.queue: Queue = Queue(maxsize=100)
+        self.explained: dict = {}  # shape key -> (duration_ms, when)
+        self.lock: threading.Lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+
+    def offer(self, name: str, command: dict, entry: dict) -> None:
+        """Queue a slow query for explaining, unless its shape was
+        explained recently at a similar speed
+
+        Args:
+            name (str): The command name
+            command (dict): The command as sent to the server
+            entry (dict): The slow query's log entry
+        """
+
+        key: str = json.dumps([name, entry["target"], entry["shape"]], sort_keys=True, default=str)
+        now: float = time.monotonic()
+
+        with self.lock:
+            previous: Optional[tuple] = self.explained.get(key)
+            if previous and entry["duration_ms"] < previous[0] * 2 and now - previous[1] < self.interval:
+                return
+
+            # Forget old shapes rather than grow without bound
+            if len(self.explained) >= 1000:
+                self.explained.clear()
+            self.explained[key] = (entry["duration_ms"], now)
+
+            # Start the thread on first use (threads do not survive a fork,
+            # so each worker process starts its own)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name="slow-query-explain", daemon=True)
+                self.thread.start()
+
+        try:
+            self.queue.put_nowait((name, command, entry))
+        except Full:
+            pass
+
+    def run(self) -> None:
+        while True:
+            name, command, entry = self.queue.get()
+            try:
+                self.capture(name, command, entry)
+            except Exception as e:
+                slow_query_logger.warning(f"Could not explain a slow {name}: {e}")
+
+    def capture(self, name: str, command: dict, entry: dict) -> None:
+        """Explain a query and store its plan
+
+        Args:
+            name (str): The command name
+            command (dict): The command as sent to the server
+            entry (dict): The slow query's log entry
+        """
+
+        query: dict = {field: value for field, value in command.items() if field not in SESSION_FIELDS}
+        explained: dict = get_db().command({"explain": query, "verbosity": "queryPlanner"})
+
+        SlowQuery(command=name, target=entry["target"], shape=json.dumps(entry["shape"], default=str),
+                  duration_ms=entry["duration_ms"], route=entry["route"],
+                  **summarize_plan(explained)).save()
+
+# endregion
+
+
+# region Command monitoring
+
+class SlowQueryListener(monitoring.CommandListener):
+    """
+        Logs operations slower than the threshold. pymongo calls listeners
+        on the thread that ran the command, so the context variable names
+        the route that ran it
+    """
+
+    def __init__(self):
+        self.threshold_ms: float = DEFAULT_THRESHOLD_MS
+        self.capturer: Optional[PlanCapturer] = None
+        self.running: dict = {}  # (connection, request id) -> (name, command, route)
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        if event.command_name not in QUERY_FIELDS:
+            return
+
+        # Explaining a query would otherwise log its own explain
+        if event.command.get(event.command_name) == SlowQuery._meta["collection"]:
+            return
+
+        self.running[(event.connection_id, event.request_id)] = \
+            (event.command_name, event.command, current_route.get())
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        self.finished(event)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        self.finished(event)
+
+    def finished(self, event) -> None:
+        started: Optional[tuple] = self.running.pop((event.connection_id, event.request_id), None)
+        if started is None:
+            return
+
+        duration_ms: float = event.duration_micros / 1000
+        if duration_ms < self.threshold_ms:
+            return
+
+        name, command, route = started
+        entry: dict = {
+            "target": command_target(name, command),
+            "shape": command_shape(name, command),
+            "duration_ms": round(duration_ms, 2),
+            "route": route
+        }
+
+        slow_query_logger.warning(json.dumps({"event": "slow_query", "command": name, **entry},
+                                             separators=(",", ":"), default=str))
+
+        if self.capturer is not None and name in EXPLAINABLE:
+            self.capturer.offer(name, command, entry)
+
+
+# Listeners are global to pymongo, so register ours only once
+slow_query_listener: SlowQueryListener = SlowQueryListener()
+listener_registered: bool = False
+
+# endregion
+
+
+# region Request hooks
+
+def init_slow_query_log(app: Flask) -> None:
+    """Log MongoDB operations slower than SLOW_QUERY_MS (200 by default),
+    unless SLOW_QUERY_LOG is False. With SLOW_QUERY_EXPLAIN = True, also
+    capture the plans of the slowest query shapes, at most once every
+    SLOW_QUERY_EXPLAIN_INTERVAL seconds (600) per shape unless they get
+    twice as slow. Must run before the app connects to MongoDB
+
+    Args:
+        app (Flask): The application
+    """
+
+    global listener_registered
+
+    if not app.config.get("SLOW_QUERY_LOG", True):
+        return
+
+    slow_query_listener.threshold_ms = float(app.config.get("SLOW_QUERY_MS", DEFAULT_THRESHOLD_MS))
+    if app.config.get("SLOW_QUERY_EXPLAIN", False) and slow_query_listener.capturer is None:
+        slow_query_listener.capturer = PlanCapturer(
+            float(app.config.get("SLOW_QUERY_EXPLAIN_INTERVAL", DEFAULT_EXPLAIN_INTERVAL)))
+
+    if not listener_registered:
+        monitoring.register(slow_query_listener)
+        listener_registered = True
+
+    @app.before_request
+    def remember_route() -> None:
+        current_route.set(f"{request.method} {request.endpoint or 'unmatched'}")
+
+    @app.after_request
+    def forget_route(response: Response) -> Response:
+        # Streamed bodies still query, so forget the route once sent
+        response.call_on_close(lambda: current_route.set(None))
+        return response
+
+# endregion
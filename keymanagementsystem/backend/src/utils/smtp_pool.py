@@ -0,0 +1,216 @@
+"""
+    Utility script for a small pool of persistent SMTP connections, so that
+    many emails can be sent without a new connection and TLS handshake each
+"""
+
+# Import libraries
+import smtplib
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from queue import Empty, LifoQueue
+from typing import Iterator
+
+# Import flask objects
+from flask import Flask
+from flask_mail import Connection, Message
+
+# Import metrics
+from .metrics import observe_email_send
+
+# Defaults for the MAIL_POOL_* config settings
+DEFAULT_POOL_SIZE = 2
+DEFAULT_IDLE_SECONDS = 60
+
+# Errors after which a connection is reopened and the email tried once more.
+# Any other SMTPException (e.g. a refused recipient) fails only its email
+# (every SMTPException is an OSError, so OSError itself cannot be listed)
+CONNECTION_ERRORS: tuple = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError,
+                            ConnectionError, socket.timeout)
+
+
+class PooledConnection:
+    """
+        A persistent Flask-Mail connection with throughput counters
+    """
+
+    def __init__(self, pool: "SMTPConnectionPool", number: int):
+        self.pool: SMTPConnectionPool = pool
+        self.number: int = number
+        self.connection: Connection = None
+        self.last_used: float = 0.0
+
+        # Counters
+        self.sent: int = 0
+        self.failed: int = 0
+        self.connects: int = 0
+        self.seconds_sending: float = 0.0
+
+    def open(self) -> None:
+        """Open (or reopen) the SMTP connection"""
+
+        self.close()
+        self.connection = Connection(self.pool.mail).__enter__()
+        self.connects += 1
+
+    def close(self) -> None:
+        """Close the SMTP connection, ignoring errors from a dead server"""
+
+        if self.connection is not None:
+            try:
+                self.connection.__exit__(None, None, None)
+            except Exception:
+                pass
+            self.connection = None
+
+    def send(self, msg: Message) -> None:
+        """Send one email, reconnecting once if the connection was lost
+
+        Args:
+            msg (Message): The email to send
+        """
+
+        start: float = time.monotonic()
+        try:
+            # Servers drop idle connections, so reopen stale ones up front
+            if self.connection is None or start - self.last_used > self.pool.idle_seconds:
+                self.open()
+
+            try:
+                self.connection.send(msg)
+            except CONNECTION_ERRORS:
+                self.open()
+                self.connection.send(msg)
+            self.sent += 1
+            observe_email_send(time.monotonic() - start, True)
+
+        except Exception:
+            self.failed += 1
+            observe_email_send(time.monotonic() - start, False)
+            raise
+
+        finally:
+            self.last_used = time.monotonic()
+            self.seconds_sending += self.last_used - start
+
+    def stats(self) -> dict:
+        """Get the counters of this connection
+
+        Returns:
+            dict: The counters, including emails sent per second of sending
+        """
+
+        return {
+            "connection": self.number,
+            "open": self.connection is not None,
+            "sent": self.sent,
+            "failed": self.failed,
+            "connects": self.connects,
+            "seconds_sending": round(self.seconds_sending, 3),
+            "emails_per_second": round(self.sent / self.seconds_sending, 2) if self.seconds_sending else 0.0
+        }
+
+
+class SMTPConnectionPool:
+    """
+        Hands out up to MAIL_POOL_SIZE persistent SMTP connections
+    """
+
+    def __init__(self, app: Flask):
+        self.mail = app.extensions["mail"]
+        self.size: int = app.config.get("MAIL_POOL_SIZE", DEFAULT_POOL_SIZE)
+        self.idle_seconds: float = app.config.get("MAIL_POOL_IDLE_SECONDS", DEFAULT_IDLE_SECONDS)
+
+        self.connections: list = [PooledConnection(self, number) for number in range(self.size)]
+        self.idle: LifoQueue = LifoQueue()
+        for connection in self.connections:
+            self.idle.put(connection)
+
+    @contextmanager
+    def connection(self) -> Iterator[PooledConnection]:
+        """Borrow a connection, waiting for one if all are in use
+
+        Yields:
+            PooledConnection: The borrowed connection
+        """
+
+        connection: PooledConnection = self.idle.get()
+        try:
+            yield connection
+        finally:
+            self.idle.put(connection)
+
+    def send_many(self, messages: list) -> list:
+        """Send many emails over a single connection
+
+        Args:
+            messages (list): The emails to send
+
+        Returns:
+            list: The error for each email (None if it was sent)
+        """
+
+        errors: list = []
+        with self.connection() as connection:
+            for msg in messages:
+                try:
+                    connection.send(msg)
+                    errors.append(None)
+
+                # The server cannot be reached even after reconnecting, so
+                # fail the rest of the batch without trying each email
+                except CONNECTION_ERRORS as e:
+                    connection.close()
+                    errors.extend([e] * (len(messages) - len(errors)))
+                    break
+
+                except Exception as e:
+                    errors.append(e)
+
+        return errors
+
+    def close(self) -> None:
+        """Close every idle connection"""
+
+        # Take every idle connection out first so none is closed twice
+        closing: list = []
+        while True:
+            try:
+                closing.append(self.idle.get_nowait())
+            except Empty:
+                break
+
+        for connection in closing:
+            connection.close()
+            self.idle.put(connection)
+
+    def stats(self) -> list:
+        """Get the counters of every connection
+
+        Returns:
+            list: The counters of each connection
+        """
+
+        return [connection.stats() for connection in self.connections]
+
+
+# Guards creating the pool of this process
+pool_lock: threading.Lock = threading.Lock()
+
+
+def get_smtp_pool(app: Flask) -> SMTPConnectionPool:
+    """Get the SMTP pool of this process, creating it on first use
+    (so it is never shared across forked processes)
+
+    Args:
+        app (Flask): The application
+
+    Returns:
+        SMTPConnectionPool: The pool
+    """
+
+    with pool_lock:
+        if "smtp_pool" not in app.extensions:
+            app.extensions["smtp_pool"] = SMTPConnectionPool(app)
+        return app.extensions["smtp_pool"]
@@ -0,0 +1,53 @@
+"""
+    Utility script for running several database writes as one transaction
+"""
+
+# Import libraries
+from typing import Any, Callable, Optional
+
+# Import flask objects
+from flask import current_app
+
+# Import mongo objects
+from mongoengine.connection import get_connection
+from pymongo.client_session import ClientSession
+from pymongo.errors import OperationFailure
+
+# Error code returned by standalone servers, which cannot run transactions
+ILLEGAL_OPERATION = 20
+
+
+def run_in_transaction(callback: Callable[[Optional[ClientSession]], Any]) -> Any:
+    """Runs callback inside a MongoDB transaction. The callback must pass the
+    session it receives to every pymongo operation it runs.
+
+    Transactions need a replica set. When MONGODB_TRANSACTIONS is False, or
+    the server turns out to be standalone, the callback is called with
+    session=None instead, so it should make its first write the one that
+    decides whether the others happen.
+
+    Args:
+        callback (Callable[[Optional[ClientSession]], Any]): The operations
+        to run
+
+    Returns:
+        Any: Whatever the callback returned
+    """
+
+    # Run without a transaction if they are turned off
+    if not current_app.config.get("MONGODB_TRANSACTIONS", True):
+        return callback(None)
+
+    try:
+        with get_connection().start_session() as session:
+            return session.with_transaction(callback)
+
+    # Fall back when the server cannot run transactions. This fails on the
+    # first operation, before anything is written
+    except OperationFailure as e:
+        if e.code != ILLEGAL_OPERATION:
+            raise
+
+        current_app.logger.warning(
+            "MongoDB does not support transactions here, set MONGODB_TRANSACTIONS = False")
+        return callback(None)
@@ -0,0 +1,176 @@
+"""
+    Utility script for finding users by name through the normalized name
+    fields that User.clean() maintains
+"""
+
+# Import libraries
+import re
+from typing import Optional, Tuple
+
+# Import flask objects
+from flask import abort, make_response
+
+# Import schemas
+from ..schemas.user import User, INTERNAL_FIELDS, name_words, normalize_name, soundex
+
+# Import pagination
+from .pagination import encode_cursor, decode_cursor
+
+# Default and maximum number of results in one page
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+
+# Most users listed when a name is shared
+MAX_NAME_MATCHES = 10
+
+
+def prefix(text: str) -> re.Pattern:
+    # Anchored prefix regexes can be answered from an index
+    return re.compile(f"^{re.escape(text)}")
+
+
+def search_tiers(query: str) -> list:
+    """Builds the filters of each rank, best first:
+    4. the whole name matches (ignoring case and spacing)
+    3. the name starts with the query
+    2. every word of the query starts a word of the name
+    1. every word of the query sounds like a word of the name
+
+    Args:
+        query (str): The text to search for
+
+    Returns:
+        list: (score, filter) pairs. Each filter excludes the better
+        ranks, so every user is in exactly one of them
+    """
+
+    words: list = name_words(query)
+    if not words:
+        return []
+
+    name: str = normalize_name(query)
+    filters: list = [
+        (4, {"name_key": name}),
+        (3, {"name_key": prefix(name)}),
+        (2, {"$and": [{"name_terms": prefix(word)} for word in words]}),
+        (1, {"name_sounds": {"$all": list(dict.fromkeys(soundex(word) for word in words))}})
+    ]
+
+    return [(score, {"$and": [match] + ([{"$nor": [better for _, better in filters[:index]]}]
+                                        if index else [])})
+            for index, (score, match) in enumerate(filters)]
+
+
+def search_users(query: str, limit: int = DEFAULT_SEARCH_LIMIT, cursor: Optional[str] = None,
+                 fields: Optional[list] = None) -> Tuple[list, Optional[str]]:
+    """Finds the users best matching a name, one page at a time.
+    Users are ranked by score, then by name. Pages resume from a cursor
+    over (score, name, _id), so later pages cost the same as the first.
+    Triggers abort if the cursor is malformed.
+
+    Args:
+        query (str): The name (or part of it) to search for
+        limit (int): The maximum number of users to return
+        cursor (Optional[str]): The cursor returned with the previous page
+        fields (Optional[list]): The user fields to return (all if None)
+
+    Returns:
+        Tuple[list, Optional[str]]: The raw users (each with a "score") and
+        the cursor for the next page (None if this is the last page)
+    """
+
+    # Resume inside the rank the previous page stopped in
+    after: Optional[tuple] = None
+    if cursor:
+        value, oid = decode_cursor(cursor)
+        if not isinstance(value, list) or len(value) != 2:
+            abort(make_response("Error! The cursor is not valid.", 400))
+        after = (value[0], value[1], oid)
+
+    # Read the name key too, for the cursor, and drop it afterwards
+    if fields:
+        projection: dict = dict.fromkeys([field for field in fields if field != "id"] + ["name_key"], 1)
+    else:
+        projection: dict = {field: 0 for field in INTERNAL_FIELDS if field != "name_key"}
+
+    collection = User._get_collection()
+    results: list = []
+
+    for score, filters in search_tiers(query):
+        if after and score > after[0]:
+            continue
+
+        # Skip past the last user of the previous page
+        if after and score == after[0]:
+            filters = {"$and": [filters, {"$or": [
+                {"name_key": {"$gt": after[1]}},
+                {"name_key": after[1], "_id": {"$gt": after[2]}}
+            ]}]}
+
+        # Fetch one extra user to know whether there is a next page
+        users = collection.find(filters, projection) \
+            .sort([("name_key", 1), ("_id", 1)]).limit(limit + 1 - len(results))
+        for user in users:
+            user["score"] = score
+            results.append(user)
+
+        if len(results) > limit:
+            break
+
+    next_cursor: Optional[str] = None
+    if len(results) > limit:
+        results = results[:limit]
+        last: dict = results[-1]
+        next_cursor = encode_cursor([last["score"], last.get("name_key")], last["_id"])
+
+    for user in results:
+        user.pop("name_key", None)
+
+    return results, next_cursor
+
+
+def get_user_by_name(full_name: str, fields: Optional[list] = None) -> dict:
+    """Finds the one user with a name (ignoring case and spacing).
+    Triggers abort with 404 if nobody has the name, or with 409 (listing
+    their pids) if several users share it.
+
+    Args:
+        full_name (str): The full name
+        fields (Optional[list]): The user fields to return (all if None)
+
+    Returns:
+        dict: The raw user
+    """
+
+    # Always read the pid to list the users sharing the name
+    if fields:
+        projection: dict = dict.fromkeys([field for field in fields if field != "id"] + ["pid"], 1)
+    else:
+        projection: dict = {field: 0 for field in INTERNAL_FIELDS}
+
+    users: list = list(User._get_collection()
+                       .find({"name_key": normalize_name(full_name)}, projection)
+                       .limit(MAX_NAME_MATCHES + 1))
+
+    # Users saved before the name fields existed only match their exact
+    # name, until "flask db search-terms" fills the fields in
+    if not users:
+        users: list = list(User._get_collection()
+                           .find({"full_name": full_name, "name_key": {"$exists": False}}, projection)
+                           .limit(MAX_NAME_MATCHES + 1))
+
+    if not users:
+        abort(make_response(f"Error! User with full_name: {full_name} does not exist in database!", 404))
+
+    if len(users) > 1:
+        pids: str = ", ".join(user["pid"] for user in users[:MAX_NAME_MATCHES])
+        more: str = " and more" if len(users) > MAX_NAME_MATCHES else ""
+        abort(make_response(
+            f"Error! Multiple users are named {full_name}: {pids}{more}. "
+            f"Look them up by pid or through /users/search instead.", 409))
+
+    user: dict = users[0]
+    if fields and "pid" not in fields:
+        user.pop("pid")
+
+    return user
@@ -3,23 +3,174 @@
 """
 
 # Import libraries
-from datetime import datetime
+import threading
+import time
+from datetime import datetime, timedelta
 from typing import Any
 
 # Import flask objects
-from flask import Response, current_app, session, abort, make_response
+from flask import Response, current_app, session, abort, make_response, g
+
+# Import mongo objects
+from mongoengine.connection import get_db
 
 # Import schemas
 # from ..schemas.key import Key #, MAX_TAG_LENGTH, MAX_SERIES_LENGTH, MAX_BUILDING_LENGTH, MAX_LOCATION_LENGTH
 from ..schemas.user import User  # , MAX_FULL_NAME_LENGTH
 # from ..schemas.record import Record #, MAX_TAG_LENGTH, MAX_COMMENT_LENGTH, MAX_PID_LENGTH
 
+# Default number of seconds a role cached in the session is trusted for
+DEFAULT_SESSION_ROLE_TTL = 300
 
-def validate_authenticated() -> Response:
-    """Ensures that requests came from an authenticated client
+# Default number of seconds between reads of the role changes made by
+# other processes
+DEFAULT_SESSION_ROLE_SYNC = 5
+
+# Name of the collection holding the latest role version of each user
+# whose role changed recently (shared by every worker process)
+ROLE_VERSIONS_COLLECTION = "role_versions"
+
+# The latest role version known to this process for each recently changed
+# pid, as (version, when it changed). A session holding an older version
+# is refreshed before its TTL expires
+role_versions: dict = {}
+role_versions_synced_at: float = 0.0
+role_versions_lock: threading.Lock = threading.Lock()
+
+
+# region Session role cache
+
+def session_role_cache_enabled() -> bool:
+    """Checks whether roles may be read from the session
+    (opt-in with the SESSION_ROLE_CACHE config setting)
+
+    Returns:
+        bool: True if the session role cache is enabled
+    """
+
+    return bool(current_app.config.get("SESSION_ROLE_CACHE", False))
+
+
+def cache_session_role(user: User) -> None:
+    """Stores the user's role, role version and a timestamp in the
+    (signed) session cookie
+
+    Args:
+        user (User): The user that owns the session
+    """
+
+    session["role"] = user.role
+    session["role_version"] = user.role_version
+    session["role_cached_at"] = time.time()
+
+
+def remember_role_version(pid: str, role_version: int, changed_at: float) -> None:
+    """Records a role version in this process, keeping the newest
+
+    Args:
+        pid (str): The pid of the user whose role changed
+        role_version (int): The user's new role version
+        changed_at (float): When the role changed (as a timestamp)
+    """
+
+    known: tuple = role_versions.get(pid, (0, 0.0))
+    if role_version >= known[0]:
+        role_versions[pid] = (role_version, max(changed_at, known[1]))
+
+
+def invalidate_session_role(pid: str, role_version: int) -> None:
+    """Records that a user's role changed (or the user was deleted) so
+    sessions caching an older role are refreshed early. This process
+    notices right away. The change is also stored in the role_versions
+    collection, which the other worker processes read at most every
+    SESSION_ROLE_SYNC seconds.
+
+    Args:
+        pid (str): The pid of the user whose role changed
+        role_version (int): The user's new role version
+    """
+
+    now: datetime = datetime.now()
+    with role_versions_lock:
+        remember_role_version(pid, role_version, now.timestamp())
+
+    versions = get_db()[ROLE_VERSIONS_COLLECTION]
+    versions.update_one({"_id": pid},
+                        {"$max": {"version": role_version}, "$set": {"changed_at": now}},
+                        upsert=True)
+
+    # Changes older than the TTL no longer matter, since every session
+    # cached before them has expired
+    ttl: float = current_app.config.get("SESSION_ROLE_TTL", DEFAULT_SESSION_ROLE_TTL)
+    versions.delete_many({"changed_at": {"$lt": now - timedelta(seconds=ttl)}})
+
+
+def sync_role_versions() -> None:
+    """Reads the role changes made by every process, at most once every
+    SESSION_ROLE_SYNC seconds (5 by default)
+    """
+
+    global role_versions_synced_at
+
+    interval: float = current_app.config.get("SESSION_ROLE_SYNC", DEFAULT_SESSION_ROLE_SYNC)
+    if time.monotonic() - role_versions_synced_at < interval:
+        return
+
+    ttl: float = current_app.config.get("SESSION_ROLE_TTL", DEFAULT_SESSION_ROLE_TTL)
+    since: datetime = datetime.now() - timedelta(seconds=ttl)
+    changes: list = list(get_db()[ROLE_VERSIONS_COLLECTION].find({"changed_at": {"$gte": since}}))
+
+    with role_versions_lock:
+        for change in changes:
+            remember_role_version(change["_id"], change["version"], change["changed_at"].timestamp())
+
+        # Forget changes older than the TTL
+        for pid in [pid for pid, known in role_versions.items() if known[1] < since.timestamp()]:
+            del role_versions[pid]
+
+        role_versions_synced_at = time.monotonic()
+
+
+def get_session_role() -> str:
+    """Gets the role cached in the session if it can still be trusted
+
+    Returns:
+        str: The cached role, or None if it is missing, expired or stale
+    """
+
+    if not session_role_cache_enabled() or "role" not in session:
+        return None
+
+    # Expire the role after the TTL
+    ttl: float = current_app.config.get("SESSION_ROLE_TTL", DEFAULT_SESSION_ROLE_TTL)
+    if time.time() - session.get("role_cached_at", 0) > ttl:
+        return None
+
+    # Expire the role early if it changed since it was cached
+    sync_role_versions()
+    if session.get("role_version", 0) < role_versions.get(session["pid"], (0, 0.0))[0]:
+        return None
+
+    return session["role"]
+
+# endregion
+
+
+def get_authenticated_user() -> User:
+    """Gets the user who made the request.
     Triggers abort if client is not authenticated.
+
+    The user is only loaded from the database once per request and is
+    kept on flask.g for the other validation helpers and route handlers.
+
+    Returns:
+        User: The authenticated user
     """
 
+    # Reuse the user if it was already loaded during this request
+    if "authenticated_user" in g:
+        return g.authenticated_user
+
     # Abort if cookie cannot be found
     if "pid" not in session:
         abort(make_response(
@@ -42,6 +193,31 @@ def validate_authenticated() -> Response:
         abort(make_response(
             f"Error! user with pid: {pid} not in database! Instruct this user to create an account by signing into the website with PID", 401))
 
+    # Keep the user for the rest of the request
+    g.authenticated_user = user
+
+    # Refresh the role cached in the session
+    if session_role_cache_enabled():
+        cache_session_role(user)
+
+    return user
+
+
+def validate_authenticated() -> None:
+    """Ensures that requests came from an authenticated client
+    Triggers abort if client is not authenticated.
+
+    When the session role cache is enabled and the cached role is still
+    fresh, the database is not queried at all.
+    """
+
+    # Trust a fresh role cached in the session
+    if "pid" in session and session["pid"] is not None and get_session_role():
+        return
+
+    # Otherwise, load the user (will abort if failed)
+    get_authenticated_user()
+
 
 def validate_authenticated_admin() -> None:
     """Ensure request came from an authenticated user with administrator+ role
@@ -55,14 +231,11 @@ def validate_authenticated_admin() -> None:
     if current_app.config["ENV"] == "development":
         return
 
-    # Get pid of client
-    pid = session["pid"]
-
-    # Find the user in the database
-    user: User = User.objects.get(pid=pid)
+    # Use the cached role if possible, otherwise the user's role
+    role: str = get_session_role() or get_authenticated_user().role
 
     # Abort if user is not adminstrator+
-    if user.role not in ("administrator", "sudo"):
+    if role not in ("administrator", "sudo"):
         abort(make_response(
             "Error! User must have administrator role or higher", 403))
 
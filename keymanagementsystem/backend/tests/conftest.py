@@ -0,0 +1,57 @@
+"""
+    Fixtures for testing the routes against an in-memory MongoDB
+"""
+
+# Import libraries
+import pytest
+
+# Import flask objects
+from flask import Flask
+from flask_mail import Mail
+from flask_mongoengine.json import override_json_encoder
+
+# Import mongo objects
+import mongoengine
+
+# Import blueprints
+from src.routes.blueprint_users import blueprint_users
+
+# Import schemas
+from src.schemas.key import Key
+from src.schemas.user import User
+from src.schemas.record import Record
+
+
+@pytest.fixture
+def app() -> Flask:
+    """An app serving the user routes from mongomock, without transactions
+    (mongomock cannot run them) and with an administrator "admin"
+    """
+
+    mongoengine.disconnect_all()
+    mongoengine.connect("kms_test", host="mongomock://localhost", uuidRepresentation="standard")
+
+    app: Flask = Flask(__name__)
+    app.config.update(SECRET_KEY="test", ENV="production", TESTING=True,
+                      MONGODB_TRANSACTIONS=False, MAIL_SUPPRESS_SEND=True)
+    override_json_encoder(app)
+    Mail(app)
+    app.register_blueprint(blueprint_users, url_prefix="/api")
+
+    for document in (Key, User, Record):
+        document.drop_collection()
+    User(pid="admin", full_name="Ad Min", role="administrator").save()
+
+    yield app
+
+    mongoengine.disconnect_all()
+
+
+@pytest.fixture
+def admin_client(app: Flask):
+    """A test client signed in as the administrator"""
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["pid"] = "admin"
+    return client
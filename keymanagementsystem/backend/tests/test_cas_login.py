@@ -0,0 +1,65 @@
+"""
+    Tests for logging in through CAS, against the CAS stub server
+"""
+
+# Import libraries
+import threading
+from http.server import ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import pytest
+import requests
+
+# Import blueprints
+from src.routes.blueprint_cas import blueprint_cas
+
+# Import the CAS stub
+from src.utils.cas_stub import CASStubHandler, TicketStore
+
+
+@pytest.fixture
+def cas_server():
+    """A CAS stub logging in "stub0", on a free local port"""
+
+    CASStubHandler.store = TicketStore(1)
+    CASStubHandler.quiet = True
+    server: ThreadingHTTPServer = ThreadingHTTPServer(("localhost", 0), CASStubHandler)
+    thread: threading.Thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield f"http://localhost:{server.server_port}/cas/login"
+
+    server.shutdown()
+    server.server_close()
+
+
+def test_login_verifies_ticket_over_pooled_session(app, cas_server):
+    app.config.update(CAS_SERVER_URL=cas_server,
+                      CAS_SERVICE_URL="http://localhost/api/cas/login_callback")
+    app.register_blueprint(blueprint_cas, url_prefix="/api")
+    client = app.test_client()
+
+    # Log in twice, as CAS would send the user back each time
+    for destination in ("/first", "/second"):
+        login = client.get("/api/cas/login", query_string={"destination": destination})
+        callback = urlparse(requests.get(login.headers["Location"], allow_redirects=False).headers["Location"])
+        response = client.get(f"{callback.path}?{callback.query}")
+
+        assert response.status_code == 302
+        assert response.headers["Location"].endswith(destination)
+
+    # Both verifications went through the one session of this process
+    assert app.extensions["cas_session"].get_adapter(cas_server).poolmanager.pools
+
+
+def test_replayed_ticket_is_rejected(app, cas_server):
+    app.config.update(CAS_SERVER_URL=cas_server,
+                      CAS_SERVICE_URL="http://localhost/api/cas/login_callback")
+    app.register_blueprint(blueprint_cas, url_prefix="/api")
+    client = app.test_client()
+
+    login = client.get("/api/cas/login", query_string={"destination": "/home"})
+    callback = urlparse(requests.get(login.headers["Location"], allow_redirects=False).headers["Location"])
+    client.get(f"{callback.path}?{callback.query}")
+
+    assert b"Failed to verify ticket" in client.get(f"{callback.path}?{callback.query}").data
@@ -0,0 +1,36 @@
+"""
+    Tests for the per-collection change counters
+"""
+
+# Import the counters
+from src.utils import collection_versions
+from src.utils.collection_versions import get_collection_versions, bump_collection_versions
+
+
+def test_read_racing_a_bump_is_not_cached(app, monkeypatch):
+    with app.app_context():
+        get_collection_versions("keys")
+        bump_collection_versions("keys")
+        before: str = get_collection_versions("keys")["keys"]
+
+        # Bump while the next read is waiting for MongoDB, after it has
+        # fetched the old version
+        get_db = collection_versions.get_db
+
+        class RacingVersions:
+            def __init__(self, versions):
+                self.versions = versions
+
+            def find(self, *args, **kwargs):
+                docs: list = list(self.versions.find(*args, **kwargs))
+                monkeypatch.setattr(collection_versions, "get_db", get_db)
+                bump_collection_versions("keys")
+                return docs
+
+        monkeypatch.setattr(collection_versions, "get_db", lambda: {
+            collection_versions.VERSIONS_COLLECTION: RacingVersions(get_db()[collection_versions.VERSIONS_COLLECTION])})
+        collection_versions.cached_versions.pop("keys", None)
+
+        # The racing read returns the old version, but does not keep it
+        assert get_collection_versions("keys")["keys"] == before
+        assert get_collection_versions("keys")["keys"] != before
@@ -0,0 +1,30 @@
+"""
+    Tests for the database management commands
+"""
+
+# Import the commands
+from src.utils.db_commands import db_cli
+
+# Import schemas
+from src.schemas.user import User
+
+
+def test_indexes_check_reports_missing_unique_option(app):
+    runner = app.test_cli_runner()
+    assert runner.invoke(db_cli, ["indexes"]).exit_code == 0
+
+    # Replace the unique pid index by a plain one on the same field
+    users = User._get_collection()
+    users.drop_index("pid_1")
+    users.create_index("pid")
+
+    result = runner.invoke(db_cli, ["indexes", "--check"])
+
+    assert result.exit_code == 1
+    assert "users: missing index [('pid', 1)] unique" in result.output
+
+
+def test_requests_do_not_build_indexes(app):
+    User(pid="bob", full_name="Bob Smith", role="requestor").save()
+
+    assert list(User._get_collection().index_information()) == ["_id_"]
@@ -0,0 +1,75 @@
+"""
+    Tests for the SMTP connection pool
+"""
+
+# Import libraries
+import smtplib
+
+# Import flask objects
+from flask import Flask
+from flask_mail import Mail
+
+# Import the pool
+from src.utils import smtp_pool
+
+
+class FakeConnection:
+    """
+        Stands in for a Flask-Mail connection. Refuses the recipient of any
+        message named "bad", and drops the connection on "lost" once
+    """
+
+    opened: int = 0
+    sent: list = []
+    dropped: bool = False
+
+    def __init__(self, mail: Mail):
+        pass
+
+    def __enter__(self) -> "FakeConnection":
+        FakeConnection.opened += 1
+        return self
+
+    def __exit__(self, *args) -> None:
+        pass
+
+    def send(self, msg: str) -> None:
+        FakeConnection.sent.append(msg)
+        if msg == "bad":
+            raise smtplib.SMTPRecipientsRefused({"bad@example.com": (550, b"No such user")})
+        if msg == "lost" and not FakeConnection.dropped:
+            FakeConnection.dropped = True
+            raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+
+
+def make_pool(monkeypatch) -> smtp_pool.SMTPConnectionPool:
+    monkeypatch.setattr(smtp_pool, "Connection", FakeConnection)
+    monkeypatch.setattr(FakeConnection, "opened", 0)
+    monkeypatch.setattr(FakeConnection, "sent", [])
+    monkeypatch.setattr(FakeConnection, "dropped", False)
+
+    app: Flask = Flask(__name__)
+    Mail(app)
+    return smtp_pool.SMTPConnectionPool(app)
+
+
+def test_bad_recipient_fails_only_its_email(monkeypatch):
+    pool: smtp_pool.SMTPConnectionPool = make_pool(monkeypatch)
+
+    errors: list = pool.send_many(["a", "bad", "c", "d"])
+
+    # The bad email is sent once, and the rest of the batch still goes out
+    assert FakeConnection.sent == ["a", "bad", "c", "d"]
+    assert FakeConnection.opened == 1
+    assert errors[0] is None and errors[2] is None and errors[3] is None
+    assert isinstance(errors[1], smtplib.SMTPRecipientsRefused)
+
+
+def test_lost_connection_is_reopened(monkeypatch):
+    pool: smtp_pool.SMTPConnectionPool = make_pool(monkeypatch)
+
+    errors: list = pool.send_many(["a", "lost", "c"])
+
+    assert FakeConnection.sent == ["a", "lost", "lost", "c"]
+    assert FakeConnection.opened == 2
+    assert errors == [None, None, None]
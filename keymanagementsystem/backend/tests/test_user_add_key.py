@@ -0,0 +1,50 @@
+"""
+    Tests for checking out a key (POST /api/users/<pid>/keys/<tag_number>)
+"""
+
+# Import schemas
+from src.schemas.key import Key
+from src.schemas.user import User
+from src.schemas.record import Record
+
+
+class FailingRecords:
+    """
+        Stands in for the ledger collection, failing every insert
+    """
+
+    def insert_one(self, *args, **kwargs) -> None:
+        raise RuntimeError("ledger unavailable")
+
+
+def add_key_and_user() -> Key:
+    User(pid="bob", full_name="Bob Smith", role="requestor").save()
+    key: Key = Key(tag_number="1", series_id="S1", sequence_id=1, building="B1",
+                   key_type="Door", location=["R1"], is_available=True)
+    key.save()
+    return key
+
+
+def test_checkout(admin_client):
+    key: Key = add_key_and_user()
+
+    response = admin_client.post("/api/users/bob/keys/1")
+
+    assert response.status_code == 200
+    key.reload()
+    assert not key.is_available and key.owner_pid == "bob"
+    assert User.objects.get(pid="bob").owned_keys == [key]
+    assert Record.objects(tag_number="1", pid="bob", exchange="acquired").count() == 1
+
+
+def test_checkout_rolls_back_without_transaction(admin_client, monkeypatch):
+    key: Key = add_key_and_user()
+    monkeypatch.setattr(Record, "_get_collection", classmethod(lambda cls: FailingRecords()))
+
+    response = admin_client.post("/api/users/bob/keys/1")
+
+    # The claim and the user's reference are both undone
+    assert response.status_code == 400
+    key.reload()
+    assert key.is_available and key.owner_pid is None
+    assert User.objects.get(pid="bob").owned_keys == []
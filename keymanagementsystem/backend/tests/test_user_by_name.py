@@ -0,0 +1,25 @@
+"""
+    Tests for finding users by name (GET /api/users/name/<full_name>)
+"""
+
+# Import schemas
+from src.schemas.user import User
+
+
+def test_by_name_ignores_case_and_spacing(admin_client):
+    User(pid="bob", full_name="Bob Smith", role="requestor").save()
+
+    response = admin_client.get("/api/users/name/bob  SMITH")
+
+    assert response.status_code == 200
+    assert response.get_json()["pid"] == "bob"
+
+
+def test_by_name_finds_users_without_name_fields(admin_client):
+    # Saved before the name search fields existed
+    User._get_collection().insert_one(
+        {"pid": "old", "full_name": "Old Timer", "role": "requestor", "owned_keys": []})
+
+    assert admin_client.get("/api/users/name/Old Timer").get_json()["pid"] == "old"
+    assert admin_client.get("/api/users/name/Old Timer/keys").status_code == 200
+    assert admin_client.get("/api/users/name/Nobody").status_code == 404
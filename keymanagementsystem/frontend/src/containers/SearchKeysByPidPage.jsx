@@ -26,7 +26,7 @@ export default function SearchKeysByPidPage() {
     const [ownedKeys, setOwnedKeys] = useState(null);
     const [currentPid, setCurrentPid] = useState("");
 
-    useEffect(() => UsersService.getAllUsers().then(result => {
+    useEffect(() => UsersService.getAllUsers(["pid", "full_name", "role"]).then(result => {
 
         console.log("I was called because counter is " + counter);
 
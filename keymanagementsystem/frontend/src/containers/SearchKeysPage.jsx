@@ -46,18 +46,32 @@ export default function SearchKeysPage() {
     // Janky counter for updating useEffect below
     let [counter, setCounter] = useState(0);
 
-    // Key data
+    // Text typed in the table's search box
+    const [searchText, setSearchText] = useState("");
+
+    // Key data (every key, or the server's best matches while searching)
     const [keyData, setKeyData] = useState([]);
-    useEffect(() => KeysService.getAllKeys().then(result => {
+    useEffect(() => {
 
         console.log("I was called because counter is " + counter);
 
-        if (result.ok) {
-            setKeyData(result.data);
-        } else {
-            alert(result.msg)
-        }
-    }), [counter]);
+        // Wait until the user stops typing before searching
+        const timer = setTimeout(() => {
+            const request = searchText
+                ? KeysService.searchKeys(searchText, 100).then(result => result.ok ? { ...result, data: result.data.items } : result)
+                : KeysService.getAllKeys();
+
+            request.then(result => {
+                if (result.ok) {
+                    setKeyData(result.data);
+                } else {
+                    alert(result.msg)
+                }
+            });
+        }, searchText ? 300 : 0);
+
+        return () => clearTimeout(timer);
+    }, [counter, searchText]);
 
     // Handler functions
 
@@ -76,25 +90,19 @@ export default function SearchKeysPage() {
         }
 
         // Assign the key
-        UsersService.assignKey(pid, tag_number).then(result => {
+        // (the server also adds the "acquired" record to the ledger)
+        UsersService.assignKey(pid, tag_number, "Auto-Generated").then(result => {
             if (result.ok) {
                 alert(result.msg);
 
-                // Add the record to database
-                LedgerService.addRecord({
-                    tag_number: tag_number,
-                    pid: pid,
-                    exchange: "acquired",
-                    comment: "Auto-Generated"
-                }).then(result => {
-                    if (!result.ok) {
-                        alert(result.msg);
-                    }
-                });
-
                 setCounter(counter + 1); // Trigger the use effect 
             } else {
-                if (pid == "") {
+                if (result.status === 409) {
+                    // Someone else checked out the key first
+                    alert(result.msg);
+                    setCounter(counter + 1);
+                }
+                else if (pid == "") {
                     alert("No pid given!");
                 }
                 else {
@@ -150,22 +158,11 @@ export default function SearchKeysPage() {
                 // alert(result.msg);
 
                 // Assign the key
-                UsersService.assignKey(newPid, tag_number).then(result2 => {
+                // (the server also adds the "acquired" record to the ledger)
+                UsersService.assignKey(newPid, tag_number, setmessage).then(result2 => {
                     if (result2.ok) {
                         alert(result2.msg);
 
-                        // Add the record to database
-                        LedgerService.addRecord({
-                            tag_number: tag_number,
-                            pid: newPid,
-                            exchange: "acquired",
-                            comment: setmessage
-                        }).then(result3 => {
-                            if (!result3.ok) {
-                                alert(result3.msg);
-                            }
-                        });
-
                         setCounter(counter + 1);
                     } else {
                         alert(result2.msg);
@@ -587,6 +584,10 @@ export default function SearchKeysPage() {
         // Only 1 row can be selected at a time
         selectableRows: "single",
 
+        // Search on the server instead of filtering the rows here
+        onSearchChange: (text) => setSearchText(text ? text.trim() : ""),
+        customSearch: () => true,
+
         // Handle delete functionality
         onRowsDelete: (rowsDeleted) => {
             let index = rowsDeleted.data[0].dataIndex;
@@ -23,7 +23,7 @@ export default function SearchUsersPage() {
     const [userData, setUserData] = useState([]);
     const [ownedKeys, setOwnedKeys] = useState(null);
 
-    useEffect(() => UsersService.getAllUsers().then(result => {
+    useEffect(() => UsersService.getAllUsers(["pid", "full_name", "role"]).then(result => {
 
         console.log("I was called because counter is " + counter);
 
@@ -71,30 +71,51 @@ export default function SearchUsersPage() {
         const fn = prompt("Enter the full name of the user you want to search");
 
         // Do not move on if the input was not provided (such as clicking the cancel button)
-        if (fn == "") {
+        if (!fn) {
             return;
         }
-        //alert(fn + " getSingleUserByName");
-        // Use service class to set user data
-        UsersService.getSingleUserByName(fn).then(result => {
-            if (result.ok) {
-                //alert(JSON.stringify(result.data));
-                setUser(result.data);
-
-                // Use service class to set owned keys
-                UsersService.getUserOwnedKeysByName(fn).then(result => {
-                    if (result.ok) {
-                        //alert("ok")
-                        setOwnedKeys(result.data);
-                    }
 
-                    // No need to do the alert here because the above will already handle that
-                });
-                
-            } else {
-                //alert(JSON.stringify(result.data));
+        // Find the users best matching the name
+        UsersService.searchUsers(fn, 10).then(result => {
+            if (!result.ok) {
                 alert(result.msg);
+                return;
+            }
+
+            const matches = result.data.items;
+            if (matches.length === 0) {
+                alert(`No users match ${fn}`);
+                return;
+            }
+
+            // Ask which one was meant unless a single user matched
+            let pid = matches[0].pid;
+            if (matches.length > 1) {
+                const choices = matches.map(match => `${match.pid} (${match.full_name})`).join("\n");
+                pid = prompt(`Several users match ${fn}. Enter the PID of the one you want:\n${choices}`, pid);
+                if (!pid) {
+                    return;
+                }
             }
+
+            // Use service class to set user data
+            UsersService.getSingleUser(pid).then(result => {
+                if (result.ok) {
+                    setUser(result.data);
+
+                    // Use service class to set owned keys
+                    UsersService.getUserOwnedKeys(pid).then(result => {
+                        if (result.ok) {
+                            setOwnedKeys(result.data);
+                        }
+
+                        // No need to do the alert here because the above will already handle that
+                    });
+
+                } else {
+                    alert(result.msg);
+                }
+            });
         });
     }
 
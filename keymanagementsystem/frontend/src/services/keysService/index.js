@@ -37,6 +37,90 @@ class KeysService {
         return { ok: true, msg: msg, data: data };
     }
 
+    /**
+     * Get a single page of keys, filtered and sorted by the server
+     *
+     * @param {Object} params               - The query parameters for the page
+     * @param {number} params.limit         - The page size (optional)
+     * @param {string} params.cursor        - The next_cursor from the previous page (optional)
+     * @param {string} params.sort          - The field to sort on, prefix with "-" for descending (optional)
+     * @param {string} params.building      - Filter by building (optional)
+     * @param {string} params.key_type      - Filter by key type (optional)
+     * @param {string} params.is_available  - Filter by availability, "true" or "false" (optional)
+     * @param {string} params.series_id     - Filter by series ID (optional)
+     * @param {string} params.location      - Filter by location (optional)
+     *
+     * @return A promise containing JSON like { ok: bool, msg: str, data: null or JSON like { items, total, next_cursor } }
+     */
+    async getKeysPage(params) {
+
+        // Create URL, skipping parameters that were not set
+        const query = new URLSearchParams(
+            Object.entries(params).filter(([_, value]) => value !== undefined && value !== null && value !== "")
+        );
+        let url = `${process.env.REACT_APP_API_URL}/keys?${query.toString()}`;
+
+        // Send GET request
+        const response = await fetch(url, { credentials: "include" });
+
+        // Clone response
+        const dataResponse = response.clone();
+
+        // Get response message
+        let msg = await response.text();
+
+        // Exit if the response is not ok
+        if (!response.ok) {
+            console.error(msg);
+            return { ok: false, msg: msg, data: null };
+        }
+
+        // Get the data
+        const data = await dataResponse.json();
+
+        // Return a json containing response status, message and data
+        return { ok: true, msg: msg, data: data };
+    }
+
+    /**
+     * Search keys by tag number, series ID, building, location and comment
+     *
+     * @param {string} query - The words to search for (matched as whole words or prefixes)
+     * @param {number} limit - The maximum number of keys to return (optional)
+     *
+     * @return A promise containing JSON like { ok: bool, msg: str, data: null or JSON like { items, more } }
+     */
+    async searchKeys(query, limit) {
+
+        // Create URL
+        const params = new URLSearchParams({ q: query });
+        if (limit) {
+            params.set("limit", limit);
+        }
+        let url = `${process.env.REACT_APP_API_URL}/keys/search?${params.toString()}`;
+
+        // Send GET request
+        const response = await fetch(url, { credentials: "include" });
+
+        // Clone response
+        const dataResponse = response.clone();
+
+        // Get response message
+        let msg = await response.text();
+
+        // Exit if the response is not ok
+        if (!response.ok) {
+            console.error(msg);
+            return { ok: false, msg: msg, data: null };
+        }
+
+        // Get the data
+        const data = await dataResponse.json();
+
+        // Return a json containing response status, message and data
+        return { ok: true, msg: msg, data: data };
+    }
+
     /**
      * Get specific key in the system
      * 
@@ -159,6 +243,47 @@ class KeysService {
         return { ok: true, msg: msg, data: null };
     }
 
+    /**
+     * Add many keys to the system at once
+     * 
+     * @param {Array} keys - An array of key objects (same fields as for addKey)
+     * 
+     * @return A promise containing JSON like { ok: bool, msg: str, data: null or JSON like { created, failed, results } }
+     */
+    async addKeys(keys) {
+
+        // Create URL
+        let url = `${process.env.REACT_APP_API_URL}/keys/bulk`;
+
+        // Send POST request
+        const response = await fetch(url, {
+            headers: {
+                "Content-Type": "application/json"
+            },
+            method: "POST",
+            credentials: "include",
+            body: JSON.stringify(keys)
+        });
+
+        // Clone response
+        const dataResponse = response.clone();
+
+        // Get the response message
+        const msg = await response.text();
+
+        // Exit if the request itself was rejected
+        if (response.status !== 200 && response.status !== 207 && !msg.startsWith("{")) {
+            console.error(msg);
+            return { ok: false, msg: msg, data: null };
+        }
+
+        // Get the per-row results
+        const data = await dataResponse.json();
+
+        // Return a json containing response status, message and data
+        return { ok: response.status === 200, msg: msg, data: data };
+    }
+
     /**
      * Update properties about a key
      * 
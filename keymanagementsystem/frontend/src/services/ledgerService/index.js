@@ -36,6 +36,51 @@ class LedgerService {
         return { ok: true, msg: msg, data: data };
     }
 
+    /**
+     * Get a single page of records, filtered by the server
+     *
+     * @param {Object} params             - The query parameters for the page
+     * @param {number} params.limit       - The page size (optional)
+     * @param {string} params.cursor      - The next_cursor from the previous page (optional)
+     * @param {string} params.sort        - "date" or "-date" (optional, newest first by default)
+     * @param {string} params.from        - The earliest date as an ISO string (optional)
+     * @param {string} params.to          - The latest date as an ISO string (optional)
+     * @param {string} params.pid         - Filter by pid (optional)
+     * @param {string} params.tag_number  - Filter by tag number (optional)
+     * @param {string} params.exchange    - Filter by exchange (optional)
+     *
+     * @return A promise containing JSON like { ok: bool, msg: str, data: null or JSON like { items, total, next_cursor } }
+     */
+    async getRecordsPage(params) {
+
+        // Create URL, skipping parameters that were not set
+        const query = new URLSearchParams(
+            Object.entries(params).filter(([_, value]) => value !== undefined && value !== null && value !== "")
+        );
+        let url = `${process.env.REACT_APP_API_URL}/ledger?${query.toString()}`;
+
+        // Send GET request
+        const response = await fetch(url, { credentials: "include" });
+
+        // Clone response
+        const dataResponse = response.clone();
+
+        // Get response message
+        let msg = await response.text();
+
+        // Exit if the response is not ok
+        if (!response.ok) {
+            console.error(msg);
+            return { ok: false, msg: msg, data: null };
+        }
+
+        // Get the data
+        const data = await dataResponse.json();
+
+        // Return a json containing response status, message and data
+        return { ok: true, msg: msg, data: data };
+    }
+
     /**
      * Get specific record in the ledger in the system
      * 
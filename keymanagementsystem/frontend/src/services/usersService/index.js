@@ -12,12 +12,17 @@ class UsersService {
     /**
      * Get all users in the system
      * 
+     * @param {Array} fields - The user fields to return, e.g. ["pid", "full_name"] (optional, defaults to all)
+     * 
      * @return A promise containing JSON like { ok: bool, msg: str, data: null or array of users JSONs }
      */
-    async getAllUsers() {
+    async getAllUsers(fields) {
 
-        // Create URL
+        // Create URL, only asking for the needed fields
         let url = `${process.env.REACT_APP_API_URL}/users`;
+        if (fields) {
+            url += `?fields=${encodeURIComponent(fields.join(","))}`;
+        }
 
         // Send GET request
         const response = await fetch(url, { credentials: "include" });
@@ -81,6 +86,49 @@ class UsersService {
         return { ok: true, msg: msg, data: data };
     }
 
+    /**
+     * Search users by name, ignoring case, as a prefix or by how it sounds
+     *
+     * @param {string} query - The name (or part of it) to search for
+     * @param {number} limit - The maximum number of users to return (optional)
+     * @param {string} cursor - The next_cursor of the previous page (optional)
+     *
+     * @return A promise containing JSON like { ok: bool, msg: str, data: null or JSON like { items, next_cursor } }
+     */
+    async searchUsers(query, limit, cursor) {
+
+        // Create URL
+        const params = new URLSearchParams({ q: query, fields: "pid,full_name,role" });
+        if (limit) {
+            params.set("limit", limit);
+        }
+        if (cursor) {
+            params.set("cursor", cursor);
+        }
+        let url = `${process.env.REACT_APP_API_URL}/users/search?${params.toString()}`;
+
+        // Send GET request
+        const response = await fetch(url, { credentials: "include" });
+
+        // Clone response
+        const dataResponse = response.clone();
+
+        // Get response message
+        let msg = await response.text();
+
+        // Exit if the response is not ok
+        if (!response.ok) {
+            console.error(msg);
+            return { ok: false, msg: msg, data: null };
+        }
+
+        // Get the data
+        const data = await dataResponse.json();
+
+        // Return a json containing response status, message and data
+        return { ok: true, msg: msg, data: data };
+    }
+
     /**
      * Get specific user in the system BY NAME
      * 
@@ -275,13 +323,15 @@ class UsersService {
     }
 
     /**
-     * Assigns a key to a user
+     * Assigns a key to a user and records the exchange in the ledger
      * @param {string} pid          - The pid to assign to
      * @param {string} tagNumber    - The tag number of the key to assign
+     * @param {string} comment      - The comment for the ledger record (optional)
      * 
-     * @return A promise containing JSON like { ok: bool, msg: str, data: null }
+     * @return A promise containing JSON like { ok: bool, msg: str, data: null, status: number }.
+     * A status of 409 means the key was not available
      */
-    async assignKey(pid, tagNumber) {
+    async assignKey(pid, tagNumber, comment = "Auto-Generated") {
 
         // Ensure a valid pid was specified
         if (pid === null || !pid.match(VALID_OR_MOCK_PID_REGEX)) {
@@ -293,7 +343,14 @@ class UsersService {
         let url = `${process.env.REACT_APP_API_URL}/users/${pid}/keys/${tagNumber}`;
 
         // Send POST request
-        const response = await fetch(url, { method: "POST", credentials: "include" });
+        const response = await fetch(url, {
+            headers: {
+                "Content-Type": "application/json"
+            },
+            method: "POST",
+            credentials: "include",
+            body: JSON.stringify({ comment: comment })
+        });
 
         // Get the response message
         const msg = await response.text();
@@ -301,11 +358,11 @@ class UsersService {
         // Exit if response is not ok
         if (!response.ok) {
             console.error(msg);
-            return { ok: false, msg: msg, data: null };
+            return { ok: false, msg: msg, data: null, status: response.status };
         }
 
         // Return a json containing response status, message and data
-        return { ok: true, msg: msg, data: null };
+        return { ok: true, msg: msg, data: null, status: response.status };
     }
 
     /**